@@ -9,10 +9,13 @@ Tor curses monitoring application.
   nyx_interface - nyx interface singleton
   tor_controller - tor connection singleton
   cache - provides our application cache
+  scheduler - provides the scheduler that runs our daemons
 
   show_message - shows a message to the user
   input_prompt - prompts the user for text input
   init_controller - initializes our connection to tor
+  batch_query - requests many GETINFO and GETCONF values together
+  controller_snapshot - provides tor's listeners, policy, and address
   expand_path - expands path with respect to our chroot
   chroot - provides the chroot path we reside within
   join - joins a series of strings up to a set length
@@ -21,10 +24,25 @@ Tor curses monitoring application.
     |- write - provides a content where we can write to the cache
     |
     |- relay_nickname - provides the nickname of a relay
-    +- relay_address - provides the address and orport of a relay
+    |- relay_address - provides the address and orport of a relay
+    |- relay_status - provides the consensus status of a relay
+    |- relays - provides all relays within the cache
+    +- lookup_stats - provides statistics about our memoized lookups
 
   CacheWriter - context in which we can write to the cache
-    +- record_relay - caches information about a relay
+    |- record_relay - caches information about a relay
+    |- record_relays - caches information about many relays at once
+    +- update_relays - applies the relays that changed between consensus
+
+  Scheduler - timer heap that wakes our daemons when their work is due
+    |- add - starts waking a task at its rate
+    |- remove - stops waking a task
+    |- set_rate - changes the rate of a task
+    +- lag - provides how late our tasks have run
+
+  ScheduledTask - work that a daemon performs at a set rate
+    |- wait - blocks until the task is due
+    +- wake - unblocks the task's waiters immediately
 
   Interface - overall nyx interface
     |- get_page - page we're showing
@@ -40,14 +58,70 @@ Tor curses monitoring application.
     |- redraw - renders our content
     |- quit - quits our application
     +- halt - stops daemon panels
+
+.. data:: CacheStats
+
+  Statistics about the memoized lookups of our :class:`~nyx.Cache`.
+
+  :var int hits: lookups answered without querying sqlite
+  :var int misses: lookups that queried sqlite
+  :var int size: number of memoized results
+  :var int generation: number of times the cache has been written to
+
+.. data:: BatchResponse
+
+  Values provided by :func:`~nyx.batch_query`.
+
+  :var dict info: GETINFO keys mapped to their value
+  :var dict conf: GETCONF keys mapped to their value
+
+.. data:: ControllerSnapshot
+
+  Tor configuration provided by :func:`~nyx.controller_snapshot`.
+
+  :var frozenset or_ports: **int** ORPorts we listen on
+  :var frozenset dir_ports: **int** DirPorts we listen on
+  :var frozenset socks_ports: **int** SocksPorts we listen on
+  :var frozenset control_ports: **int** ControlPorts we listen on
+  :var stem.exit_policy.ExitPolicy exit_policy: our exit policy, **None** if
+    unavailable
+  :var nyx.tracker.ExitPolicyMatcher exit_matcher: compiled form of our exit policy,
+    **None** if unavailable
+  :var dict hidden_service_conf: hidden service directories mapped to their
+    configuration
+  :var frozenset hidden_service_targets: (address, port) tuples our hidden
+    services forward to
+  :var str address: our external address, **None** if unknown
+  :var str fingerprint: our relay fingerprint, **None** if we're not a relay
+  :var bool is_geoip_unavailable: **True** if tor lacks geoip information
+  :var float timestamp: unix timestamp when this was fetched
+
+.. data:: RelayStatus
+
+  Consensus information about a relay within our :class:`~nyx.Cache`.
+
+  :var str fingerprint: relay fingerprint
+  :var str nickname: relay nickname
+  :var str address: ipv4 or ipv6 address
+  :var int or_port: ORPort of the relay
+  :var int dir_port: DirPort of the relay, **None** if it lacks one
+  :var datetime published: when the relay's descriptor was published
+  :var tuple flags: **str** flags the relay has
+  :var int bandwidth: consensus weight of the relay, **None** if unknown
 """
 
+import binascii
 import collections
 import contextlib
+import datetime
 import distutils.spawn
 import getpass
+import heapq
+import itertools
 import os
 import platform
+import re
+import socket
 import sys
 import threading
 import time
@@ -153,6 +227,7 @@ CONFIG = stem.util.conf.config_dict('nyx', {
 NYX_INTERFACE = None
 TOR_CONTROLLER = None
 CACHE = None
+SCHEDULER = None
 CHROOT = None
 BASE_DIR = os.path.sep.join(__file__.split(os.path.sep)[:-1])
 
@@ -168,24 +243,99 @@ stem.control.LOG_CACHE_FETCHES = False
 
 stem.response.events.PARSE_NEWCONSENSUS_EVENTS = False
 
-# Duration for threads to pause when there's no work left to do. This is a
-# compromise - lower means faster shutdown when quit but higher means lower
-# cpu usage when running.
+# Duration for threads to pause when waiting on something other than our
+# scheduler, such as initial results from a tracker.
 
 PAUSE_TIME = 0.4
 
-SCHEMA_VERSION = 2  # version of our scheme, bump this if you change the following
+# Maximum number of relay lookups the Cache memoizes, and bytes of our
+# database that sqlite may memory map.
+
+CACHE_MEMO_SIZE = 4096
+CACHE_MMAP_SIZE = 64 * 1024 * 1024
+
+CacheStats = collections.namedtuple('CacheStats', [
+  'hits',
+  'misses',
+  'size',
+  'generation',
+])
+
+BatchResponse = collections.namedtuple('BatchResponse', [
+  'info',
+  'conf',
+])
+
+ControllerSnapshot = collections.namedtuple('ControllerSnapshot', [
+  'or_ports',
+  'dir_ports',
+  'socks_ports',
+  'control_ports',
+  'exit_policy',
+  'exit_matcher',
+  'hidden_service_conf',
+  'hidden_service_targets',
+  'address',
+  'fingerprint',
+  'is_geoip_unavailable',
+  'timestamp',
+])
+
+RelayStatus = collections.namedtuple('RelayStatus', [
+  'fingerprint',
+  'nickname',
+  'address',
+  'or_port',
+  'dir_port',
+  'published',
+  'flags',
+  'bandwidth',
+])
+
+# Fingerprints and addresses are stored in their packed binary form, which is
+# under half the size of their text and quicker to index. Each full consensus
+# we record bumps the consensus_generation, and relays that weren't a part of
+# it are removed. Flags are space separated and publication times are
+# formatted as they are in the consensus.
+
+SCHEMA_VERSION = 4  # version of our scheme, bump this if you change the following
 SCHEMA = (
+  'PRAGMA auto_vacuum = INCREMENTAL',  # must precede creating tables
+
   'CREATE TABLE schema(version INTEGER)',
   'INSERT INTO schema(version) VALUES (%i)' % SCHEMA_VERSION,
 
-  'CREATE TABLE metadata(relays_updated_at REAL)',
-  'INSERT INTO metadata(relays_updated_at) VALUES (0.0)',
+  'CREATE TABLE metadata(relays_updated_at REAL, consensus_generation INTEGER)',
+  'INSERT INTO metadata(relays_updated_at, consensus_generation) VALUES (0.0, 0)',
 
-  'CREATE TABLE relays(fingerprint TEXT PRIMARY KEY, address TEXT, or_port INTEGER, nickname TEXT)',
+  'CREATE TABLE relays(fingerprint BLOB PRIMARY KEY, address BLOB, or_port INTEGER, nickname TEXT, dir_port INTEGER, published TEXT, flags TEXT, bandwidth INTEGER, generation INTEGER)',
   'CREATE INDEX addresses ON relays(address)',
 )
 
+# GETINFO keys that failed when we requested them individually. A single
+# unavailable key fails a whole multi-key request, so these are requested on
+# their own until they succeed.
+
+UNBATCHED_GETINFO = set()
+
+# Configuration that's checked for every connection we list or draw. This is
+# fetched once and kept until tor's configuration or address changes, so hot
+# loops read plain attributes rather than contending for stem's cache lock.
+
+CONTROLLER_SNAPSHOT = None
+CONTROLLER_SNAPSHOT_LOCK = threading.RLock()
+SNAPSHOT_GENERATION = 0  # bumped when invalidated, so snapshots built meanwhile aren't kept
+SNAPSHOT_LISTENING_TO = None
+EXIT_MATCHER = None  # kept while our exit policy is unchanged
+
+# Validation for bulk relay ingest. These match stem's tor_tools checks, but
+# are compiled once rather than for every relay.
+
+FINGERPRINT_PATTERN = re.compile('^[0-9a-fA-F]{40}$')
+NICKNAME_PATTERN = re.compile('^[a-zA-Z0-9]{1,19}$')
+
+RELAY_INSERT = 'INSERT OR REPLACE INTO relays(fingerprint, address, or_port, nickname, dir_port, published, flags, bandwidth, generation) VALUES (?,?,?,?,?,?,?,?,?)'
+
 
 try:
   uses_settings = stem.util.conf.uses_settings('nyx', os.path.join(BASE_DIR, 'settings'), lazy_load = False)
@@ -295,6 +445,21 @@ def cache():
   return CACHE
 
 
+def scheduler():
+  """
+  Provides the scheduler that wakes our daemons when they have work to do.
+
+  :returns: :class:`~nyx.Scheduler` for our application
+  """
+
+  global SCHEDULER
+
+  if SCHEDULER is None:
+    SCHEDULER = Scheduler()
+
+  return SCHEDULER
+
+
 def show_message(message = None, *attr, **kwargs):
   """
   Shows a message in our header.
@@ -338,6 +503,137 @@ def init_controller(*args, **kwargs):
   return TOR_CONTROLLER
 
 
+def batch_query(info = None, conf = None):
+  """
+  Requests GETINFO and GETCONF values from tor with a single request for each,
+  rather than a round trip per key.
+
+  :param dict info: GETINFO keys mapped to the default if they're unavailable
+  :param dict conf: GETCONF keys mapped to the default if they're unset
+
+  :returns: :data:`~nyx.BatchResponse` with the values of our keys
+  """
+
+  controller = tor_controller()
+  info_values, conf_values = {}, {}
+
+  if info:
+    batched = [key for key in info if key not in UNBATCHED_GETINFO]
+    unbatched = [key for key in info if key in UNBATCHED_GETINFO]
+
+    try:
+      if batched:
+        info_values = controller.get_info(batched)
+    except stem.ControllerError:
+      unbatched = list(info)  # ask for each so we know which failed
+
+    for key in unbatched:
+      try:
+        info_values[key] = controller.get_info(key)
+        UNBATCHED_GETINFO.discard(key)
+      except stem.ControllerError:
+        UNBATCHED_GETINFO.add(key)
+
+  if conf:
+    conf_values = controller.get_conf_map(list(conf), None, multiple = False)
+
+  return BatchResponse(
+    dict([(key, info_values.get(key, default)) for key, default in (info or {}).items()]),
+    dict([(key, conf_values.get(key) if conf_values.get(key) is not None else default) for key, default in (conf or {}).items()]),
+  )
+
+
+def controller_snapshot():
+  """
+  Provides the tor configuration we check for each connection, such as our
+  listening ports and exit policy. This is fetched once and refetched when
+  tor's configuration changes, it's reset, or our address may have changed.
+
+  :returns: :data:`~nyx.ControllerSnapshot` for our tor instance
+  """
+
+  global CONTROLLER_SNAPSHOT, SNAPSHOT_LISTENING_TO, EXIT_MATCHER
+
+  snapshot = CONTROLLER_SNAPSHOT
+
+  if snapshot and (time.time() - snapshot.timestamp) <= stem.control.CACHE_ADDRESS_FOR:
+    return snapshot
+
+  with CONTROLLER_SNAPSHOT_LOCK:
+    controller = tor_controller()
+    generation = SNAPSHOT_GENERATION
+
+    if SNAPSHOT_LISTENING_TO is not controller:
+      controller.add_status_listener(_invalidate_snapshot)
+
+      try:
+        controller.add_event_listener(_invalidate_snapshot, stem.control.EventType.CONF_CHANGED)
+        controller.add_event_listener(_address_changed, stem.control.EventType.STATUS_SERVER)
+      except stem.ProtocolError as exc:
+        stem.util.log.info('Unable to listen for configuration changes, our cached configuration will be refetched every %i seconds: %s' % (stem.control.CACHE_ADDRESS_FOR, exc))
+
+      SNAPSHOT_LISTENING_TO = controller
+
+    def ports(listener_type):
+      return frozenset(controller.get_ports(listener_type, []))
+
+    exit_policy = controller.get_exit_policy(None)
+
+    if exit_policy is None:
+      EXIT_MATCHER = None
+    elif EXIT_MATCHER is None or EXIT_MATCHER.policy != exit_policy:
+      EXIT_MATCHER = nyx.tracker.ExitPolicyMatcher(exit_policy)
+
+    hs_conf = controller.get_hidden_service_conf({})
+    hs_targets = set()
+
+    for hs_config in hs_conf.values():
+      for virtual_port, target_address, target_port in hs_config.get('HiddenServicePort', []):
+        if not target_port:
+          continue  # unix socket
+
+        target_address = target_address.strip('[]')
+
+        if target_address == 'localhost':
+          hs_targets.update([('127.0.0.1', target_port), ('::1', target_port)])
+        else:
+          hs_targets.add((target_address, target_port))
+
+    snapshot = ControllerSnapshot(
+      ports(stem.control.Listener.OR),
+      ports(stem.control.Listener.DIR),
+      ports(stem.control.Listener.SOCKS),
+      ports(stem.control.Listener.CONTROL),
+      exit_policy,
+      EXIT_MATCHER,
+      hs_conf,
+      frozenset(hs_targets),
+      controller.get_info('address', None),
+      controller.get_info('fingerprint', None),
+      controller.is_geoip_unavailable(),
+      time.time(),
+    )
+
+    # if tor's configuration changed while we were asking for it then this
+    # may predate the change, so provide it without keeping it
+
+    if generation == SNAPSHOT_GENERATION:
+      CONTROLLER_SNAPSHOT = snapshot
+
+    return snapshot
+
+
+def _invalidate_snapshot(*args):
+  global CONTROLLER_SNAPSHOT, SNAPSHOT_GENERATION
+  SNAPSHOT_GENERATION += 1
+  CONTROLLER_SNAPSHOT = None
+
+
+def _address_changed(event):
+  if event.action == 'EXTERNAL_ADDRESS':
+    _invalidate_snapshot()
+
+
 @uses_settings
 def data_directory(filename, config):
   path = config.get('data_directory', '~/.nyx')
@@ -454,10 +750,30 @@ class Cache(object):
     self._conn_lock = threading.RLock()
     cache_path = nyx.data_directory('cache.sqlite')
 
+    # Memoized lookup results, least recently used first. These are dropped
+    # whenever we're written to, which bumps our generation.
+
+    self._memo = collections.OrderedDict()
+    self._memo_lock = threading.RLock()
+    self._memo_hits = 0
+    self._memo_misses = 0
+    self._generation = 0
+
     if cache_path and os.path.isfile(cache_path) and not os.access(cache_path, os.W_OK):
       stem.util.log.notice("Nyx's cache at %s is not writable by our user (%s). That's ok, but we'll have better performance if we can write to it." % (cache_path, getpass.getuser()))
       cache_path = None
 
+    # On disk caches are written through our shared connection, but each
+    # thread reads through its own read-only connection. In WAL mode readers
+    # see the last commit rather than waiting on the writer, so lookups don't
+    # stall while a consensus is being ingested. In-memory databases can't be
+    # shared between connections, so those use our shared connection for
+    # everything.
+
+    self._path = None
+    self._readers = threading.local()
+    self._vacuum_pending = False
+
     if cache_path:
       try:
         self._conn = sqlite3.connect(cache_path, check_same_thread = False)
@@ -474,11 +790,25 @@ class Cache(object):
           stem.util.log.info('Cache at %s has schema version %s but the current version is %s, clearing it.' % (cache_path, schema, SCHEMA_VERSION))
 
         self._conn.close()
-        os.remove(cache_path)
+
+        for path in (cache_path, cache_path + '-wal', cache_path + '-shm'):
+          if os.path.exists(path):
+            os.remove(path)
+
         self._conn = sqlite3.connect(cache_path, check_same_thread = False)
 
         for cmd in SCHEMA:
           self._conn.execute(cmd)
+
+        self._conn.commit()
+
+      try:
+        if self._conn.execute('PRAGMA journal_mode = WAL').fetchone()[0].lower() == 'wal':
+          self._conn.execute('PRAGMA synchronous = NORMAL')  # durable enough for a cache when using WAL
+          self._conn.execute('PRAGMA mmap_size = %i' % CACHE_MMAP_SIZE)
+          self._path = cache_path
+      except sqlite3.Error as exc:
+        stem.util.log.info('Unable to use WAL mode for our cache, reads will wait on writes (%s)' % exc)
     else:
       stem.util.log.info('Unable to cache to disk. Using an in-memory cache instead.')
       self._conn = sqlite3.connect(':memory:', check_same_thread = False)
@@ -494,8 +824,21 @@ class Cache(object):
     :returns: :class:`~nyx.CacheWriter` that can modify the cache
     """
 
-    with self._conn:
-      yield CacheWriter(self)
+    try:
+      with self._conn:
+        yield CacheWriter(self)
+
+      if self._vacuum_pending:
+        # Releases the pages of relays we've removed. This needs to be run to
+        # completion outside a transaction, which executescript() does.
+
+        with self._conn_lock:
+          self._vacuum_pending = False
+          self._conn.executescript('PRAGMA incremental_vacuum;')
+    finally:
+      with self._memo_lock:
+        self._generation += 1
+        self._memo.clear()
 
   def relays_for_address(self, address):
     """
@@ -506,12 +849,15 @@ class Cache(object):
     :returns: **dict** of ORPorts to their fingerprint
     """
 
-    result = {}
+    def query():
+      packed_address = _pack_address(address)
 
-    for entry in self._query('SELECT or_port, fingerprint FROM relays WHERE address=?', address).fetchall():
-      result[entry[0]] = entry[1]
+      if packed_address is None:
+        return {}
 
-    return result
+      return dict([(or_port, _unpack_fingerprint(fingerprint)) for or_port, fingerprint in self._query('SELECT or_port, fingerprint FROM relays WHERE address=?', sqlite3.Binary(packed_address)).fetchall()])
+
+    return dict(self._memoized('relays_for_address', address, query))
 
   def relay_nickname(self, fingerprint, default = None):
     """
@@ -523,8 +869,13 @@ class Cache(object):
     :returns: **str** with the nickname ("Unnamed" if unset)
     """
 
-    result = self._query('SELECT nickname FROM relays WHERE fingerprint=?', fingerprint).fetchone()
-    return result[0] if result else default
+    def query():
+      packed_fingerprint = _pack_fingerprint(fingerprint)
+      result = self._query('SELECT nickname FROM relays WHERE fingerprint=?', packed_fingerprint).fetchone() if packed_fingerprint else None
+      return result[0] if result else None
+
+    result = self._memoized('relay_nickname', fingerprint, query)
+    return result if result is not None else default
 
   def relay_address(self, fingerprint, default = None):
     """
@@ -536,9 +887,59 @@ class Cache(object):
     :returns: **tuple** with a **str** address and **int** port
     """
 
-    result = self._query('SELECT address, or_port FROM relays WHERE fingerprint=?', fingerprint).fetchone()
+    def query():
+      packed_fingerprint = _pack_fingerprint(fingerprint)
+      result = self._query('SELECT address, or_port FROM relays WHERE fingerprint=?', packed_fingerprint).fetchone() if packed_fingerprint else None
+      return (_unpack_address(result[0]), result[1]) if result else None
+
+    result = self._memoized('relay_address', fingerprint, query)
+    return result if result else default
+
+  def relay_status(self, fingerprint, default = None):
+    """
+    Provides the consensus information we have for a relay.
+
+    :param str fingerprint: relay to look up
+    :param str default: response if no such relay exists
+
+    :returns: :data:`~nyx.RelayStatus` of the relay
+    """
+
+    def query():
+      packed_fingerprint = _pack_fingerprint(fingerprint)
+      result = self._query('SELECT nickname, address, or_port, dir_port, published, flags, bandwidth FROM relays WHERE fingerprint=?', packed_fingerprint).fetchone() if packed_fingerprint else None
+
+      if not result:
+        return None
+
+      nickname, address, or_port, dir_port, published, flags, bandwidth = result
+
+      try:
+        published = datetime.datetime.strptime(published, '%Y-%m-%d %H:%M:%S') if published else None
+      except ValueError:
+        published = None
+
+      return RelayStatus(fingerprint.upper(), nickname, _unpack_address(address), or_port, dir_port, published, tuple(flags.split()) if flags else (), bandwidth)
+
+    result = self._memoized('relay_status', fingerprint, query)
     return result if result else default
 
+  def relays(self, include_status = False):
+    """
+    Provides all relays within our cache.
+
+    :param bool include_status: provides the relays' consensus status as well
+
+    :returns: **list** of (fingerprint, address, or_port, nickname) tuples, or
+      (fingerprint, address, or_port, nickname, dir_port, published, flags,
+      bandwidth) if we're including their status
+    """
+
+    if not include_status:
+      return [(_unpack_fingerprint(fingerprint), _unpack_address(address), or_port, nickname) for fingerprint, address, or_port, nickname in self._query('SELECT fingerprint, address, or_port, nickname FROM relays').fetchall()]
+
+    return [(_unpack_fingerprint(fingerprint), _unpack_address(address), or_port, nickname, dir_port, published, tuple(flags.split()) if flags else (), bandwidth) for fingerprint, address, or_port, nickname, dir_port, published, flags, bandwidth in self._query('SELECT fingerprint, address, or_port, nickname, dir_port, published, flags, bandwidth FROM relays').fetchall()]
+
   def relays_updated_at(self):
     """
     Provides the unix timestamp when relay information was last updated.
@@ -549,20 +950,95 @@ class Cache(object):
 
     return self._query('SELECT relays_updated_at FROM metadata').fetchone()[0]
 
+  def lookup_stats(self):
+    """
+    Provides statistics about our memoized lookups.
+
+    :returns: :data:`~nyx.CacheStats` for our lookups
+    """
+
+    with self._memo_lock:
+      return CacheStats(self._memo_hits, self._memo_misses, len(self._memo), self._generation)
+
+  def _memoized(self, lookup, param, query):
+    """
+    Provides the memoized result of a lookup, running the query if we don't
+    have it.
+    """
+
+    key = (lookup, param)
+
+    with self._memo_lock:
+      try:
+        result = self._memo.pop(key)
+        self._memo[key] = result  # most recently used
+        self._memo_hits += 1
+        return result
+      except KeyError:
+        self._memo_misses += 1
+        generation = self._generation
+
+    result = query()
+
+    with self._memo_lock:
+      if generation == self._generation:  # don't memoize if a write raced us
+        self._memo[key] = result
+
+        while len(self._memo) > CACHE_MEMO_SIZE:
+          self._memo.popitem(last = False)
+
+    return result
+
   def _query(self, query, *param):
     """
     Performs a query on our cache.
     """
 
+    reader = self._reader()
+
+    if reader is None:
+      with self._conn_lock:
+        return self._conn.execute(query, param)
+
+    # Results are read in full so the statement doesn't hold open a read
+    # snapshot, which would hide later commits from this connection.
+
+    return _Rows(reader.execute(query, param).fetchall())
+
+  def _write(self, query, *param):
+    """
+    Performs a modification of our cache.
+    """
+
     with self._conn_lock:
       return self._conn.execute(query, param)
 
+  def _reader(self):
+    """
+    Provides the read-only connection of this thread, or **None** if reads
+    should use our shared connection. Queries are cached per-connection, so
+    our lookups are only prepared once per thread.
+    """
+
+    if self._path is None:
+      return None
+
+    reader = getattr(self._readers, 'conn', None)
+
+    if reader is None:
+      reader = sqlite3.connect(self._path, cached_statements = 32)
+      reader.execute('PRAGMA query_only = ON')
+      reader.execute('PRAGMA mmap_size = %i' % CACHE_MMAP_SIZE)
+      self._readers.conn = reader
+
+    return reader
+
 
 class CacheWriter(object):
   def __init__(self, cache):
     self._cache = cache
 
-  def record_relay(self, fingerprint, address, or_port, nickname):
+  def record_relay(self, fingerprint, address, or_port, nickname, dir_port = None, published = None, flags = None, bandwidth = None):
     """
     Records relay metadata.
 
@@ -570,6 +1046,11 @@ class CacheWriter(object):
     :param str address: ipv4 or ipv6 address
     :param int or_port: ORPort of the relay
     :param str nickname: relay nickname
+    :param int dir_port: DirPort of the relay
+    :param str published: publication time of the relay's descriptor, formatted
+      as it is in the consensus ('YYYY-MM-DD HH:MM:SS')
+    :param list flags: flags the relay has
+    :param int bandwidth: consensus weight of the relay
 
     :raises: **ValueError** if provided data is malformed
     """
@@ -582,9 +1063,349 @@ class CacheWriter(object):
       raise ValueError("'%s' isn't a valid address" % address)
     elif not stem.util.connection.is_valid_port(or_port):
       raise ValueError("'%s' isn't a valid port" % or_port)
+    elif dir_port is not None and not stem.util.connection.is_valid_port(dir_port):
+      raise ValueError("'%s' isn't a valid port" % dir_port)
+
+    with self._cache._conn_lock:
+      generation = self._cache._write('SELECT consensus_generation FROM metadata').fetchone()[0]
+      relay = (fingerprint, address, int(or_port), nickname, int(dir_port) if dir_port is not None else None, published, tuple(flags) if flags else (), bandwidth)
+      self._cache._write(RELAY_INSERT, *_relay_row(relay, generation))
+      self._cache._write('UPDATE metadata SET relays_updated_at=?', time.time())
+
+  def record_relays(self, relays, is_complete = True):
+    """
+    Records metadata for many relays at once, such as a full consensus. Relays
+    are validated together and written with a single statement, so this is far
+    quicker than calling :func:`~nyx.CacheWriter.record_relay` for each.
+
+    A complete update replaces our prior relays, so relays that aren't a part
+    of it are removed from the cache.
+
+    :param list relays: (fingerprint, address, or_port, nickname) tuples,
+      optionally followed by their (dir_port, published, flags, bandwidth)
+    :param bool is_complete: if **False** these are only part of an update,
+      so we shouldn't mark our relay information as being updated or remove
+      relays yet
+
+    :returns: **int** number of relays recorded, malformed entries are skipped
+    """
+
+    with self._cache._conn_lock:
+      generation = self._cache._write('SELECT consensus_generation FROM metadata').fetchone()[0] + 1
+      rows = [_relay_row(relay, generation) for relay in relays]
+      rows = [row for row in rows if row is not None]
+
+      if len(rows) != len(relays):
+        stem.util.log.info('Skipped %i malformed relays when updating our cache.' % (len(relays) - len(rows)))
+
+      self._cache._conn.executemany(RELAY_INSERT, rows)
+
+      if is_complete:
+        self._cache._write('UPDATE metadata SET relays_updated_at=?, consensus_generation=?', time.time(), generation)
+        removed = self._cache._write('DELETE FROM relays WHERE generation < ?', generation).rowcount
+
+        if removed > 0:
+          self._cache._vacuum_pending = True
+          stem.util.log.info('Removed %i relays that are no longer in the consensus from our cache.' % removed)
+
+    return len(rows)
+
+  def update_relays(self, changed, removed, is_complete = True):
+    """
+    Applies the relays that changed between consensus. Unlike
+    :func:`~nyx.CacheWriter.record_relays` relays that aren't provided are
+    left alone, so only new or changed relays need to be written.
+
+    :param list changed: relay tuples, as with
+      :func:`~nyx.CacheWriter.record_relays`, that are new or changed
+    :param list removed: fingerprints of relays that have left the consensus
+    :param bool is_complete: if **False** these are only part of an update,
+      so we shouldn't mark our relay information as being updated yet
+
+    :returns: **int** number of relays recorded, malformed entries are skipped
+    """
+
+    with self._cache._conn_lock:
+      generation = self._cache._write('SELECT consensus_generation FROM metadata').fetchone()[0]
+      rows = [_relay_row(relay, generation) for relay in changed]
+      rows = [row for row in rows if row is not None]
+
+      if len(rows) != len(changed):
+        stem.util.log.info('Skipped %i malformed relays when updating our cache.' % (len(changed) - len(rows)))
+
+      self._cache._conn.executemany(RELAY_INSERT, rows)
+      self._cache._conn.executemany('DELETE FROM relays WHERE fingerprint=?', [(_pack_fingerprint(fingerprint),) for fingerprint in removed])
+
+      if is_complete:
+        self._cache._write('UPDATE metadata SET relays_updated_at=?', time.time())
+
+    return len(rows)
+
+
+class _Rows(list):
+  """
+  Query results that have been read in full, with the cursor methods we use.
+  """
+
+  def fetchone(self):
+    return self[0] if self else None
+
+  def fetchall(self):
+    return list(self)
+
+
+def _relay_row(relay, generation):
+  """
+  Provides the relays table row for relay metadata, packing the fingerprint and
+  address. These checks are equivalent to those of
+  :func:`~nyx.CacheWriter.record_relay`, but cheaper.
+
+  :param tuple relay: (fingerprint, address, or_port, nickname) of the relay,
+    optionally followed by its (dir_port, published, flags, bandwidth)
+  :param int generation: consensus generation the relay belongs to
+
+  :returns: **tuple** for the row, **None** if the metadata is malformed
+  """
+
+  if len(relay) < 8:
+    relay = tuple(relay) + (None,) * (8 - len(relay))
+
+  fingerprint, address, or_port, nickname, dir_port, published, flags, bandwidth = relay
+
+  if not FINGERPRINT_PATTERN.match(fingerprint) or not NICKNAME_PATTERN.match(nickname):
+    return None
+  elif not isinstance(or_port, int) or not 0 < or_port <= 65535:
+    return None
+  elif dir_port is not None and (not isinstance(dir_port, int) or not 0 < dir_port <= 65535):
+    return None
+
+  packed_address = _pack_address(address)
+
+  if packed_address is None:
+    return None
+
+  return (_pack_fingerprint(fingerprint), sqlite3.Binary(packed_address), or_port, nickname, dir_port, published, ' '.join(flags) if flags else None, bandwidth, generation)
+
+
+def _pack_fingerprint(fingerprint):
+  """
+  Provides the binary form of a hex fingerprint, **None** if malformed.
+  """
+
+  if not fingerprint or not FINGERPRINT_PATTERN.match(fingerprint):
+    return None
+
+  return sqlite3.Binary(binascii.unhexlify(fingerprint))
+
+
+def _unpack_fingerprint(packed_fingerprint):
+  return binascii.hexlify(bytes(packed_fingerprint)).upper().decode('ascii')
+
+
+def _pack_address(address):
+  """
+  Provides the packed binary form of an IPv4 or IPv6 address.
+
+  :param str address: address to be packed
+
+  :returns: **bytes** for the address, **None** if it's malformed
+  """
+
+  try:
+    return socket.inet_pton(socket.AF_INET6 if ':' in address else socket.AF_INET, address)
+  except (socket.error, TypeError, ValueError):
+    return None
+
+
+def _address_value(address):
+  """
+  Provides the integer value of an IPv4 or IPv6 address.
+
+  :param str address: address to be converted
+
+  :returns: **int** for the address, **None** if it's malformed
+  """
+
+  packed_address = _pack_address(address)
+  return None if packed_address is None else int(binascii.hexlify(packed_address), 16)
+
+
+def _unpack_address(packed_address):
+  packed_address = bytes(packed_address)
+  return socket.inet_ntop(socket.AF_INET if len(packed_address) == 4 else socket.AF_INET6, packed_address)
+
+
+class ScheduledTask(object):
+  """
+  Work that a daemon performs at a set rate. Daemons block on :func:`wait`
+  until our :class:`~nyx.Scheduler` signals the task is due, rather than
+  polling.
+
+  :var str name: description of the task
+  :var float rate: seconds between runs of the task
+  :var float lag: seconds our last run started after it was due
+  :var float max_lag: largest lag we've had
+  """
+
+  def __init__(self, name, rate):
+    self.name = name
+    self.rate = rate
+    self.lag = 0.0
+    self.max_lag = 0.0
+
+    self._cond = threading.Condition()
+    self._is_woken = False  # set until the waiting daemon picks up our wakeup
+    self._due = None  # when we were last due to run
+    self._heap_id = None  # identifies our present entry in the scheduler heap
+
+  def wait(self, timeout = None):
+    """
+    Blocks until the task is due or :func:`~nyx.ScheduledTask.wake` is called.
+
+    :param float timeout: maximum seconds to wait, indefinitely if **None**
+
+    :returns: **True** if we were woken and **False** if we timed out
+    """
+
+    # Our wakeup is consumed under the same lock the scheduler fires with, so
+    # a run that comes due while we're returning can't be dropped.
+
+    with self._cond:
+      wait_until = None if timeout is None else time.time() + timeout
+
+      while not self._is_woken:
+        if wait_until is None:
+          self._cond.wait()
+        elif time.time() < wait_until:
+          self._cond.wait(wait_until - time.time())
+        else:
+          return False
+
+      self._is_woken = False
+
+      if self._due is not None:
+        self.lag = max(0.0, time.time() - self._due)
+        self.max_lag = max(self.max_lag, self.lag)
+        self._due = None
+
+      return True
+
+  def wake(self):
+    """
+    Unblocks anything waiting on this task, such as when it should stop.
+    """
+
+    with self._cond:
+      self._is_woken = True
+      self._cond.notify_all()
+
+  def _fire(self, due):
+    with self._cond:
+      self._due = due
+      self._is_woken = True
+      self._cond.notify_all()
+
+
+class Scheduler(object):
+  """
+  Heap of tasks ordered by when they're next due. A single thread sleeps until
+  the earliest is due then wakes the daemon waiting on it, so idle daemons
+  don't wake up and tasks run on a fixed schedule without drifting.
+  """
+
+  def __init__(self):
+    self._heap = []  # (due, heap_id, task) tuples
+    self._heap_ids = itertools.count()
+    self._cond = threading.Condition()
+    self._tasks = set()
+    self._thread = None
+
+  def add(self, task, delay = 0):
+    """
+    Starts waking a task at its rate.
+
+    :param nyx.ScheduledTask task: task to be scheduled
+    :param float delay: seconds until the task is first due
+    """
+
+    with self._cond:
+      self._tasks.add(task)
+      self._push(task, time.time() + delay)
+
+      if self._thread is None:
+        self._thread = threading.Thread(target = self._run, name = 'nyx scheduler')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+  def remove(self, task):
+    """
+    Stops waking a task.
+
+    :param nyx.ScheduledTask task: task to be unscheduled
+    """
+
+    with self._cond:
+      self._tasks.discard(task)
+      task._heap_id = None  # invalidates its heap entry
+
+  def set_rate(self, task, rate):
+    """
+    Changes how frequently a task is due. Its next run is moved to reflect the
+    new rate.
+
+    :param nyx.ScheduledTask task: task to be adjusted
+    :param float rate: seconds between runs of the task
+    """
+
+    with self._cond:
+      previous_rate, task.rate = task.rate, rate
+
+      if task in self._tasks:
+        for due, heap_id, entry in self._heap:
+          if entry is task and heap_id == task._heap_id:
+            self._push(task, max(time.time(), due - previous_rate + rate))
+            break
+
+  def lag(self):
+    """
+    Provides how late our tasks have started relative to when they were due.
+
+    :returns: **dict** mapping task names to a (last_lag, max_lag) tuple
+    """
+
+    with self._cond:
+      return dict([(task.name, (task.lag, task.max_lag)) for task in self._tasks])
+
+  def _push(self, task, due):
+    task._heap_id = next(self._heap_ids)
+    heapq.heappush(self._heap, (due, task._heap_id, task))
+    self._cond.notify()
+
+  def _run(self):
+    with self._cond:
+      while True:
+        while self._heap and self._heap[0][1] != self._heap[0][2]._heap_id:
+          heapq.heappop(self._heap)  # removed or rescheduled task
+
+        if not self._heap:
+          self._cond.wait()
+          continue
+
+        due, _, task = self._heap[0]
+        now = time.time()
+
+        if due > now:
+          self._cond.wait(due - now)
+          continue
+
+        heapq.heappop(self._heap)
+        task._fire(due)
+
+        # Schedule relative to when we were due so we don't drift. If we've
+        # fallen a full period behind then skip ahead rather than bursting.
 
-    self._cache._query('INSERT OR REPLACE INTO relays(fingerprint, address, or_port, nickname) VALUES (?,?,?,?)', fingerprint, address, or_port, nickname)
-    self._cache._query('UPDATE metadata SET relays_updated_at=?', time.time())
+        next_due = due + task.rate
+        self._push(task, next_due if next_due > now else now + task.rate)
 
 
 class Interface(object):
@@ -780,3 +1601,4 @@ import nyx.panel.log
 import nyx.panel.torrc
 import nyx.popups
 import nyx.starter
+import nyx.tracker
@@ -1087,14 +1087,16 @@ class CursorScroller(object):
 
       selected, scroll = my_scroller.selection(content, page_height)
 
-    :param list content: content the scroller is tracking
+    :param list content: content the scroller is tracking, this can be any
+      sequence that provides an index() method
     :param int page_height: height visible on the page
 
     :returns: **tuple** of the form **(cursor, scroll)**, the cursor is
       **None** if content is empty
     """
 
-    content = list(content)  # shallow copy for thread safety
+    if isinstance(content, list):
+      content = list(content)  # shallow copy for thread safety
 
     if not content:
       self._cursor_location = 0
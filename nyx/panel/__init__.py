@@ -29,7 +29,6 @@ Panels consisting the nyx interface.
 import collections
 import inspect
 import threading
-import time
 
 import nyx
 import nyx.curses
@@ -189,7 +188,7 @@ class DaemonPanel(Panel, threading.Thread):
     self.setDaemon(True)
 
     self._halt = False  # terminates thread if true
-    self._update_rate = update_rate
+    self._scheduled = nyx.ScheduledTask(type(self).__name__, update_rate)
 
   def _update(self):
     pass
@@ -199,19 +198,16 @@ class DaemonPanel(Panel, threading.Thread):
     Performs our _update() action at the given rate.
     """
 
-    last_ran = None
+    nyx.scheduler().add(self._scheduled)
 
-    while not self._halt:
-      if last_ran and time.time() - last_ran < self._update_rate:
-        sleep_until = last_ran + self._update_rate + 0.1
+    try:
+      while not self._halt:
+        self._scheduled.wait()
 
-        while not self._halt and time.time() < sleep_until:
-          time.sleep(nyx.PAUSE_TIME)
-
-        continue  # done waiting, try again
-
-      self._update()
-      last_ran = time.time()
+        if not self._halt:
+          self._update()
+    finally:
+      nyx.scheduler().remove(self._scheduled)
 
   def stop(self):
     """
@@ -219,3 +215,4 @@ class DaemonPanel(Panel, threading.Thread):
     """
 
     self._halt = True
+    self._scheduled.wake()
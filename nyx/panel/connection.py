@@ -5,9 +5,9 @@
 Listing of the currently established connections tor has made.
 """
 
+import bisect
 import collections
 import curses
-import itertools
 import re
 import time
 
@@ -17,27 +17,26 @@ import nyx.panel
 import nyx.popups
 import nyx.tracker
 
-from nyx import nyx_interface, tor_controller
+from nyx import nyx_interface, tor_controller, controller_snapshot
 from nyx.curses import WHITE, NORMAL, BOLD, HIGHLIGHT
 from nyx.menu import MenuItem, Submenu, RadioMenuItem, RadioGroup
 
-from stem.control import Listener
-from stem.util import datetime_to_unix, conf, connection, enum, str_tools
+from stem.util import datetime_to_unix, conf, connection, enum, log, str_tools
 
 # height of the detail panel content, not counting top and bottom border
 
 DETAILS_HEIGHT = 7
 
 EXIT_USAGE_WIDTH = 15
+DESCRIPTOR_PREFETCH = 3  # lines to either side of our selection with descriptors we prefetch
 UPDATE_RATE = 5  # rate in seconds at which we refresh
 
 # cached information from our last _update() call
 
-LAST_RETRIEVED_HS_CONF = None
 LAST_RETRIEVED_CIRCUITS = None
 
 ENTRY_CACHE = {}
-ENTRY_CACHE_REFERENCED = {}
+ENTRY_CACHE_REFERENCED = {}  # circuits => last referenced, connections are evicted when they close
 
 # Connection Categories:
 #   Inbound      Relay connection, coming to us.
@@ -53,6 +52,16 @@ Category = enum.Enum('INBOUND', 'OUTBOUND', 'EXIT', 'HIDDEN', 'SOCKS', 'CIRCUIT'
 SortAttr = enum.Enum('CATEGORY', 'UPTIME', 'IP_ADDRESS', 'PORT', 'FINGERPRINT', 'NICKNAME', 'COUNTRY')
 LineType = enum.Enum('CONNECTION', 'CIRCUIT_HEADER', 'CIRCUIT')
 
+# Time in seconds each stage of classifying a batch of connections took.
+
+ClassifyStats = collections.namedtuple('ClassifyStats', [
+  'connections',
+  'relay_time',
+  'category_time',
+  'locale_time',
+  'entry_time',
+])
+
 Line = collections.namedtuple('Line', [
   'entry',
   'line_type',
@@ -80,12 +89,24 @@ CONFIG = conf.config_dict('nyx', {
 
 class Entry(object):
   @staticmethod
-  def from_connection(connection):
-    if connection not in ENTRY_CACHE:
-      ENTRY_CACHE[connection] = ConnectionEntry(connection)
+  def from_connections(connections):
+    """
+    Provides entries for a batch of connections. Those we lack are classified
+    together, sharing their relay, exit policy, and locale lookups. These
+    are cached until the caller evicts them when tor's connection closes,
+    rather than expiring with our unreferenced entries.
 
-    ENTRY_CACHE_REFERENCED[connection] = time.time()
-    return ENTRY_CACHE[connection]
+    :param list connections: connections to provide entries for
+
+    :returns: **tuple** of the form (entries, stats) with **list** of entries
+      for our connections and :data:`~nyx.panel.connection.ClassifyStats`
+      for the ones we classified
+    """
+
+    entries, stats = _classify([conn for conn in connections if conn not in ENTRY_CACHE])
+    ENTRY_CACHE.update(entries)
+
+    return [ENTRY_CACHE[conn] for conn in connections], stats
 
   @staticmethod
   def from_circuit(circuit):
@@ -99,6 +120,7 @@ class Entry(object):
     self._lines = None
     self._type = None
     self._is_private_val = None
+    self._sort_key = None  # tuple of the form (sort order, key)
 
   def get_lines(self):
     """
@@ -171,75 +193,46 @@ class Entry(object):
     else:
       return ''
 
-  def _get_lines(self):
-    raise NotImplementedError('should be implemented by subclasses')
-
-  def _get_type(self):
-    raise NotImplementedError('should be implemented by subclasses')
-
-  def _is_private(self):
-    raise NotImplementedError('should be implemented by subclasses')
+  def sort_key(self, sort_order):
+    """
+    Provides the values we're sorted by. These don't change, so this is cached
+    until we're asked for a different ordering.
 
+    :param list sort_order: **SortAttr** we're ordered by
 
-class ConnectionEntry(Entry):
-  def __init__(self, connection):
-    super(ConnectionEntry, self).__init__()
-    self._connection = connection
+    :returns: **tuple** that's comparable with the keys of other entries
+    """
 
-  def _get_lines(self):
-    fingerprint, nickname = None, None
+    sort_order = tuple(sort_order)
 
-    if self.get_type() in (Category.OUTBOUND, Category.CIRCUIT, Category.DIRECTORY, Category.EXIT):
-      fingerprint = nyx.tracker.get_consensus_tracker().get_relay_fingerprints(self._connection.remote_address).get(self._connection.remote_port)
+    if self._sort_key is None or self._sort_key[0] != sort_order:
+      self._sort_key = (sort_order, tuple([self.sort_value(attr) for attr in sort_order]))
 
-      if fingerprint:
-        nickname = nyx.tracker.get_consensus_tracker().get_relay_nickname(fingerprint)
+    return self._sort_key[1]
 
-    locale = tor_controller().get_info('ip-to-country/%s' % self._connection.remote_address, None)
-    return [Line(self, LineType.CONNECTION, self._connection, None, fingerprint, nickname, locale)]
+  def _get_lines(self):
+    raise NotImplementedError('should be implemented by subclasses')
 
   def _get_type(self):
-    controller = tor_controller()
-
-    if self._connection.local_port in controller.get_ports(Listener.OR, []):
-      return Category.INBOUND
-    elif self._connection.local_port in controller.get_ports(Listener.DIR, []):
-      return Category.INBOUND
-    elif self._connection.local_port in controller.get_ports(Listener.SOCKS, []):
-      return Category.SOCKS
-    elif self._connection.local_port in controller.get_ports(Listener.CONTROL, []):
-      return Category.CONTROL
-
-    if LAST_RETRIEVED_HS_CONF:
-      for hs_config in LAST_RETRIEVED_HS_CONF.values():
-        if self._connection.remote_port == hs_config['HiddenServicePort']:
-          return Category.HIDDEN
-
-    fingerprint = nyx.tracker.get_consensus_tracker().get_relay_fingerprints(self._connection.remote_address).get(self._connection.remote_port)
-    exit_policy = controller.get_exit_policy(None)
-
-    if fingerprint and LAST_RETRIEVED_CIRCUITS:
-      for circ in LAST_RETRIEVED_CIRCUITS:
-        if circ.path and len(circ.path) == 1 and circ.path[0][0] == fingerprint and circ.status == 'BUILT':
-          return Category.DIRECTORY  # one-hop circuit to retrieve directory information
-    elif not fingerprint and exit_policy and exit_policy.can_exit_to(self._connection.remote_address, self._connection.remote_port):
-      return Category.EXIT
-
-    return Category.OUTBOUND
+    raise NotImplementedError('should be implemented by subclasses')
 
   def _is_private(self):
-    if not CONFIG['show_addresses']:
-      return True
+    raise NotImplementedError('should be implemented by subclasses')
 
-    if self.get_type() == Category.INBOUND:
-      return len(nyx.tracker.get_consensus_tracker().get_relay_fingerprints(self._connection.remote_address)) == 0
-    elif self.get_type() == Category.EXIT:
-      # DNS connections exiting us aren't private (since they're hitting our
-      # resolvers). Everything else is.
 
-      return not (self._connection.remote_port == 53 and self._connection.protocol == 'udp')
+class ConnectionEntry(Entry):
+  """
+  Connection tor has established. These are built by
+  :func:`~nyx.panel.connection._classify`, which determines their category,
+  relay, locale, and privacy.
+  """
 
-    return False  # for everything else this isn't a concern
+  def __init__(self, connection, category, is_private, fingerprint = None, nickname = None, locale = None):
+    super(ConnectionEntry, self).__init__()
+    self._connection = connection
+    self._type = category
+    self._is_private_val = is_private
+    self._lines = [Line(self, LineType.CONNECTION, connection, None, fingerprint, nickname, locale)]
 
 
 class CircuitEntry(Entry):
@@ -256,12 +249,16 @@ class CircuitEntry(Entry):
         address, port = consensus_tracker.get_relay_address(fingerprint, ('192.168.0.1', 0))
         nickname = consensus_tracker.get_relay_nickname(fingerprint)
 
-      locale = tor_controller().get_info('ip-to-country/%s' % address, None)
       connection = nyx.tracker.Connection(datetime_to_unix(self._circuit.created), False, '127.0.0.1', 0, address, port, 'tcp', False)
-      return Line(self, line_type, connection, self._circuit, fingerprint, nickname, locale)
+      return Line(self, line_type, connection, self._circuit, fingerprint, nickname, None)
 
     header_line = line(self._circuit.path[-1][0] if self._circuit.status == 'BUILT' else None, LineType.CIRCUIT_HEADER)
-    return [header_line] + [line(fp, LineType.CIRCUIT) for fp, _ in self._circuit.path]
+    lines = [header_line] + [line(fp, LineType.CIRCUIT) for fp, _ in self._circuit.path]
+
+    # locales of our hops are looked up together
+
+    locales = nyx.tracker.get_locale_tracker().get_locales([line.connection.remote_address for line in lines])
+    return [line._replace(locale = locales.get(line.connection.remote_address)) for line in lines]
 
   def _get_type(self):
     return Category.CIRCUIT
@@ -270,6 +267,152 @@ class CircuitEntry(Entry):
     return False
 
 
+def _classify(connections):
+  """
+  Determines the category, relay, locale, and privacy of many connections in a
+  single pass. Each distinct address is only looked up once, and our listening
+  ports are checked against the frozensets of our controller snapshot.
+
+  :param list connections: connections to be classified
+
+  :returns: **tuple** of the form (entries, stats) with a **dict** of
+    connections to their :class:`~nyx.panel.connection.ConnectionEntry` and
+    :data:`~nyx.panel.connection.ClassifyStats` for how long this took
+  """
+
+  start_time = time.time()
+  consensus_tracker = nyx.tracker.get_consensus_tracker()
+
+  relays = dict([(address, consensus_tracker.get_relay_fingerprints(address)) for address in set([conn.remote_address for conn in connections])])
+  fingerprints = dict([(conn, relays[conn.remote_address].get(conn.remote_port)) for conn in connections])
+  nicknames = dict([(fp, consensus_tracker.get_relay_nickname(fp)) for fp in set(fingerprints.values()) if fp])
+
+  relay_time = time.time()
+
+  snapshot = controller_snapshot()
+  inbound_ports = snapshot.or_ports | snapshot.dir_ports
+
+  # directory fetches are made through established one-hop circuits
+
+  directory_fingerprints = set([circ.path[0][0] for circ in (LAST_RETRIEVED_CIRCUITS or []) if circ.path and len(circ.path) == 1 and circ.status == 'BUILT'])
+  categories = {}
+
+  for conn in connections:
+    if conn.local_port in inbound_ports:
+      category = Category.INBOUND
+    elif conn.local_port in snapshot.socks_ports:
+      category = Category.SOCKS
+    elif conn.local_port in snapshot.control_ports:
+      category = Category.CONTROL
+    elif (conn.remote_address, conn.remote_port) in snapshot.hidden_service_targets:
+      category = Category.HIDDEN
+    elif fingerprints[conn]:
+      category = Category.DIRECTORY if fingerprints[conn] in directory_fingerprints else Category.OUTBOUND
+    elif snapshot.exit_matcher:
+      category = Category.EXIT if snapshot.exit_matcher.can_exit_to(conn.remote_address, conn.remote_port) else Category.OUTBOUND
+    else:
+      category = Category.OUTBOUND
+
+    categories[conn] = category
+
+  category_time = time.time()
+  locales = nyx.tracker.get_locale_tracker().get_locales(list(relays.keys()))
+  locale_time = time.time()
+
+  show_addresses = CONFIG['show_addresses']
+  entries = {}
+
+  for conn in connections:
+    category = categories[conn]
+    fingerprint = fingerprints[conn] if category in (Category.OUTBOUND, Category.DIRECTORY, Category.EXIT) else None
+
+    if not show_addresses:
+      is_private = True
+    elif category == Category.INBOUND:
+      is_private = not relays[conn.remote_address]
+    elif category == Category.EXIT:
+      is_private = not (conn.remote_port == 53 and conn.protocol == 'udp')
+    else:
+      is_private = False
+
+    entries[conn] = ConnectionEntry(conn, category, is_private, fingerprint, nicknames.get(fingerprint), locales.get(conn.remote_address))
+
+  entry_time = time.time()
+
+  return entries, ClassifyStats(len(connections), relay_time - start_time, category_time - relay_time, locale_time - category_time, entry_time - locale_time)
+
+
+class LineModel(object):
+  """
+  Lines of our entries, indexed so looking up a line or its position doesn't
+  require listing every line. This is immutable, so it can be shared between
+  threads without copying.
+
+  :var list entries: entries we have the lines of
+  :var collections.Counter categories: number of entries in each **Category**
+  """
+
+  def __init__(self, entries = ()):
+    self.entries = list(entries)
+    self.categories = collections.Counter([entry.get_type() for entry in self.entries])
+
+    # line offset that each entry starts at, and an entry's index within our
+    # entries
+
+    self._offsets = [0]
+    self._positions = {}
+
+    for index, entry in enumerate(self.entries):
+      self._offsets.append(self._offsets[-1] + len(entry.get_lines()))
+      self._positions[entry] = index
+
+  def index(self, line):
+    """
+    Provides the position of a line.
+
+    :param nyx.panel.connection.Line line: line to look up
+
+    :returns: **int** with the line's position
+
+    :raises: **ValueError** if we don't have the line
+    """
+
+    position = self._positions.get(line.entry)
+
+    if position is not None:
+      entry_lines = line.entry.get_lines()
+
+      if line in entry_lines:
+        return self._offsets[position] + entry_lines.index(line)
+
+    raise ValueError('%s is not among our lines' % (line,))
+
+  def __contains__(self, line):
+    try:
+      self.index(line)
+      return True
+    except (AttributeError, ValueError):
+      return False
+
+  def __getitem__(self, index):
+    if index < 0:
+      index += len(self)
+
+    if not 0 <= index < len(self):
+      raise IndexError('line index out of range')
+
+    position = bisect.bisect_right(self._offsets, index) - 1
+    return self.entries[position].get_lines()[index - self._offsets[position]]
+
+  def __iter__(self):
+    for entry in self.entries:
+      for line in entry.get_lines():
+        yield line
+
+  def __len__(self):
+    return self._offsets[-1]
+
+
 class ConnectionPanel(nyx.panel.DaemonPanel):
   """
   Listing of connections tor is making, with information correlated against
@@ -281,12 +424,22 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
 
     self._scroller = nyx.curses.CursorScroller()
     self._entries = []            # last fetched display entries
+    self._entries_order = None    # sort order of our entries
+    self._line_model = LineModel()  # lines of our entries
+    self._connection_entries = {}  # connection => entry for tor's present connections
+    self._connection_generation = 0  # ConnectionTracker generation of our connection entries
     self._show_details = False    # presents the details panel if true
     self._sort_order = CONFIG['connection_order']
     self._pause_time = 0
 
     self._last_resource_fetch = -1  # timestamp of the last ConnectionResolver results used
 
+    # Descriptors for our details are fetched in the background, redrawing
+    # when the one we're showing arrives.
+
+    self._awaited_descriptor = None
+    nyx.tracker.get_descriptor_tracker().add_listener(self._descriptor_fetched)
+
     # Tracks exiting port and client country statistics
 
     self._client_locale_usage = {}
@@ -325,7 +478,34 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
 
     if results:
       self._sort_order = results
-      self._entries = sorted(self._entries, key = lambda entry: [entry.sort_value(attr) for attr in self._sort_order])
+      self._entries = sorted(self._entries, key = lambda entry: entry.sort_key(self._sort_order))
+      self._entries_order = self._sort_order
+      self._line_model = LineModel(self._entries)
+
+  def _prefetch_descriptors(self, lines, selected):
+    """
+    Requests the descriptors of our selection and the lines around it, so
+    they're usually at hand by the time the cursor reaches them.
+    """
+
+    index = lines.index(selected)
+    nearby = [selected]
+
+    for offset in range(1, DESCRIPTOR_PREFETCH + 1):
+      if index + offset < len(lines):
+        nearby.append(lines[index + offset])
+
+      if index - offset >= 0:
+        nearby.append(lines[index - offset])
+
+    fingerprints = [_details_fingerprint(line) for line in nearby]
+    cached = nyx.tracker.get_descriptor_tracker().query(fingerprints)
+    self._awaited_descriptor = fingerprints[0] if fingerprints[0] not in cached else None
+
+  def _descriptor_fetched(self, fingerprint):
+    if self._show_details and fingerprint == self._awaited_descriptor:
+      self._awaited_descriptor = None
+      self.redraw()
 
   def set_paused(self, is_pause):
     if is_pause:
@@ -338,8 +518,7 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
       if self._show_details:
         page_height -= (DETAILS_HEIGHT + 1)
 
-      lines = list(itertools.chain.from_iterable([entry.get_lines() for entry in self._entries]))
-      is_changed = self._scroller.handle_key(key, lines, page_height)
+      is_changed = self._scroller.handle_key(key, self._line_model, page_height)
 
       if is_changed:
         self.redraw()
@@ -349,10 +528,8 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
       self.redraw()
 
     def _show_descriptor():
-      entries = self._entries
-
       while True:
-        lines = list(itertools.chain.from_iterable([entry.get_lines() for entry in entries]))
+        lines = self._line_model
         selected = self._scroller.selection(lines)
 
         if not selected:
@@ -361,6 +538,12 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
         def is_close_key(key):
           return key.is_selection() or key.match('d') or key.match('left') or key.match('right')
 
+        # fetch the relays to either side while we show this one, so stepping
+        # through them is quick
+
+        index = lines.index(selected)
+        nyx.tracker.get_descriptor_tracker().query([selected.fingerprint] + [lines[i].fingerprint for i in range(max(0, index - 1), min(index + 2, len(lines))) if i != index])
+
         color = CONFIG['attr.connection.category_color'].get(selected.entry.get_type(), WHITE)
         key = nyx.popups.show_descriptor(selected.fingerprint, color, is_close_key)
 
@@ -441,9 +624,8 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
   def _draw(self, subwindow):
     controller = tor_controller()
     interface = nyx_interface()
-    entries = self._entries
+    lines = self._line_model
 
-    lines = list(itertools.chain.from_iterable([entry.get_lines() for entry in entries]))
     is_showing_details = self._show_details and lines
     details_offset = DETAILS_HEIGHT + 1 if is_showing_details else 0
     selected, scroll = self._scroller.selection(lines, subwindow.height - details_offset - 1)
@@ -458,9 +640,10 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
     is_scrollbar_visible = len(lines) > subwindow.height - details_offset - 1
     scroll_offset = 2 if is_scrollbar_visible else 0
 
-    _draw_title(subwindow, entries, self._show_details)
+    _draw_title(subwindow, lines.categories, self._show_details)
 
     if is_showing_details:
+      self._prefetch_descriptors(lines, selected)
       _draw_details(subwindow, selected)
 
       # draw a 'T' pipe if connecting with the scrollbar
@@ -483,7 +666,7 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
     Fetches the newest resolved connections.
     """
 
-    global LAST_RETRIEVED_CIRCUITS, LAST_RETRIEVED_HS_CONF
+    global LAST_RETRIEVED_CIRCUITS
 
     conn_resolver = nyx.tracker.get_connection_tracker()
     resolution_count = conn_resolver.run_counter()
@@ -507,14 +690,40 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
 
     controller = tor_controller()
     LAST_RETRIEVED_CIRCUITS = controller.get_circuits([])
-    LAST_RETRIEVED_HS_CONF = controller.get_hidden_service_conf({})
 
     if not conn_resolver.is_alive():
       return  # if we're not fetching connections then this is a no-op
     elif resolution_count == self._last_resource_fetch:
       return  # no new connections to process
 
-    new_entries = [Entry.from_connection(conn) for conn in conn_resolver.get_value()]
+    # Apply the connections that have come and gone since our last update
+    # rather than rebuilding entries for everything.
+
+    changes = conn_resolver.get_changes(self._connection_generation)
+
+    if changes.removed is None:
+      removed, self._connection_entries = list(self._connection_entries), {}
+    else:
+      removed = changes.removed
+
+      for conn in removed:
+        self._connection_entries.pop(conn, None)
+
+    for conn in removed:
+      ENTRY_CACHE.pop(conn, None)
+
+    # New connections are classified together, so their relay and locale
+    # lookups are shared and any we need to ask tor about are one request.
+
+    added = list(changes.added)
+    added_entries, stats = Entry.from_connections(added)
+    self._connection_entries.update(zip(added, added_entries))
+
+    if stats.connections:
+      log.debug('Classified %i connections (relays: %0.3fs, categories: %0.3fs, locales: %0.3fs, entries: %0.3fs)' % stats)
+
+    self._connection_generation = changes.generation
+    new_entries = list(self._connection_entries.values())
 
     for circ in LAST_RETRIEVED_CIRCUITS:
       # Skips established single-hop circuits (these are for directory
@@ -523,9 +732,9 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
       if not (circ.status == 'BUILT' and len(circ.path) == 1):
         new_entries.append(Entry.from_circuit(circ))
 
-    # update stats for client and exit connections
+    # update stats for new client and exit connections
 
-    for entry in new_entries:
+    for entry in added_entries:
       line = entry.get_lines()[0]
 
       # This loop is the lengthiest part of our update. If our thread's stopped
@@ -542,7 +751,13 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
 
         self._counted_connections.add(line.connection.remote_address)
 
-    self._entries = sorted(new_entries, key = lambda entry: [entry.sort_value(attr) for attr in self._sort_order])
+    # Most entries are unchanged between updates, so rather than resorting
+    # everything we place new entries among the ones we already have.
+
+    sort_order = self._sort_order
+    self._entries = _sort_entries(self._entries if self._entries_order == sort_order else [], new_entries, sort_order)
+    self._entries_order = sort_order
+    self._line_model = LineModel(self._entries)
     self._last_resource_fetch = resolution_count
 
     if CONFIG['resolve_processes']:
@@ -558,7 +773,8 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
 
       nyx.tracker.get_port_usage_tracker().query(local_ports, remote_ports)
 
-    # clear cache of anything that hasn't been referenced in the last five minutes
+    # clear cache of anything that hasn't been referenced in the last five
+    # minutes, tor's connections are instead evicted above when they close
 
     now = time.time()
     to_clear = [k for k, v in ENTRY_CACHE_REFERENCED.items() if (now - v) >= 300]
@@ -573,17 +789,57 @@ class ConnectionPanel(nyx.panel.DaemonPanel):
     self.redraw()
 
 
-def _draw_title(subwindow, entries, showing_details):
+def _sort_entries(entries, updated_entries, sort_order):
+  """
+  Sorts the entries we're updating to. Entries that we already have are kept
+  in their present order, and new ones are sorted then merged among them in a
+  single pass, so we only sort what's changed.
+
+  :param list entries: present entries, sorted by our sort_order
+  :param list updated_entries: entries we're updating to
+  :param list sort_order: **SortAttr** we're ordered by
+
+  :returns: **list** with our updated_entries in sorted order
+  """
+
+  sort_order = tuple(sort_order)
+  present, updated = set(entries), set(updated_entries)
+
+  kept = [entry for entry in entries if entry in updated]
+  kept_keys = [entry.sort_key(sort_order) for entry in kept]
+
+  added = [entry for entry in updated_entries if entry not in present]
+  added_keys = [entry.sort_key(sort_order) for entry in added]
+  added_order = sorted(range(len(added)), key = added_keys.__getitem__)
+
+  # merge the new entries in with a single pass, placing them after present
+  # entries with the same key
+
+  merged = []
+  added_index, added_count = 0, len(added_order)
+
+  for entry, key in zip(kept, kept_keys):
+    while added_index < added_count and added_keys[added_order[added_index]] < key:
+      merged.append(added[added_order[added_index]])
+      added_index += 1
+
+    merged.append(entry)
+
+  return merged + [added[i] for i in added_order[added_index:]]
+
+
+def _draw_title(subwindow, counts, showing_details):
   """
   Panel title with the number of connections we presently have.
+
+  :param collections.Counter counts: number of entries in each **Category**
   """
 
   if showing_details:
     subwindow.addstr(0, 0, 'Connection Details:', HIGHLIGHT)
-  elif not entries:
+  elif not counts:
     subwindow.addstr(0, 0, 'Connections:', HIGHLIGHT)
   else:
-    counts = collections.Counter([entry.get_type() for entry in entries])
     count_labels = ['%i %s' % (counts[category], category.lower()) for category in Category if counts[category]]
     subwindow.addstr(0, 0, 'Connections (%s):' % ', '.join(count_labels), HIGHLIGHT)
 
@@ -611,7 +867,8 @@ def _draw_line(subwindow, x, y, line, is_selected, width, current_time):
 
 
 def _draw_address_column(subwindow, x, y, line, attr):
-  src = tor_controller().get_info('address', line.connection.local_address)
+  snapshot = controller_snapshot()
+  src = snapshot.address if snapshot.address else line.connection.local_address
 
   if line.line_type == LineType.CONNECTION:
     src = '%s:%s' % (src, line.connection.local_port)
@@ -627,11 +884,11 @@ def _draw_address_column(subwindow, x, y, line, attr):
 
       if purpose:
         dst += ' (%s)' % str_tools.crop(purpose, 26 - len(dst) - 3)
-    elif not tor_controller().is_geoip_unavailable() and not line.entry.is_private():
+    elif not snapshot.is_geoip_unavailable and not line.entry.is_private():
       dst += ' (%s)' % (line.locale if line.locale else '??')
 
   src = '%-21s' % src
-  dst = '%-21s' % dst if tor_controller().is_geoip_unavailable() else '%-26s' % dst
+  dst = '%-21s' % dst if snapshot.is_geoip_unavailable else '%-26s' % dst
 
   if line.entry.get_type() in (Category.INBOUND, Category.SOCKS, Category.CONTROL):
     dst, src = src, dst
@@ -642,6 +899,23 @@ def _draw_address_column(subwindow, x, y, line, attr):
     return subwindow.addstr(x, y, '%s  -->  %s' % (src, dst), *attr)
 
 
+def _details_fingerprint(line):
+  """
+  Provides the relay our details show for a line, **None** if there isn't
+  exactly one.
+  """
+
+  if line.line_type == LineType.CIRCUIT_HEADER and line.circuit.status != 'BUILT':
+    return None
+
+  matches = nyx.tracker.get_consensus_tracker().get_relay_fingerprints(line.connection.remote_address)
+
+  if len(matches) == 1:
+    return list(matches.values())[0]
+  else:
+    return matches.get(line.connection.remote_port)
+
+
 def _draw_details(subwindow, selected):
   """
   Shows detailed information about the selected connection.
@@ -661,19 +935,26 @@ def _draw_details(subwindow, selected):
     if not matches:
       subwindow.addstr(2, 3, 'No consensus data found', *attr)
     elif len(matches) == 1 or selected.connection.remote_port in matches:
-      controller = tor_controller()
       fingerprint = list(matches.values())[0] if len(matches) == 1 else matches[selected.connection.remote_port]
-      router_status_entry = controller.get_network_status(fingerprint, None)
+      relay_status = nyx.tracker.get_consensus_tracker().get_relay_status(fingerprint)
 
       subwindow.addstr(15, 2, 'fingerprint: %s' % fingerprint, *attr)
 
-      if router_status_entry:
-        dir_port_label = 'dirport: %s' % router_status_entry.dir_port if router_status_entry.dir_port else ''
-        subwindow.addstr(2, 3, 'nickname: %-25s orport: %-10s %s' % (router_status_entry.nickname, router_status_entry.or_port, dir_port_label), *attr)
-        subwindow.addstr(2, 4, 'published: %s' % router_status_entry.published.strftime("%H:%M %m/%d/%Y"), *attr)
-        subwindow.addstr(2, 5, 'flags: %s' % ', '.join(router_status_entry.flags), *attr)
+      # Consensus information comes from our cache. We only go to tor for the
+      # relay's full descriptor.
 
-        server_descriptor = controller.get_server_descriptor(fingerprint, None)
+      if relay_status:
+        dir_port_label = 'dirport: %s' % relay_status.dir_port if relay_status.dir_port else ''
+        published_label = relay_status.published.strftime("%H:%M %m/%d/%Y") if relay_status.published else 'unknown'
+        subwindow.addstr(2, 3, 'nickname: %-25s orport: %-10s %s' % (relay_status.nickname, relay_status.or_port, dir_port_label), *attr)
+        subwindow.addstr(2, 4, 'published: %s' % published_label, *attr)
+        subwindow.addstr(2, 5, 'flags: %s' % ', '.join(relay_status.flags), *attr)
+
+        try:
+          server_descriptor = nyx.tracker.get_descriptor_tracker().fetch(fingerprint).server_descriptor
+        except nyx.tracker.UnresolvedResult:
+          server_descriptor = None
+          subwindow.addstr(2, 6, 'loading descriptor...', *attr)
 
         if server_descriptor:
           policy_label = server_descriptor.exit_policy.summary() if server_descriptor.exit_policy else 'unknown'
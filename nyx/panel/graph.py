@@ -24,10 +24,10 @@ import nyx.panel
 import nyx.popups
 import nyx.tracker
 
-from nyx import nyx_interface, tor_controller, join, show_message
+from nyx import nyx_interface, tor_controller, controller_snapshot, join, show_message
 from nyx.curses import RED, GREEN, CYAN, BOLD, HIGHLIGHT
 from nyx.menu import MenuItem, Submenu, RadioMenuItem, RadioGroup
-from stem.control import EventType, Listener
+from stem.control import EventType
 from stem.util import conf, enum, log, str_tools, system
 
 GraphStat = enum.Enum(('BANDWIDTH', 'bandwidth'), ('CONNECTIONS', 'connections'), ('SYSTEM_RESOURCES', 'resources'))
@@ -361,27 +361,54 @@ class ConnectionStats(GraphCategory):
   Tracks number of inbound and outbound connections.
   """
 
+  def __init__(self, clone = None):
+    GraphCategory.__init__(self, clone)
+
+    # Running tally of our connections. We adjust these with the changes from
+    # our ConnectionTracker rather than counting every connection each second.
+
+    if clone:
+      self._generation = clone._generation
+      self._ports = clone._ports
+      self._inbound_count = clone._inbound_count
+      self._outbound_count = clone._outbound_count
+    else:
+      self._generation = 0
+      self._ports = None
+      self._inbound_count = 0
+      self._outbound_count = 0
+
   def stat_type(self):
     return GraphStat.CONNECTIONS
 
   def bandwidth_event(self, event):
-    inbound_count, outbound_count = 0, 0
+    snapshot = controller_snapshot()
+    inbound_ports = snapshot.or_ports | snapshot.dir_ports
+    control_ports = snapshot.control_ports
+    ports = (inbound_ports, control_ports)
 
-    controller = tor_controller()
-    or_ports = controller.get_ports(Listener.OR, [])
-    dir_ports = controller.get_ports(Listener.DIR, [])
-    control_ports = controller.get_ports(Listener.CONTROL, [])
-
-    for entry in nyx.tracker.get_connection_tracker().get_value():
-      if entry.local_port in or_ports or entry.local_port in dir_ports:
-        inbound_count += 1
-      elif entry.local_port in control_ports:
-        pass  # control connection
-      else:
-        outbound_count += 1
-
-    self.primary.update(inbound_count)
-    self.secondary.update(outbound_count)
+    # recount everything if our ports have changed or we lack the history for
+    # a delta
+
+    changes = nyx.tracker.get_connection_tracker().get_changes(self._generation if ports == self._ports else None)
+
+    if changes.removed is None:
+      self._inbound_count, self._outbound_count = 0, 0
+
+    for conns, delta in ((changes.added, 1), (changes.removed or (), -1)):
+      for entry in conns:
+        if entry.local_port in inbound_ports:
+          self._inbound_count += delta
+        elif entry.local_port in control_ports:
+          pass  # control connection
+        else:
+          self._outbound_count += delta
+
+    self._generation = changes.generation
+    self._ports = ports
+
+    self.primary.update(self._inbound_count)
+    self.secondary.update(self._outbound_count)
 
     self._primary_header_stats = [str(self.primary.latest_value), ', avg: %i' % self.primary.average()]
     self._secondary_header_stats = [str(self.secondary.latest_value), ', avg: %i' % self.secondary.average()]
@@ -184,13 +184,13 @@ class HeaderPanel(nyx.panel.DaemonPanel):
     _draw_status(subwindow, 0, self.get_height() - 1, interface.is_paused(), self._message, *self._message_attr)
 
   def _reset_listener(self, controller, event_type, _):
-    self._update()
+    self._update(is_reset = True)
 
     if event_type == stem.control.State.CLOSED:
       log.notice('Tor control port closed')
 
-  def _update(self):
-    self._vals = Sampling.create(self._vals)
+  def _update(self, is_reset = False):
+    self._vals = Sampling.create(self._vals, is_reset)
 
     if self._vals.fd_used and self._vals.fd_limit != -1:
       fd_percent = 100 * self._vals.fd_used // self._vals.fd_limit
@@ -222,11 +222,42 @@ class Sampling(object):
       setattr(self, key, value)
 
   @staticmethod
-  def create(last_sampling = None):
+  def create(last_sampling = None, is_reset = False):
+    """
+    Samples tor's present state. Values that don't change while tor runs are
+    reused from our last sampling unless tor has been reset, and those we ask
+    tor about are requested together.
+
+    :param nyx.panel.header.Sampling last_sampling: our prior sampling
+    :param bool is_reset: refetches all values if **True**
+
+    :returns: :class:`~nyx.panel.header.Sampling` of tor's present state
+    """
+
     controller = tor_controller()
     retrieved = time.time()
 
-    pid = controller.get_pid('')
+    if last_sampling and last_sampling.pid and not is_reset:
+      pid, start_time, version = last_sampling.pid, last_sampling.start_time, last_sampling.version
+      hostname, platform = last_sampling.hostname, last_sampling.platform
+    else:
+      pid, start_time = controller.get_pid(''), controller.get_start_time(0)
+      version = str(controller.get_version('Unknown')).split()[0]
+      hostname, platform = os.uname()[1], '%s %s' % (os.uname()[0], os.uname()[2])  # [platform name] [version]
+
+    values = nyx.batch_query(info = {
+      'fingerprint': 'Unknown',
+      'address': 'Unknown',
+      'status/version/current': 'Unknown',
+      'process/descriptor-limit': '-1',
+    }, conf = {
+      'Nickname': '',
+      'DirPort': '0',
+      'ControlSocket': None,
+      'HashedControlPassword': None,
+      'CookieAuthentication': None,
+    })
+
     tor_resources = nyx.tracker.get_resource_tracker().get_value()
     nyx_total_cpu_time = sum(os.times()[:3], stem.util.system.SYSTEM_CALL_TIME)
 
@@ -234,9 +265,9 @@ class Sampling(object):
     control_listeners = controller.get_listeners(stem.control.Listener.CONTROL, [])
     my_router_status_entry = nyx.tracker.get_consensus_tracker().my_router_status_entry()
 
-    if controller.get_conf('HashedControlPassword', None):
+    if values.conf['HashedControlPassword']:
       auth_type = 'password'
-    elif controller.get_conf('CookieAuthentication', None) == '1':
+    elif values.conf['CookieAuthentication'] == '1':
       auth_type = 'cookie'
     else:
       auth_type = 'open'
@@ -259,26 +290,26 @@ class Sampling(object):
       'connection_time': controller.connection_time(),
       'last_heartbeat': controller.get_latest_heartbeat(),
 
-      'fingerprint': controller.get_info('fingerprint', 'Unknown'),
-      'nickname': controller.get_conf('Nickname', ''),
+      'fingerprint': values.info['fingerprint'],
+      'nickname': values.conf['Nickname'],
       'newnym_wait': controller.get_newnym_wait(),
       'exit_policy': controller.get_exit_policy(None),
       'flags': getattr(my_router_status_entry, 'flags', []),
 
-      'version': str(controller.get_version('Unknown')).split()[0],
-      'version_status': controller.get_info('status/version/current', 'Unknown'),
+      'version': version,
+      'version_status': values.info['status/version/current'],
 
-      'address': or_listeners[0][0] if (or_listeners and or_listeners[0][0] != '0.0.0.0') else controller.get_info('address', 'Unknown'),
+      'address': or_listeners[0][0] if (or_listeners and or_listeners[0][0] != '0.0.0.0') else values.info['address'],
       'or_port': or_listeners[0][1] if or_listeners else '',
-      'dir_port': controller.get_conf('DirPort', '0'),
+      'dir_port': values.conf['DirPort'],
       'control_port': str(control_listeners[0][1]) if control_listeners else None,
-      'socket_path': controller.get_conf('ControlSocket', None),
+      'socket_path': values.conf['ControlSocket'],
       'is_relay': bool(or_listeners),
 
       'auth_type': auth_type,
       'pid': pid,
-      'start_time': controller.get_start_time(0),
-      'fd_limit': int(controller.get_info('process/descriptor-limit', '-1')),
+      'start_time': start_time,
+      'fd_limit': int(values.info['process/descriptor-limit']),
       'fd_used': fd_used,
 
       'nyx_total_cpu_time': nyx_total_cpu_time,
@@ -287,8 +318,8 @@ class Sampling(object):
       'memory': stem.util.str_tools.size_label(tor_resources.memory_bytes) if tor_resources.memory_bytes > 0 else 0,
       'memory_percent': '%0.1f' % (100 * tor_resources.memory_percent),
 
-      'hostname': os.uname()[1],
-      'platform': '%s %s' % (os.uname()[0], os.uname()[2]),  # [platform name] [version]
+      'hostname': hostname,
+      'platform': platform,
     }
 
     return Sampling(**attr)
@@ -29,6 +29,7 @@ import nyx.arguments
 import nyx.curses
 import nyx.log
 import nyx.panel
+import nyx.tracker
 
 from nyx import nyx_interface
 from nyx.curses import RED, GREEN, YELLOW, CYAN, WHITE, NORMAL, BOLD, HIGHLIGHT
@@ -46,6 +47,11 @@ BLOCK_START, BLOCK_END = '-----BEGIN ', '-----END '
 
 UNRESOLVED_MSG = 'No consensus data available'
 ERROR_MSG = 'Unable to retrieve data'
+LOADING_MSG = 'Still waiting on tor for descriptors, try again shortly'
+
+# Seconds we wait for tor to provide descriptors we haven't already fetched.
+
+DESCRIPTOR_TIMEOUT = 5
 
 
 def show_help():
@@ -208,7 +214,7 @@ def show_descriptor(fingerprint, color, is_close_key):
         in_block = False
       elif in_block:
         keyword, value = '', line
-      elif ' ' in line and line != UNRESOLVED_MSG and line != ERROR_MSG:
+      elif ' ' in line and line not in (UNRESOLVED_MSG, ERROR_MSG, LOADING_MSG):
         keyword, value = line.split(' ', 1)
         keyword = keyword + ' '
 
@@ -254,25 +260,27 @@ def show_descriptor(fingerprint, color, is_close_key):
 
 def _descriptor_text(fingerprint):
   """
-  Provides the descriptors for a relay.
+  Provides the descriptors for a relay. These come from our DescriptorTracker,
+  so relays we've shown or prefetched recently are provided without querying
+  tor.
 
   :param str fingerprint: relay fingerprint to be looked up
 
   :returns: **list** with the lines that should be displayed in the dialog
   """
 
-  controller = nyx.tor_controller()
-  router_status_entry = controller.get_network_status(fingerprint, None)
-  microdescriptor = controller.get_microdescriptor(fingerprint, None)
-  server_descriptor = controller.get_server_descriptor(fingerprint, None)
+  try:
+    descriptors = nyx.tracker.get_descriptor_tracker().fetch(fingerprint, DESCRIPTOR_TIMEOUT)
+  except nyx.tracker.UnresolvedResult:
+    return ['Consensus:', '', LOADING_MSG]  # tor is slow rather than failing, it'll be cached when it responds
 
-  description = 'Consensus:\n\n%s' % (router_status_entry if router_status_entry else ERROR_MSG)
+  description = 'Consensus:\n\n%s' % (descriptors.router_status_entry if descriptors.router_status_entry else ERROR_MSG)
 
-  if server_descriptor:
-    description += '\n\nServer Descriptor:\n\n%s' % server_descriptor
+  if descriptors.server_descriptor:
+    description += '\n\nServer Descriptor:\n\n%s' % descriptors.server_descriptor
 
-  if microdescriptor:
-    description += '\n\nMicrodescriptor:\n\n%s' % microdescriptor
+  if descriptors.microdescriptor:
+    description += '\n\nMicrodescriptor:\n\n%s' % descriptors.microdescriptor
 
   return description.split('\n')
 
@@ -10,6 +10,8 @@ Background tasks for gathering information about the tor process.
   get_resource_tracker - provides a ResourceTracker for our tor process
   get_port_usage_tracker - provides a PortUsageTracker for our system
   get_consensus_tracker - provides a ConsensusTracker for our tor process
+  get_descriptor_tracker - provides a DescriptorTracker for relay descriptors
+  get_locale_tracker - provides a LocaleTracker for tor's GeoIP database
 
   stop_trackers - halts any active trackers
 
@@ -17,7 +19,8 @@ Background tasks for gathering information about the tor process.
     |- ConnectionTracker - periodically checks the connections established by tor
     |  |- get_custom_resolver - provide the custom conntion resolver we're using
     |  |- set_custom_resolver - overwrites automatic resolver selecion with a custom resolver
-    |  +- get_value - provides our latest connection results
+    |  |- get_value - provides our latest connection results
+    |  +- get_changes - provides connections added or removed since a generation
     |
     |- ResourceTracker - periodically checks the resource usage of tor
     |  +- get_value - provides our latest resource usage results
@@ -29,14 +32,44 @@ Background tasks for gathering information about the tor process.
     |- get_rate - provides the rate at which we run
     |- set_rate - sets the rate at which we run
     |- set_paused - pauses or continues work
+    |- get_lag - provides how late our last run started
     +- stop - stops further work by the daemon
 
+  RingBuffer - fixed size buffer of our most recent values
+    |- append - adds a value, replacing our oldest if full
+    |- values - provides our values from oldest to newest
+    +- clear - removes all values
+
+  ProcSampler - reads the resource usage of a process from open proc files
+    |- sample - provides the process' present resource usage
+    +- close - closes our proc files
+
+  SocketOwnerIndex - mapping of socket inodes to the process that owns them
+    |- refresh - rescans processes for sockets they've opened
+    |- owners - refreshes and provides the processes owning many sockets
+    +- owner - provides the process owning a socket
+
   ConsensusTracker - performant lookups for consensus related information
     |- update - updates the consensus information we're based on
     |- my_router_status_entry - provides the router status entry for ourselves
     |- get_relay_nickname - provides the nickname for a given relay
     |- get_relay_fingerprints - provides relays running at a location
-    +- get_relay_address - provides the address a relay is running at
+    |- get_relay_address - provides the address a relay is running at
+    |- get_relay_status - provides the consensus status of a relay
+    |- get_index_stats - provides statistics about our relay address index
+    +- get_last_update - provides the changes made by our last consensus update
+
+  DescriptorTracker - fetches relay descriptors in the background
+    |- query - queues descriptors to be fetched
+    |- fetch - provides the descriptors we've fetched for a relay
+    +- add_listener - notifies a callback when descriptors arrive
+
+  LocaleTracker - performant lookups of the locale addresses belong to
+    |- get_locale - provides the locale of an address
+    +- get_locales - provides the locales of many addresses
+
+  ExitPolicyMatcher - compiled form of an exit policy
+    +- can_exit_to - checks if we allow exiting to a destination
 
 .. data:: Resources
 
@@ -48,24 +81,88 @@ Background tasks for gathering information about the tor process.
   :var int memory_bytes: memory usage of the process in bytes
   :var float memory_percent: percentage of our memory used by this process
   :var float timestamp: unix timestamp for when this information was fetched
+  :var float cpu_p50: median cpu usage of our samples over the last
+    resource_rate seconds
+  :var float cpu_p95: 95th percentile cpu usage of our samples over the last
+    resource_rate seconds
+  :var float cpu_max: peak cpu usage of our samples over the last
+    resource_rate seconds
+
+  Percentiles are only meaningful when sampling more frequently than our
+  resource_rate (the resource_sample_rate option). Otherwise they match the
+  cpu_sample.
+
+.. data:: RelayIndexStats
+
+  Statistics about the ConsensusTracker's in-memory relay address index.
+
+  :var int relays: number of relays in the index
+  :var int addresses: number of distinct addresses in the index
+  :var float build_time: seconds it took to build the index
+  :var int memory_bytes: approximate memory used by the index
+
+.. data:: ConsensusUpdate
+
+  Relays that changed when the ConsensusTracker processed a consensus.
+
+  :var int added: relays that are new to the consensus
+  :var int changed: relays with a new address, ports, nickname, flags, or
+    bandwidth
+  :var int removed: relays that have left the consensus
+  :var float duration: seconds it took to apply the changes
+  :var bool is_full: **True** if all relays were rewritten rather than just
+    those that changed
+
+.. data:: RelayDescriptors
+
+  Descriptors tor has for a relay, provided by the DescriptorTracker. Each of
+  these is **None** if tor doesn't have it.
+
+  :var stem.descriptor.router_status_entry.RouterStatusEntryV3 router_status_entry:
+    consensus entry of the relay
+  :var stem.descriptor.server_descriptor.RelayDescriptor server_descriptor:
+    server descriptor of the relay
+  :var stem.descriptor.microdescriptor.Microdescriptor microdescriptor:
+    microdescriptor of the relay
+
+.. data:: ConnectionChanges
+
+  Connections that have changed between runs of our ConnectionTracker.
+
+  :var int generation: generation these changes bring the caller up to
+  :var frozenset added: :class:`~nyx.tracker.Connection` that are new
+  :var frozenset removed: :class:`~nyx.tracker.Connection` that are gone,
+    **None** if we lack the history for a delta in which case **added** is
+    all of our present connections
 """
 
+import array
+import binascii
+import bisect
 import collections
+import math
+import mmap
 import os
+import pwd
+import re
+import socket
+import struct
+import sys
 import time
 import threading
 
 import nyx
 import stem.control
-import stem.descriptor.router_status_entry
+import stem.exit_policy
 import stem.util.log
 
-from nyx import tor_controller
+from nyx import tor_controller, controller_snapshot, _address_value, _pack_address
 from stem.util import conf, connection, enum, proc, str_tools, system
 
 CONFIG = conf.config_dict('nyx', {
   'connection_rate': 5,
   'resource_rate': 5,
+  'resource_sample_rate': 0,
   'port_usage_rate': 5,
 })
 
@@ -80,11 +177,77 @@ CONNECTION_TRACKER = None
 RESOURCE_TRACKER = None
 PORT_USAGE_TRACKER = None
 CONSENSUS_TRACKER = None
+DESCRIPTOR_TRACKER = None
+LOCALE_TRACKER = None
 
 CustomResolver = enum.Enum(
   ('INFERENCE', 'by inference'),
+  ('NETLINK', 'netlink'),
 )
 
+# Constants for querying sockets through netlink's sock_diag interface. These
+# come from linux/netlink.h, linux/sock_diag.h, and linux/inet_diag.h.
+
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLM_F_DUMP_INTR = 0x10
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+TCP_ESTABLISHED = 1
+
+NLMSG_HEADER = struct.Struct('=IHHII')  # length, type, flags, sequence, port id
+INET_DIAG_REQ = struct.Struct('=BBBBI48s')  # family, protocol, ext, pad, states, socket id
+INET_DIAG_MSG = struct.Struct('=BBBB2s2s16s16sI8sIIIII')  # family, state, timer, retrans, socket id, expires, rqueue, wqueue, uid, inode
+
+# Array type for IPv4 bounds in our GeoIP index. 'I' is four bytes on the
+# platforms we run on, whereas 'L' is eight on LP64 systems.
+
+IPV4_ARRAY_TYPE = 'I' if array.array('I').itemsize >= 4 else 'L'
+MAX_IPV4_VALUE = 0xFFFFFFFF
+
+NETLINK_AVAILABLE = None
+PROC_SAMPLER = None
+SOCKET_OWNER_INDEX = None
+
+# Number of ConnectionTracker runs we retain changes for. Callers that fall
+# further behind than this get a full listing instead.
+
+CONNECTION_CHANGE_HISTORY = 12
+
+# Bounds for the PortUsageTracker's cache. Ports are looked up again when their
+# entry expires, and we retry unknown applications sooner since the process
+# may not have opened its socket when we looked.
+
+PORT_USAGE_CACHE_SIZE = 2048
+PORT_USAGE_TTL = 300
+PORT_USAGE_UNKNOWN_TTL = 30
+
+# Number of relays we write to our cache per transaction when processing a new
+# consensus. Our lock is released between chunks so lookups aren't blocked
+# for the whole update.
+
+CONSENSUS_CHUNK_SIZE = 500
+
+# Bounds for the DescriptorTracker's cache. Entries are keyed by when the
+# consensus says a relay published, so republished descriptors are fetched
+# right away. The expiry is a backstop for relays we lack consensus data for.
+
+DESCRIPTOR_CACHE_SIZE = 256
+DESCRIPTOR_TTL = 3600
+
+# Number of locales we retain from tor when we can't read its GeoIP database
+# ourselves.
+
+LOCALE_CACHE_SIZE = 4096
+
+# Exit policy results our ExitPolicyMatcher memoizes.
+
+EXIT_POLICY_CACHE_SIZE = 4096
+
+ROUTER_STATUS_LINE = re.compile(b'^[rsw] .*$', re.MULTILINE)
+
 # Extending stem's Connection tuple with attributes for the uptime of the
 # connection.
 
@@ -93,6 +256,20 @@ Connection = collections.namedtuple('Connection', [
   'is_legacy',  # boolean to indicate if the connection predated us
 ] + list(stem.util.connection.Connection._fields))
 
+ConsensusUpdate = collections.namedtuple('ConsensusUpdate', [
+  'added',
+  'changed',
+  'removed',
+  'duration',
+  'is_full',
+])
+
+ConnectionChanges = collections.namedtuple('ConnectionChanges', [
+  'generation',
+  'added',
+  'removed',
+])
+
 Resources = collections.namedtuple('Resources', [
   'cpu_sample',
   'cpu_average',
@@ -100,6 +277,22 @@ Resources = collections.namedtuple('Resources', [
   'memory_bytes',
   'memory_percent',
   'timestamp',
+  'cpu_p50',
+  'cpu_p95',
+  'cpu_max',
+])
+
+RelayIndexStats = collections.namedtuple('RelayIndexStats', [
+  'relays',
+  'addresses',
+  'build_time',
+  'memory_bytes',
+])
+
+RelayDescriptors = collections.namedtuple('RelayDescriptors', [
+  'router_status_entry',
+  'server_descriptor',
+  'microdescriptor',
 ])
 
 Process = collections.namedtuple('Process', [
@@ -138,7 +331,7 @@ def get_resource_tracker():
   global RESOURCE_TRACKER
 
   if RESOURCE_TRACKER is None:
-    RESOURCE_TRACKER = ResourceTracker(CONFIG['resource_rate'])
+    RESOURCE_TRACKER = ResourceTracker(CONFIG['resource_rate'], CONFIG['resource_sample_rate'])
     RESOURCE_TRACKER.start()
 
   return RESOURCE_TRACKER
@@ -171,6 +364,32 @@ def get_consensus_tracker():
   return CONSENSUS_TRACKER
 
 
+def get_descriptor_tracker():
+  """
+  Singleton for fetching the descriptors of relays.
+  """
+
+  global DESCRIPTOR_TRACKER
+
+  if DESCRIPTOR_TRACKER is None:
+    DESCRIPTOR_TRACKER = DescriptorTracker()
+
+  return DESCRIPTOR_TRACKER
+
+
+def get_locale_tracker():
+  """
+  Singleton for determining the locale of addresses.
+  """
+
+  global LOCALE_TRACKER
+
+  if LOCALE_TRACKER is None:
+    LOCALE_TRACKER = LocaleTracker()
+
+  return LOCALE_TRACKER
+
+
 def stop_trackers():
   """
   Halts active trackers, providing back the thread shutting them down.
@@ -179,11 +398,7 @@ def stop_trackers():
   """
 
   def halt_trackers():
-    trackers = filter(lambda t: t and t.is_alive(), [
-      CONNECTION_TRACKER,
-      RESOURCE_TRACKER,
-      PORT_USAGE_TRACKER,
-    ])
+    trackers = [t for t in (CONNECTION_TRACKER, RESOURCE_TRACKER, PORT_USAGE_TRACKER) if t and t.is_alive()]
 
     for tracker in trackers:
       tracker.stop()
@@ -245,8 +460,9 @@ def _resources_via_ps(pid):
 
 def _resources_via_proc(pid):
   """
-  Fetches resource usage information about a given process via proc. This
-  returns a tuple of the form...
+  Fetches resource usage information about a given process via proc. Our
+  :class:`~nyx.tracker.ProcSampler` is reused between calls so its proc files
+  stay open. This returns a tuple of the form...
 
     (total_cpu_time, uptime, memory_in_bytes, memory_in_percent)
 
@@ -257,21 +473,496 @@ def _resources_via_proc(pid):
   :raises: **IOError** if unsuccessful
   """
 
-  utime, stime, start_time = proc.stats(
-    pid,
-    proc.Stat.CPU_UTIME,
-    proc.Stat.CPU_STIME,
-    proc.Stat.START_TIME,
-  )
+  global PROC_SAMPLER
+
+  if PROC_SAMPLER is None or PROC_SAMPLER.pid != pid:
+    if PROC_SAMPLER:
+      PROC_SAMPLER.close()
+
+    PROC_SAMPLER = ProcSampler(pid)
+
+  try:
+    return PROC_SAMPLER.sample()
+  except IOError:
+    PROC_SAMPLER.close()  # reopen our files when next called
+    PROC_SAMPLER = None
+    raise
+
+
+def _tcp_sockets():
+  """
+  Provides the established tcp sockets on this system. This comes from netlink
+  if available, and proc's tcp tables otherwise.
+
+  :returns: **generator** of (local_port, remote_port, inode) tuples
+
+  :raises: **IOError** if unsuccessful
+  """
+
+  if _is_netlink_available():
+    try:
+      netlink_socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG)
+    except socket.error as exc:
+      raise IOError('netlink sock_diag is unavailable: %s' % exc)
+
+    try:
+      for family in (socket.AF_INET, socket.AF_INET6):
+        for msg in _netlink_dump(netlink_socket, family, socket.IPPROTO_TCP):
+          yield struct.unpack('!H', msg[4])[0], struct.unpack('!H', msg[5])[0], msg[14]
+    finally:
+      netlink_socket.close()
+
+    return
+
+  # Entries of proc's tcp tables look like...
+  #
+  #   sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+  #    0: 0100007F:2353 0100007F:91AD 01 00000000:00000000 00:00000000 00000000  1000        0 14048 ...
+
+  for table in ('/proc/net/tcp', '/proc/net/tcp6'):
+    try:
+      with open(table) as table_file:
+        lines = table_file.readlines()[1:]
+    except IOError as exc:
+      if table.endswith('6'):
+        continue  # system lacks ipv6 support
+
+      raise IOError("unable to read '%s': %s" % (table, exc))
+
+    for line in lines:
+      line_comp = line.split()
+
+      if len(line_comp) < 10 or line_comp[3] != '01':
+        continue  # connection isn't established
+
+      try:
+        local_port = int(line_comp[1].rsplit(':', 1)[1], 16)
+        remote_port = int(line_comp[2].rsplit(':', 1)[1], 16)
+        yield local_port, remote_port, int(line_comp[9])
+      except (IndexError, ValueError):
+        raise IOError("unrecognized line in '%s': %s" % (table, line.strip()))
+
+
+def _process_for_ports_via_proc(local_ports, remote_ports):
+  """
+  Provides the process using the given ports from our socket owner index. This
+  is the same as :func:`~nyx.tracker._process_for_ports` but doesn't require
+  lsof, and rescans only the file descriptors opened since we last checked.
+
+  :param list local_ports: local port numbers to look up
+  :param list remote_ports: remote port numbers to look up
+
+  :returns: **dict** mapping the ports to the associated **Process**, or
+    **None** if it can't be determined
+
+  :raises: **IOError** if unsuccessful
+  """
+
+  global SOCKET_OWNER_INDEX
+
+  if SOCKET_OWNER_INDEX is None:
+    SOCKET_OWNER_INDEX = SocketOwnerIndex()
+
+  local_ports, remote_ports = set(local_ports), set(remote_ports)
+  inodes, live_inodes = {}, set()  # port => inode, and all of our sockets
+
+  for local_port, remote_port, inode in _tcp_sockets():
+    live_inodes.add(inode)
+
+    if local_port in local_ports:
+      inodes[local_port] = inode
+    elif remote_port in remote_ports:
+      inodes[remote_port] = inode
+
+  owners = SOCKET_OWNER_INDEX.owners(inodes.values(), live_inodes)
+  results = dict([(port, owners[inode]) for port, inode in inodes.items()])
+
+  for unknown_port in local_ports.union(remote_ports).difference(results.keys()):
+    results[unknown_port] = None
+
+  return results
+
+
+def _consensus_relays(consensus_content):
+  """
+  Parses the router status entries of a network status document. This only
+  reads the 'r', 's', and 'w' lines, so it's far quicker than having stem parse
+  the document.
+
+  :param str consensus_content: network status document
+
+  :returns: **list** of relay tuples as described by
+    :func:`~nyx.tracker._router_status_relays`
+  """
+
+  return _router_status_relays([line for line in consensus_content.splitlines() if line[:2] in ('r ', 's ', 'w ')])
+
+
+def _cached_consensus_relays(data_directory):
+  """
+  Reads the router status entries of the consensus tor has cached in its data
+  directory. The file is memory mapped and scanned for 'r', 's', and 'w'
+  lines, so we don't need to read the whole document into memory. If tor has
+  cached both consensus flavors we use whichever is newest.
+
+  :param str data_directory: tor's data directory
+
+  :returns: **list** of relay tuples as described by
+    :func:`~nyx.tracker._router_status_relays`
+
+  :raises: **IOError** if neither consensus can be read, or it has no relays
+  """
+
+  paths = [os.path.join(data_directory, filename) for filename in ('cached-consensus', 'cached-microdesc-consensus')]
+  paths = sorted([path for path in paths if os.path.isfile(path)], key = os.path.getmtime, reverse = True)
+
+  if not paths:
+    raise IOError('%s lacks a cached consensus' % data_directory)
+
+  try:
+    with open(paths[0], 'rb') as consensus_file:
+      consensus_map = mmap.mmap(consensus_file.fileno(), 0, access = mmap.ACCESS_READ)
+  except (EnvironmentError, ValueError) as exc:
+    raise IOError("unable to read '%s': %s" % (paths[0], exc))
+
+  try:
+    relays = _router_status_relays([match.group(0).decode('utf-8', 'replace') for match in ROUTER_STATUS_LINE.finditer(consensus_map)])
+  finally:
+    consensus_map.close()
+
+  if not relays:
+    raise IOError("'%s' has no router status entries" % paths[0])
+
+  return relays
+
+
+def _router_status_relays(lines):
+  """
+  Parses the 'r', 's', and 'w' lines of either consensus flavor...
+
+    r <nickname> <identity> <digest> <publication date> <time> <address> <orport> <dirport>
+    r <nickname> <identity> <publication date> <time> <address> <orport> <dirport>
+    s <flags>
+    w Bandwidth=<weight>
+
+  Identities are unpadded base64. Decoding them with binascii is several times
+  faster than stem's _base64_to_hex(), and fingerprints are validated when
+  they're recorded.
+
+  :param list lines: router status entry lines
+
+  :returns: **list** of (fingerprint, address, or_port, nickname, dir_port,
+    published, flags, bandwidth) tuples, malformed entries are skipped
+  """
+
+  relays = []
+  relay = None  # entry whose 's' and 'w' lines we're reading
+
+  for line in lines:
+    if line.startswith('r '):
+      if relay:
+        relays.append(tuple(relay))
+
+      r_comp = line.rstrip().split(' ')
+      offset = 1 if len(r_comp) == 9 else 0  # microdescriptor flavor lacks the digest
+
+      try:
+        identity = r_comp[2]
+        fingerprint = binascii.hexlify(binascii.a2b_base64(identity + '=' * (-len(identity) % 4))).upper().decode('ascii')
+        dir_port = int(r_comp[7 + offset])
+        relay = [fingerprint, r_comp[5 + offset], int(r_comp[6 + offset]), r_comp[1], dir_port if dir_port else None, '%s %s' % (r_comp[3 + offset], r_comp[4 + offset]), (), None]
+      except (IndexError, ValueError, TypeError):
+        relay = None
+        stem.util.log.debug('Malformed router status entry: %s' % line)
+    elif relay is None:
+      continue  # belongs to a malformed entry
+    elif line.startswith('s '):
+      relay[6] = tuple(line.split()[1:])
+    elif line.startswith('w '):
+      for entry in line.split()[1:]:
+        if entry.startswith('Bandwidth=') and entry[10:].isdigit():
+          relay[7] = int(entry[10:])
+
+  if relay:
+    relays.append(tuple(relay))
+
+  return relays
+
+
+def _geoip_ranges(path, family):
+  """
+  Reads one of tor's GeoIP files into sorted arrays. IPv4 files have lines
+  with the integer bounds of an address range...
+
+    <start>,<end>,<country code>
+
+  ... while IPv6 files have the addresses themselves.
+
+  :param str path: GeoIP file to be read
+  :param int family: address family of the file
+
+  :returns: **tuple** of the form (starts, ends, locales) with the range
+    bounds, sorted by their start, and their lowercase country code
+
+  :raises: **IOError** if the file can't be read
+  """
+
+  entries, locales = [], {}
+
+  try:
+    with open(path) as geoip_file:
+      for line in geoip_file:
+        if not line or line.startswith('#'):
+          continue
+
+        try:
+          start, end, locale = line.strip().split(',')
+
+          if family == socket.AF_INET:
+            start, end = int(start), int(end)
+          else:
+            start, end = _address_value(start), _address_value(end)
+        except ValueError:
+          continue  # blank or malformed line
+
+        if start is None or end is None:
+          continue  # malformed address
+        elif family == socket.AF_INET and not (0 <= start <= end <= MAX_IPV4_VALUE):
+          continue  # bounds outside the IPv4 address space
+
+        entries.append((start, end, locales.setdefault(locale, locale.lower())))
+  except EnvironmentError as exc:
+    raise IOError("unable to read '%s': %s" % (path, exc))
+
+  if not entries:
+    raise IOError("'%s' has no address ranges" % path)
+
+  entries.sort()
+
+  if family == socket.AF_INET:
+    starts, ends = array.array(IPV4_ARRAY_TYPE, [entry[0] for entry in entries]), array.array(IPV4_ARRAY_TYPE, [entry[1] for entry in entries])
+  else:
+    starts, ends = [entry[0] for entry in entries], [entry[1] for entry in entries]
+
+  return starts, ends, [entry[2] for entry in entries]
+
+
+def _address_range(address, masked_bits, bits):
+  """
+  Provides the first and last address of a subnet as integers.
+  """
+
+  address_int = _address_value(address)
+  host_bits = bits - masked_bits
+  min_address = (address_int >> host_bits) << host_bits
+
+  return (min_address, min_address + (1 << host_bits) - 1)
+
+
+def _relay_digest(relays):
+  """
+  Provides a digest of relays, mapping fingerprints to a hash of everything
+  else we know about them.
+
+  :param list relays: relay tuples, starting with their fingerprint
+
+  :returns: **dict** of fingerprints to **int** hashes
+  """
+
+  return dict([(relay[0], hash(relay[1:])) for relay in relays])
+
+
+def _index_memory(index):
+  """
+  Approximate memory usage of a relay address index.
+  """
+
+  memory_bytes = sys.getsizeof(index)
+
+  for packed_address, ports in index.items():
+    memory_bytes += sys.getsizeof(packed_address) + sys.getsizeof(ports) + sum([sys.getsizeof(fp) for fp in ports.values()])
+
+  return memory_bytes
+
+
+def _percentile(values, fraction):
+  """
+  Provides the nearest-rank percentile of a sorted list.
+
+  :param list values: sorted values to pick from
+  :param float fraction: percentile as a fraction between zero and one
+
+  :returns: value at that percentile, zero if we have no values
+  """
+
+  if not values:
+    return 0.0
+
+  return values[max(0, int(math.ceil(fraction * len(values))) - 1)]
+
+
+def _is_netlink_available():
+  """
+  Checks if we can query sockets through netlink's sock_diag interface. This
+  is only available on Linux.
+
+  :returns: **bool** that's **True** if we can query sock_diag
+  """
+
+  global NETLINK_AVAILABLE
+
+  if NETLINK_AVAILABLE is None:
+    try:
+      socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG).close()
+      NETLINK_AVAILABLE = True
+    except (AttributeError, socket.error):
+      NETLINK_AVAILABLE = False
+
+  return NETLINK_AVAILABLE
+
+
+def _socket_inodes(pid):
+  """
+  Provides the inodes of the sockets a process has open.
+
+  :param int pid: process to be queried
+
+  :returns: **set** of **int** socket inodes
+
+  :raises: **IOError** if unsuccessful
+  """
+
+  inodes = set()
+  fd_dir = '/proc/%s/fd' % pid
+
+  try:
+    fds = os.listdir(fd_dir)
+  except OSError as exc:
+    raise IOError("unable to read '%s': %s" % (fd_dir, exc))
+
+  for fd in fds:
+    try:
+      link = os.readlink(os.path.join(fd_dir, fd))
+    except OSError:
+      continue  # file descriptor was closed while we were reading
+
+    if link.startswith('socket:['):
+      inodes.add(int(link[8:-1]))
+
+  return inodes
+
+
+def _netlink_dump(netlink_socket, family, protocol):
+  """
+  Requests the established sockets of a given family and protocol from
+  sock_diag.
+
+  :param socket.socket netlink_socket: NETLINK_SOCK_DIAG socket to query with
+  :param int family: **socket.AF_INET** or **socket.AF_INET6**
+  :param int protocol: **socket.IPPROTO_TCP** or **socket.IPPROTO_UDP**
+
+  :returns: **generator** of inet_diag_msg tuples for each socket
+
+  :raises: **IOError** if unsuccessful
+  """
+
+  request = INET_DIAG_REQ.pack(family, protocol, 0, 0, 1 << TCP_ESTABLISHED, b'')
+  netlink_socket.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(request), SOCK_DIAG_BY_FAMILY, NLM_F_REQUEST | NLM_F_DUMP, 0, 0) + request)
 
-  total_cpu_time = float(utime) + float(stime)
-  memory_in_bytes = proc.memory_usage(pid)[0]
-  total_memory = proc.physical_memory()
+  while True:
+    response = netlink_socket.recv(65536)
 
-  uptime = time.time() - float(start_time)
-  memory_in_percent = float(memory_in_bytes) / total_memory
+    if not response:
+      raise IOError('netlink response ended before the dump was complete')
 
-  return (total_cpu_time, uptime, memory_in_bytes, memory_in_percent)
+    offset = 0
+
+    while offset + NLMSG_HEADER.size <= len(response):
+      msg_length, msg_type, msg_flags = NLMSG_HEADER.unpack_from(response, offset)[:3]
+
+      if msg_length < NLMSG_HEADER.size:
+        raise IOError('malformed netlink message of %i bytes' % msg_length)
+      elif msg_flags & NLM_F_DUMP_INTR:
+        raise IOError('netlink dump was interrupted by a change to the socket table')
+      elif msg_type == NLMSG_DONE:
+        # failed dumps conclude with a negative errno rather than an NLMSG_ERROR
+
+        if msg_length >= NLMSG_HEADER.size + 4:
+          errno = -struct.unpack_from('=i', response, offset + NLMSG_HEADER.size)[0]
+
+          if errno > 0:
+            raise IOError('netlink dump failed: %s' % os.strerror(errno))
+
+        return
+      elif msg_type == NLMSG_ERROR:
+        errno = -struct.unpack_from('=i', response, offset + NLMSG_HEADER.size)[0]
+        raise IOError('netlink request failed: %s' % os.strerror(errno))
+      elif msg_type == SOCK_DIAG_BY_FAMILY:
+        yield INET_DIAG_MSG.unpack_from(response, offset + NLMSG_HEADER.size)
+
+      offset += (msg_length + 3) & ~3  # messages are four byte aligned
+
+
+def _connections_via_netlink(pid = None, user = None):
+  """
+  Fetches established connections from the kernel via netlink's sock_diag
+  interface. This is similar to proc.connections() but the kernel only
+  provides established sockets, as binary structs, so there's no text to parse.
+  If no **pid** or **user** are provided this provides all connections.
+
+  :param int pid: process to provide connections for
+  :param str user: username to provide connections for
+
+  :returns: **list** of :class:`~stem.util.connection.Connection` instances
+
+  :raises: **IOError** if unsuccessful
+  """
+
+  inodes = _socket_inodes(pid) if pid else None
+
+  try:
+    uid = pwd.getpwnam(user).pw_uid if (user and not pid) else None
+  except KeyError:
+    raise IOError("'%s' isn't a user on this system" % user)
+
+  if inodes is not None and not inodes:
+    return []  # process doesn't have any sockets
+
+  try:
+    netlink_socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG)
+  except (AttributeError, socket.error) as exc:
+    raise IOError('netlink sock_diag is unavailable: %s' % exc)
+
+  conn = []
+
+  try:
+    for family, is_ipv6, address_size in ((socket.AF_INET, False, 4), (socket.AF_INET6, True, 16)):
+      for protocol, protocol_label in ((socket.IPPROTO_TCP, 'tcp'), (socket.IPPROTO_UDP, 'udp')):
+        for msg in _netlink_dump(netlink_socket, family, protocol):
+          local_port, remote_port = struct.unpack('!H', msg[4])[0], struct.unpack('!H', msg[5])[0]
+          msg_uid, msg_inode = msg[13], msg[14]
+
+          if inodes is not None and msg_inode not in inodes:
+            continue
+          elif uid is not None and msg_uid != uid:
+            continue
+          elif local_port == 0 or remote_port == 0:
+            continue  # no port
+
+          local_address = socket.inet_ntop(family, msg[6][:address_size])
+          remote_address = socket.inet_ntop(family, msg[7][:address_size])
+
+          if is_ipv6:
+            local_address = connection.expand_ipv6_address(local_address)
+            remote_address = connection.expand_ipv6_address(remote_address)
+
+          conn.append(connection.Connection(local_address, local_port, remote_address, remote_port, protocol_label, is_ipv6))
+  except socket.error as exc:
+    raise IOError('unable to query netlink sock_diag: %s' % exc)
+  finally:
+    netlink_socket.close()
+
+  return conn
 
 
 def _process_for_ports(local_ports, remote_ports):
@@ -374,39 +1065,39 @@ class Daemon(threading.Thread):
     self._process_name = None
 
     self._rate = rate
-    self._last_ran = -1  # time when we last ran
     self._run_counter = 0  # counter for the number of successful runs
 
     self._is_paused = False
     self._halt = False  # terminates thread if true
+    self._scheduled = nyx.ScheduledTask(type(self).__name__, rate)
 
     controller = tor_controller()
     controller.add_status_listener(self._tor_status_listener)
     self._tor_status_listener(controller, stem.control.State.INIT, None)
 
   def run(self):
-    while not self._halt:
-      if self._is_paused or time.time() - self._last_ran < self._rate:
-        sleep_until = self._last_ran + self._rate
+    nyx.scheduler().add(self._scheduled)
 
-        while not self._halt and time.time() < sleep_until:
-          time.sleep(nyx.PAUSE_TIME)
-
-        continue  # done waiting, try again
+    try:
+      while not self._halt:
+        self._scheduled.wait()
 
-      with self._process_lock:
-        is_successful = False
+        if self._halt or self._is_paused:
+          continue
 
-        if self._process_pid is not None:
-          try:
-            is_successful = self._task(self._process_pid, self._process_name)
-          except Exception as exc:
-            stem.util.log.notice('BUG: Unexpected exception from %s: %s' % (type(self).__name__, exc))
+        with self._process_lock:
+          is_successful = False
 
-        if is_successful:
-          self._run_counter += 1
+          if self._process_pid is not None:
+            try:
+              is_successful = self._task(self._process_pid, self._process_name)
+            except Exception as exc:
+              stem.util.log.notice('BUG: Unexpected exception from %s: %s' % (type(self).__name__, exc))
 
-      self._last_ran = time.time()
+          if is_successful:
+            self._run_counter += 1
+    finally:
+      nyx.scheduler().remove(self._scheduled)
 
   def _task(self, process_pid, process_name):
     """
@@ -449,10 +1140,20 @@ class Daemon(threading.Thread):
     """
 
     self._rate = rate
+    nyx.scheduler().set_rate(self._scheduled, rate)
 
-  def set_paused(self, pause):
+  def get_lag(self):
     """
-    Either resumes or holds off on doing further work.
+    Provides how late our last run started relative to when it was scheduled.
+
+    :returns: **float** with the seconds our last run was delayed
+    """
+
+    return self._scheduled.lag
+
+  def set_paused(self, pause):
+    """
+    Either resumes or holds off on doing further work.
 
     :param bool pause: halts work if **True**, resumes otherwise
     """
@@ -465,6 +1166,7 @@ class Daemon(threading.Thread):
     """
 
     self._halt = True
+    self._scheduled.wake()
 
   def _tor_status_listener(self, controller, event_type, _):
     with self._process_lock:
@@ -495,8 +1197,7 @@ class ConnectionTracker(Daemon):
   def __init__(self, rate):
     super(ConnectionTracker, self).__init__(rate)
 
-    self._connections = []
-    self._start_times = {}  # connection => (unix_timestamp, is_legacy)
+    self._connections = collections.OrderedDict()  # stem connection => our Connection
     self._custom_resolver = None
     self._is_first_run = True
 
@@ -506,6 +1207,13 @@ class ConnectionTracker(Daemon):
     self._failure_count = 0
     self._rate_too_low_count = 0
 
+    # Connections added and removed by our recent runs, so callers can apply
+    # deltas rather than walk all of our connections.
+
+    self._generation = 0
+    self._changes = collections.deque(maxlen = CONNECTION_CHANGE_HISTORY)
+    self._changes_lock = threading.RLock()
+
     # If 'DisableDebuggerAttachment 0' is set we can do normal connection
     # resolution. Otherwise connection resolution by inference is the only game
     # in town.
@@ -513,6 +1221,9 @@ class ConnectionTracker(Daemon):
     self._resolvers = [CustomResolver.INFERENCE] if stem.util.proc.is_available() else []
 
     if tor_controller().get_conf('DisableDebuggerAttachment', None) == '0':
+      if self._resolvers and _is_netlink_available():
+        self._resolvers = [CustomResolver.NETLINK] + self._resolvers
+
       self._resolvers = self._resolvers + connection.system_resolvers()
     elif not self._resolvers:
       stem.util.log.notice("Tor connection information is unavailable. This is fine, but if you would like to have it please see https://nyx.torproject.org/#no_connections")
@@ -531,7 +1242,6 @@ class ConnectionTracker(Daemon):
 
     try:
       start_time = time.time()
-      new_connections, new_start_times = [], {}
 
       if resolver == CustomResolver.INFERENCE:
         # provide connections going to a relay or one of our tor ports
@@ -540,25 +1250,42 @@ class ConnectionTracker(Daemon):
         controller = tor_controller()
         consensus_tracker = get_consensus_tracker()
 
-        relay_ports = set(controller.get_ports(stem.control.Listener.OR, []))
-        relay_ports.update(controller.get_ports(stem.control.Listener.DIR, []))
-        relay_ports.update(controller.get_ports(stem.control.Listener.CONTROL, []))
+        snapshot = controller_snapshot()
+        relay_ports = snapshot.or_ports | snapshot.dir_ports | snapshot.control_ports
 
-        for conn in proc.connections(user = controller.get_user(None)):
+        if _is_netlink_available():
+          candidates = _connections_via_netlink(user = controller.get_user(None))
+        else:
+          candidates = proc.connections(user = controller.get_user(None))
+
+        for conn in candidates:
           if conn.remote_port in consensus_tracker.get_relay_fingerprints(conn.remote_address):
             connections.append(conn)  # outbound to another relay
           elif conn.local_port in relay_ports:
             connections.append(conn)
+      elif resolver == CustomResolver.NETLINK:
+        connections = _connections_via_netlink(process_pid)
       else:
         connections = connection.get_connections(resolver, process_pid = process_pid, process_name = process_name)
 
+      # Only new connections need a start time, and only connections that have
+      # gone away need to be dropped. Everything else carries over as-is.
+
+      current = set(connections)
+      removed_keys = [conn for conn in self._connections if conn not in current]
+      added = collections.OrderedDict()
+
       for conn in connections:
-        conn_start_time, is_legacy = self._start_times.get(conn, (start_time, self._is_first_run))
-        new_start_times[conn] = (conn_start_time, is_legacy)
-        new_connections.append(Connection(conn_start_time, is_legacy, *conn))
+        if conn not in self._connections and conn not in added:
+          added[conn] = Connection(start_time, self._is_first_run, *conn)
+
+      with self._changes_lock:
+        removed = [self._connections.pop(conn) for conn in removed_keys]
+        self._connections.update(added)
+
+        self._generation += 1
+        self._changes.append(ConnectionChanges(self._generation, frozenset(added.values()), frozenset(removed)))
 
-      self._connections = new_connections
-      self._start_times = new_start_times
       self._is_first_run = False
 
       runtime = time.time() - start_time
@@ -633,8 +1360,50 @@ class ConnectionTracker(Daemon):
 
     if self._halt:
       return []
-    else:
-      return list(self._connections)
+
+    with self._changes_lock:
+      return list(self._connections.values())
+
+  def get_changes(self, since_generation):
+    """
+    Provides the connections that have been added or removed since a given
+    generation. Callers should start with a generation of zero, then provide
+    the generation of our last response.
+
+    If we no longer have the history to provide a delta then the result's
+    **removed** attribute is **None** and **added** has all of our present
+    connections. Callers should discard their prior connections in that case.
+
+    :param int since_generation: generation of the last changes the caller
+      applied
+
+    :returns: :data:`~nyx.tracker.ConnectionChanges` with the changes since
+      that generation
+    """
+
+    with self._changes_lock:
+      if self._halt:
+        return ConnectionChanges(self._generation, frozenset(), None)
+      elif since_generation == self._generation:
+        return ConnectionChanges(self._generation, frozenset(), frozenset())
+      elif since_generation is None or since_generation > self._generation or not self._changes or since_generation < self._changes[0].generation - 1:
+        return ConnectionChanges(self._generation, frozenset(self._connections.values()), None)
+
+      added, removed = set(), set()
+
+      for changes in self._changes:
+        if changes.generation <= since_generation:
+          continue
+
+        for conn in changes.removed:
+          if conn in added:
+            added.remove(conn)  # came and went since the caller last checked
+          else:
+            removed.add(conn)
+
+        added.update(changes.added)
+
+      return ConnectionChanges(self._generation, frozenset(added), frozenset(removed))
 
 
 class ResourceTracker(Daemon):
@@ -642,11 +1411,24 @@ class ResourceTracker(Daemon):
   Periodically retrieves the resource usage of tor.
   """
 
-  def __init__(self, rate):
+  def __init__(self, rate, sample_rate = 0):
+    self._use_proc = proc.is_available()  # determines if we use proc or ps for lookups
+    self._interval = rate
+
+    # When we can use proc we can optionally sample more frequently than our
+    # rate. Our samples are buffered so our results can include percentiles
+    # over the full interval. Forking ps for this would be too expensive.
+
+    if sample_rate and sample_rate < rate and self._use_proc:
+      buffer_size = int(math.ceil(max(rate, 1.0) / sample_rate)) + 2
+      self._sample_times, self._cpu_totals = RingBuffer(buffer_size), RingBuffer(buffer_size)
+      rate = sample_rate
+    else:
+      self._sample_times, self._cpu_totals = None, None
+
     super(ResourceTracker, self).__init__(rate)
 
     self._resources = None
-    self._use_proc = proc.is_available()  # determines if we use proc or ps for lookups
     self._failure_count = 0  # number of times in a row we've failed to get results
 
   def get_value(self):
@@ -657,7 +1439,7 @@ class ResourceTracker(Daemon):
     """
 
     result = self._resources
-    return result if result else Resources(0.0, 0.0, 0.0, 0, 0.0, 0.0)
+    return result if result else Resources(0.0, 0.0, 0.0, 0, 0.0, 0.0, 0.0, 0.0, 0.0)
 
   def _task(self, process_pid, process_name):
     try:
@@ -665,10 +1447,16 @@ class ResourceTracker(Daemon):
       total_cpu_time, uptime, memory_in_bytes, memory_in_percent = resolver(process_pid)
       now = time.time()
 
-      if self._resources:
+      if self._sample_times is not None:
+        cpu_sample, cpu_usage = self._buffer_sample(total_cpu_time, now)
+      elif self._resources:
         cpu_sample = (total_cpu_time - self._resources.cpu_total) / (now - self._resources.timestamp)
+        cpu_usage = [cpu_sample]
       else:
         cpu_sample = 0.0  # we need a prior datapoint to give a sampling
+        cpu_usage = [cpu_sample]
+
+      cpu_usage.sort()
 
       self._resources = Resources(
         cpu_sample = cpu_sample,
@@ -677,6 +1465,9 @@ class ResourceTracker(Daemon):
         memory_bytes = memory_in_bytes,
         memory_percent = memory_in_percent,
         timestamp = now,
+        cpu_p50 = _percentile(cpu_usage, 0.5),
+        cpu_p95 = _percentile(cpu_usage, 0.95),
+        cpu_max = cpu_usage[-1] if cpu_usage else 0.0,
       )
 
       self._failure_count = 0
@@ -692,6 +1483,10 @@ class ResourceTracker(Daemon):
           self._use_proc = False
           self._failure_count = 0
 
+          if self._sample_times is not None:
+            self._sample_times, self._cpu_totals = None, None
+            self.set_rate(self._interval)
+
           stem.util.log.info('Failed three attempts to get process resource usage from proc, falling back to ps (%s)' % exc)
         else:
           stem.util.log.debug('Unable to query process resource usage from proc (%s)' % exc)
@@ -706,18 +1501,195 @@ class ResourceTracker(Daemon):
 
       return False
 
+  def _buffer_sample(self, total_cpu_time, now):
+    """
+    Adds a sample to our buffers, providing the cpu usage over the last second
+    and of each sample within our interval.
+    """
+
+    if self._cpu_totals and total_cpu_time < self._cpu_totals.values()[-1]:
+      self._sample_times.clear()  # process has been restarted
+      self._cpu_totals.clear()
+
+    self._sample_times.append(now)
+    self._cpu_totals.append(total_cpu_time)
+
+    sample_times, cpu_totals = self._sample_times.values(), self._cpu_totals.values()
+    cpu_usage = []
+
+    for i in range(1, len(sample_times)):
+      elapsed = sample_times[i] - sample_times[i - 1]
+
+      if elapsed > 0 and sample_times[i] > now - self._interval:
+        cpu_usage.append((cpu_totals[i] - cpu_totals[i - 1]) / elapsed)
+
+    # Our cpu_sample is relative to our newest sample that's at least a second
+    # old, so it's a true per-second value.
+
+    baseline = 0
+
+    for i, sample_time in enumerate(sample_times):
+      if sample_time <= now - 1:
+        baseline = i
+
+    elapsed = now - sample_times[baseline]
+    cpu_sample = (total_cpu_time - cpu_totals[baseline]) / elapsed if elapsed > 0 else 0.0
+
+    return cpu_sample, cpu_usage
+
+
+class SocketOwnerIndex(object):
+  """
+  Mapping of socket inodes to the process that owns them, built by scanning
+  the file descriptors in /proc/*/fd. We only read the descriptors of a
+  process that we haven't seen before, so after the first scan refreshes are
+  little more than a directory listing per process.
+  """
+
+  def __init__(self, proc_path = '/proc'):
+    self._proc_path = proc_path
+    self._fds = {}  # pid => {fd => inode, or None if not a socket}
+    self._names = {}  # pid => process name
+    self._owners = {}  # inode => (pid, fd)
+    self._unowned = set()  # inodes we couldn't find when rereading everything
+
+  def refresh(self, reread = False):
+    """
+    Rescans processes for the sockets they've opened.
+
+    :param bool reread: reads all file descriptors rather than just new ones
+
+    :raises: **IOError** if unable to list our processes
+    """
+
+    try:
+      pids = set([int(entry) for entry in os.listdir(self._proc_path) if entry.isdigit()])
+    except OSError as exc:
+      raise IOError("unable to read '%s': %s" % (self._proc_path, exc))
+
+    for pid in set(self._fds).difference(pids):
+      self._remove(pid)
+
+    for pid in pids:
+      fd_dir = os.path.join(self._proc_path, str(pid), 'fd')
+
+      try:
+        fds = set(os.listdir(fd_dir))
+      except OSError:
+        self._remove(pid)  # process is gone or we lack permissions
+        continue
+
+      known_fds = self._fds.setdefault(pid, {})
+
+      for fd in (set(known_fds) if reread else set(known_fds).difference(fds)):
+        inode = known_fds.pop(fd)
+
+        if inode is not None and self._owners.get(inode) == (pid, fd):
+          del self._owners[inode]
+
+      for fd in fds.difference(known_fds):
+        inode = self._read_fd(pid, fd)
+        known_fds[fd] = inode
+
+        if inode is not None:
+          self._owners[inode] = (pid, fd)
+
+  def owners(self, inodes, live_inodes):
+    """
+    Refreshes ourselves and provides the processes owning sockets.
+
+    File descriptors are only read when they're new, so a reused descriptor
+    number can hide a socket. If a socket's unknown we reread everything, but
+    only once while it's open. Sockets we still can't find, such as those of
+    other users' processes, are only looked for among new descriptors after
+    that.
+
+    :param list inodes: inodes of the sockets to look up
+    :param set live_inodes: inodes of all open sockets, so we can forget the
+      ones that have closed
+
+    :returns: **dict** mapping inodes to the **Process** owning them, **None**
+      if unknown
+
+    :raises: **IOError** if unable to list our processes
+    """
+
+    self.refresh()
+    self._unowned.intersection_update(live_inodes)
+    results = dict([(inode, self.owner(inode)) for inode in inodes])
+
+    if [inode for inode, process in results.items() if process is None and inode not in self._unowned]:
+      self.refresh(reread = True)
+      results = dict([(inode, self.owner(inode)) for inode in inodes])
+      self._unowned.update([inode for inode, process in results.items() if process is None])
+
+    return results
+
+  def owner(self, inode):
+    """
+    Provides the process owning a socket. This is a dictionary lookup, though
+    we check that the descriptor still refers to this socket.
+
+    :param int inode: inode of the socket
+
+    :returns: **Process** owning the socket, **None** if unknown
+    """
+
+    owner = self._owners.get(inode)
+
+    if owner is None:
+      return None
+
+    pid, fd = owner
+
+    if self._read_fd(pid, fd) != inode:
+      del self._owners[inode]
+      return None
+
+    if pid not in self._names:
+      try:
+        with open(os.path.join(self._proc_path, str(pid), 'comm')) as comm_file:
+          self._names[pid] = comm_file.read().strip()
+      except IOError:
+        return None  # process is gone
+
+    return Process(pid, self._names[pid])
+
+  def _read_fd(self, pid, fd):
+    """
+    Provides the socket inode a file descriptor refers to, **None** if it's
+    not a socket.
+    """
+
+    try:
+      link = os.readlink(os.path.join(self._proc_path, str(pid), 'fd', fd))
+    except OSError:
+      return None  # file descriptor was closed while we were reading
+
+    return int(link[8:-1]) if link.startswith('socket:[') else None
+
+  def _remove(self, pid):
+    for fd, inode in self._fds.pop(pid, {}).items():
+      if inode is not None and self._owners.get(inode) == (pid, fd):
+        del self._owners[inode]
+
+    self._names.pop(pid, None)
+
 
 class PortUsageTracker(Daemon):
   """
-  Periodically retrieves the processes using a set of ports.
+  Periodically retrieves the processes using a set of ports. Results are
+  cached so each port is looked up once rather than on every run, with the
+  least recently used entries evicted when we're full.
   """
 
   def __init__(self, rate):
     super(PortUsageTracker, self).__init__(rate)
 
-    self._last_requested_local_ports = []
-    self._last_requested_remote_ports = []
-    self._processes_for_ports = {}
+    self._cache = collections.OrderedDict()  # port => (process, expiration), least recently used first
+    self._pending = collections.OrderedDict()  # port => True if local, False if remote
+    self._lock = threading.RLock()
+    self._use_proc = proc.is_available()  # determines if we use proc or lsof for lookups
     self._failure_count = 0  # number of times in a row we've failed to get results
 
   def fetch(self, port):
@@ -737,22 +1709,24 @@ class PortUsageTracker(Daemon):
         the application but it couldn't be determined
     """
 
-    try:
-      result = self._processes_for_ports[port]
+    with self._lock:
+      try:
+        result = self._cache.pop(port)
+        self._cache[port] = result  # most recently used
+      except KeyError:
+        raise UnresolvedResult()
 
-      if result is None:
-        raise UnknownApplication()
-      else:
-        return result
-    except KeyError:
-      raise UnresolvedResult()
+    if result[0] is None:
+      raise UnknownApplication()
+    else:
+      return result[0]
 
   def query(self, local_ports, remote_ports):
     """
-    Registers a given set of ports for further lookups, and returns the last
-    set of 'port => process' mappings we retrieved. Note that this means that
-    we will not return the requested ports unless they're requested again after
-    a successful lookup has been performed.
+    Registers a given set of ports for further lookups, and returns the
+    'port => process' mappings we have for them. Ports are only queued for a
+    lookup if they're not cached, or their cache entry has expired. Expired
+    entries are still provided until we have a replacement.
 
     :param list local_ports: local port numbers to look up
     :param list remote_ports: remote port numbers to look up
@@ -760,47 +1734,706 @@ class PortUsageTracker(Daemon):
     :returns: **dict** mapping port numbers to the **Process** using it
     """
 
-    self._last_requested_local_ports = local_ports
-    self._last_requested_remote_ports = remote_ports
-    return self._processes_for_ports
+    results, now = {}, time.time()
+
+    with self._lock:
+      for ports, is_local in ((local_ports, True), (remote_ports, False)):
+        for port in ports:
+          cached = self._cache.get(port)
+
+          if cached is not None:
+            results[port] = cached[0]
+
+          if (cached is None or cached[1] <= now) and port not in self._pending:
+            self._pending[port] = is_local
+
+    return results
 
   def _task(self, process_pid, process_name):
-    local_ports = self._last_requested_local_ports
-    remote_ports = self._last_requested_remote_ports
+    with self._lock:
+      pending = list(self._pending.items())
+      self._pending.clear()
 
-    if not local_ports and not remote_ports:
+    if not pending:
       return True
 
-    result = {}
+    local_ports = [port for port, is_local in pending if is_local]
+    remote_ports = [port for port, is_local in pending if not is_local]
 
-    # Use cached results from our last lookup if available.
+    try:
+      resolver = _process_for_ports_via_proc if self._use_proc else _process_for_ports
+      results, now = resolver(local_ports, remote_ports), time.time()
 
-    for port, process in self._processes_for_ports.items():
-      if port in local_ports:
-        result[port] = process
-        local_ports.remove(port)
-      elif port in remote_ports:
-        result[port] = process
-        remote_ports.remove(port)
+      with self._lock:
+        for port, process in results.items():
+          self._cache.pop(port, None)
+          self._cache[port] = (process, now + (PORT_USAGE_TTL if process else PORT_USAGE_UNKNOWN_TTL))
 
-    try:
-      if local_ports or remote_ports:
-        result.update(_process_for_ports(local_ports, remote_ports))
+        while len(self._cache) > PORT_USAGE_CACHE_SIZE:
+          self._cache.popitem(last = False)
 
-      self._processes_for_ports = result
       self._failure_count = 0
       return True
     except IOError as exc:
+      with self._lock:
+        for port, is_local in pending:
+          self._pending.setdefault(port, is_local)  # retry with our next run
+
       self._failure_count += 1
 
-      if self._failure_count >= 3:
-        stem.util.log.info('Failed three attempts to determine the process using active ports (%s)' % exc)
-        self.stop()
+      if self._use_proc:
+        if self._failure_count >= 3:
+          self._use_proc = False
+          self._failure_count = 0
+
+          stem.util.log.info('Failed three attempts to determine the process using active ports from proc, falling back to lsof (%s)' % exc)
+        else:
+          stem.util.log.debug('Unable to query the processes using ports from proc (%s)' % exc)
+      else:
+        if self._failure_count >= 3:
+          stem.util.log.info('Failed three attempts to determine the process using active ports (%s)' % exc)
+          self.stop()
+        else:
+          stem.util.log.debug('Unable to query the processes using ports usage lsof (%s)' % exc)
+
+      return False
+
+
+class DescriptorTracker(object):
+  """
+  Fetches relay descriptors in a background thread so callers, such as our
+  interface when drawing, never block on tor. Descriptors are retained in a
+  bounded cache with the least recently used evicted first. Entries are keyed
+  by the relay's fingerprint and publication time, so a new consensus listing
+  a republished descriptor makes us fetch it again.
+  """
+
+  def __init__(self):
+    self._cache = collections.OrderedDict()  # (fingerprint, published) => (descriptors, expiration), least recently used first
+    self._pending = collections.OrderedDict()  # fingerprints to fetch, in order of priority
+    self._pending_cond = threading.Condition()
+    self._listeners = []
+    self._fetching = None  # fingerprint our worker is presently fetching
+    self._worker = None
+
+  def fetch(self, fingerprint, timeout = 0):
+    """
+    Provides the descriptors of a relay. This retrieves the results from our
+    cache, so without a timeout it only works if we've already issued a
+    query() request for it and gotten results.
+
+    :param str fingerprint: relay to look up
+    :param float timeout: seconds to wait for the descriptors if we don't
+      have them yet, they're fetched ahead of other queries
+
+    :returns: :data:`~nyx.tracker.RelayDescriptors` of the relay
+
+    :raises: :class:`nyx.tracker.UnresolvedResult` if the descriptors are still
+      being fetched
+    """
+
+    key = _descriptor_cache_key(fingerprint)
+
+    with self._pending_cond:
+      if key not in self._cache and timeout > 0:
+        remaining = [fp for fp in self._pending if fp != fingerprint]
+        self._pending.clear()
+
+        for fp in [fingerprint] + remaining:
+          self._pending[fp] = True
+
+        self._start_worker()
+        wait_until = time.time() + timeout
+
+        while key not in self._cache and self._is_fetching(fingerprint) and time.time() < wait_until:
+          self._pending_cond.wait(wait_until - time.time())
+          key = _descriptor_cache_key(fingerprint)
+
+      try:
+        cached = self._cache.pop(key)
+        self._cache[key] = cached  # most recently used
+        return cached[0]
+      except KeyError:
+        raise UnresolvedResult()
+
+  def query(self, fingerprints):
+    """
+    Registers relays whose descriptors should be fetched, in order of
+    priority. Descriptors are only fetched if they're not cached, or their
+    cache entry has expired. Expired entries are still provided until we have
+    a replacement.
+
+    This replaces prior requests we haven't gotten to, so callers that move on
+    quickly (such as when scrolling) don't leave a backlog.
+
+    :param list fingerprints: relays to look up
+
+    :returns: **dict** mapping fingerprints to the
+      :data:`~nyx.tracker.RelayDescriptors` we already have
+    """
+
+    results, now = {}, time.time()
+    keys = [_descriptor_cache_key(fingerprint) for fingerprint in fingerprints]
+
+    with self._pending_cond:
+      self._pending.clear()
+
+      for fingerprint, key in zip(fingerprints, keys):
+        cached = self._cache.get(key)
+
+        if cached is not None:
+          results[fingerprint] = cached[0]
+
+        if fingerprint and (cached is None or cached[1] <= now):
+          self._pending[fingerprint] = True
+
+      if self._pending:
+        self._start_worker()
+
+    return results
+
+  def add_listener(self, listener):
+    """
+    Registers a callback to be notified with the fingerprint of each relay
+    we fetch descriptors for. This is called from our background thread.
+
+    :param functor listener: function to be notified
+    """
+
+    self._listeners.append(listener)
+
+  def _is_fetching(self, fingerprint):
+    # true if we're still working to get the descriptors of a relay
+
+    return fingerprint in self._pending or fingerprint == self._fetching
+
+  def _start_worker(self):
+    # notifies our worker of new requests, starting it if need be
+
+    self._pending_cond.notify_all()
+
+    if self._worker is None:
+      self._worker = threading.Thread(target = self._fetch_descriptors, name = 'DescriptorTracker')
+      self._worker.setDaemon(True)
+      self._worker.start()
+
+  def _fetch_descriptors(self):
+    while True:
+      with self._pending_cond:
+        while not self._pending:
+          self._pending_cond.wait()
+
+        fingerprint = self._pending.popitem(last = False)[0]
+        self._fetching = fingerprint
+
+      try:
+        controller = tor_controller()
+        key = _descriptor_cache_key(fingerprint)
+
+        descriptors = RelayDescriptors(
+          controller.get_network_status(fingerprint, None),
+          controller.get_server_descriptor(fingerprint, None),
+          controller.get_microdescriptor(fingerprint, None),
+        )
+      except Exception as exc:
+        stem.util.log.debug('Unable to fetch the descriptors of %s: %s' % (fingerprint, exc))
+        descriptors = None
+
+      with self._pending_cond:
+        self._fetching = None
+        self._pending_cond.notify_all()  # wakes callers waiting in fetch()
+
+        if descriptors is None:
+          continue  # failures aren't cached, so we'll try again when next queried
+
+        self._cache.pop(key, None)
+        self._cache[key] = (descriptors, time.time() + DESCRIPTOR_TTL)
+
+        while len(self._cache) > DESCRIPTOR_CACHE_SIZE:
+          self._cache.popitem(last = False)
+
+      for listener in self._listeners:
+        listener(fingerprint)
+
+
+def _descriptor_cache_key(fingerprint):
+  """
+  Provides the key our DescriptorTracker caches a relay's descriptors under.
+  Tor doesn't provide descriptor digests without querying it, so the
+  publication time from our consensus cache stands in for one.
+  """
+
+  relay_status = get_consensus_tracker().get_relay_status(fingerprint)
+  return (fingerprint, relay_status.published if relay_status else None)
+
+
+class LocaleTracker(object):
+  """
+  Provides the locale of addresses from tor's GeoIP database. If tor is local
+  we read its GeoIPFile and GeoIPv6File into sorted arrays of address ranges,
+  so lookups are a bisect rather than a GETINFO request. Otherwise, or if the
+  files can't be read, we ask tor and cache its responses.
+  """
+
+  def __init__(self):
+    self._ranges = {}  # address family => (range starts, range ends, locales)
+    self._cache = collections.OrderedDict()  # address => locale from tor (None if it can't be resolved), least recently used first
+    self._lock = threading.RLock()
+
+    controller = tor_controller()
+
+    if controller.is_localhost():
+      for family, option in ((socket.AF_INET, 'GeoIPFile'), (socket.AF_INET6, 'GeoIPv6File')):
+        path = controller.get_conf(option, None)
+
+        if not path:
+          continue
+
+        try:
+          start_time = time.time()
+          self._ranges[family] = _geoip_ranges(nyx.expand_path(path), family)
+          stem.util.log.info('Loaded %i address ranges from %s, took %0.2fs.' % (len(self._ranges[family][0]), path, time.time() - start_time))
+        except IOError as exc:
+          stem.util.log.info("Unable to read tor's GeoIP database, we'll ask tor for locales instead (%s)" % exc)
+
+  def get_locale(self, address):
+    """
+    Provides the locale of an address.
+
+    :param str address: address to be checked
+
+    :returns: **str** with the two letter country code of the address ('??'
+      if unknown), **None** if it cannot be determined
+    """
+
+    return self.get_locales([address]).get(address)
+
+  def get_locales(self, addresses):
+    """
+    Provides the locales of many addresses. Any we need to ask tor about are
+    requested together, falling back to a request for each if tor rejects the
+    batch (it fails as a whole if any address is invalid). Addresses tor can't
+    resolve are remembered so we don't ask again.
+
+    :param list addresses: addresses to be checked
+
+    :returns: **dict** mapping addresses to their two letter country code ('??'
+      if unknown), addresses that cannot be determined are omitted
+    """
+
+    results, unresolved = {}, []
+
+    for address in addresses:
+      locale = self._local_locale(address)
+
+      if locale is not None:
+        results[address] = locale
+      else:
+        unresolved.append(address)
+
+    if unresolved:
+      with self._lock:
+        for address in list(unresolved):
+          if address in self._cache:
+            locale = self._cache.pop(address)
+            self._cache[address] = locale  # most recently used
+            unresolved.remove(address)
+
+            if locale:
+              results[address] = locale
+
+    if unresolved:
+      unresolved = list(set(unresolved))
+      response = self._query_tor(['ip-to-country/%s' % address for address in unresolved])
+
+      with self._lock:
+        for address in unresolved:
+          key = 'ip-to-country/%s' % address
+
+          if key in response:
+            locale = response[key]
+            self._cache[address] = locale
+
+            if locale:
+              results[address] = locale
+
+        while len(self._cache) > LOCALE_CACHE_SIZE:
+          self._cache.popitem(last = False)
+
+    return results
+
+  def _query_tor(self, keys):
+    """
+    Asks tor for GETINFO keys. If tor rejects our request we ask for each key
+    individually, and those it still rejects are mapped to **None**. Keys are
+    omitted if we're unable to ask tor at all.
+    """
+
+    controller = tor_controller()
+
+    try:
+      return controller.get_info(keys)
+    except stem.SocketError:
+      return {}
+    except stem.ControllerError:
+      pass
+
+    response = {}
+
+    for key in keys:
+      try:
+        response[key] = controller.get_info(key)
+      except stem.SocketError:
+        break
+      except stem.ControllerError:
+        response[key] = None
+
+    return response
+
+  def _local_locale(self, address):
+    """
+    Provides the locale of an address from our GeoIP database, **None** if we
+    lack the database for its address family.
+    """
+
+    value = _address_value(address)
+
+    if value is None:
+      return None
+
+    ranges = self._ranges.get(socket.AF_INET6 if ':' in address else socket.AF_INET)
+
+    if ranges is None:
+      return None
+
+    starts, ends, locales = ranges
+    index = bisect.bisect_right(starts, value) - 1
+
+    if index >= 0 and value <= ends[index]:
+      return locales[index]
+    else:
+      return '??'
+
+
+class ExitPolicyMatcher(object):
+  """
+  Compiled form of an exit policy. Stem checks destinations against each rule
+  in turn, which is slow for policies with long reject lists. Instead we
+  divide ports into ranges that share the same rules, and divide the
+  addresses of those rules into sorted ranges with the verdict of the first
+  rule that covers them. Lookups are then a couple bisections, and their
+  results are memoized.
+
+  :var stem.exit_policy.ExitPolicy policy: policy we were compiled from
+  """
+
+  def __init__(self, policy, cache_size = EXIT_POLICY_CACHE_SIZE):
+    self.policy = policy
+
+    self._cache = collections.OrderedDict()  # (address, port) => bool
+    self._cache_size = cache_size
+    self._lock = threading.RLock()
+
+    self._is_exiting_allowed = policy.is_exiting_allowed()
+
+    # Destinations no rule applies to are allowed, except for microdescriptor
+    # policies which default to the opposite of their rules.
+
+    if isinstance(policy, stem.exit_policy.MicroExitPolicy):
+      self._default = not policy.is_accept
+    else:
+      self._default = True
+
+    # rules of the form (is_accept, ipv4 range, ipv6 range, min port, max port)
+    # with a **None** address range if the rule doesn't apply to that family
+
+    rules = []
+
+    for rule in policy:
+      if not rule.is_address_wildcard() and not rule.is_match(rule.address, rule.min_port):
+        continue  # tor ignores accept6/reject6 rules with an IPv4 address, so they never match
+
+      min_port, max_port = (0, 65535) if rule.is_port_wildcard() else (rule.min_port, rule.max_port)
+      address_type = rule.get_address_type()
+
+      if rule.is_address_wildcard():
+        ipv4_range, ipv6_range = (0, 2 ** 32 - 1), (0, 2 ** 128 - 1)
+      elif address_type == stem.exit_policy.AddressType.IPv4:
+        ipv4_range, ipv6_range = _address_range(rule.address, rule.get_masked_bits(), 32), None
       else:
-        stem.util.log.debug('Unable to query the processes using ports usage lsof (%s)' % exc)
+        ipv4_range, ipv6_range = None, _address_range(rule.address, rule.get_masked_bits(), 128)
+
+      rules.append((rule.is_accept, ipv4_range, ipv6_range, min_port, max_port))
+
+    # Port boundaries where the rules that apply change. Ports within the same
+    # bucket have identical rules, and buckets with the same rules share their
+    # compiled address ranges.
+
+    boundaries = set([0])
+
+    for rule in rules:
+      boundaries.update((rule[3], rule[4] + 1))
+
+    self._port_starts = sorted([port for port in boundaries if port <= 65535])
+    self._port_buckets = []
+    compiled = {}
+
+    for port in self._port_starts:
+      applicable = tuple([i for i, rule in enumerate(rules) if rule[3] <= port <= rule[4]])
+
+      if applicable not in compiled:
+        compiled[applicable] = (
+          self._compile([(rules[i][0], rules[i][1]) for i in applicable if rules[i][1]], 2 ** 32 - 1),
+          self._compile([(rules[i][0], rules[i][2]) for i in applicable if rules[i][2]], 2 ** 128 - 1),
+        )
+
+      self._port_buckets.append(compiled[applicable])
+
+  def can_exit_to(self, address, port):
+    """
+    Checks if our policy allows exiting to the given destination. This
+    matches stem's :func:`~stem.exit_policy.ExitPolicy.can_exit_to`.
+
+    :param str address: IPv4 or IPv6 address
+    :param int port: port number
+
+    :returns: **True** if exiting to this destination is allowed, **False**
+      otherwise
+    """
 
+    if not self._is_exiting_allowed:
       return False
 
+    destination = (address, port)
+
+    with self._lock:
+      if destination in self._cache:
+        result = self._cache.pop(destination)
+        self._cache[destination] = result
+        return result
+
+    address = address.lstrip('[').rstrip(']')
+    address_int = _address_value(address)
+
+    if address_int is None:
+      raise ValueError("'%s' isn't a valid IPv4 or IPv6 address" % address)
+
+    starts, verdicts = self._port_buckets[bisect.bisect_right(self._port_starts, port) - 1][1 if ':' in address else 0]
+    verdict = verdicts[bisect.bisect_right(starts, address_int) - 1]
+    result = self._default if verdict is None else verdict
+
+    with self._lock:
+      self._cache[destination] = result
+
+      while len(self._cache) > self._cache_size:
+        self._cache.popitem(last = False)
+
+    return result
+
+  @staticmethod
+  def _compile(rules, max_address):
+    """
+    Divides the address space into sorted ranges, each with the verdict of the
+    first rule that covers it.
+
+    :param list rules: (is_accept, (min address, max address)) tuples in
+      policy order
+    :param int max_address: largest address of this family
+
+    :returns: **tuple** of the form (starts, verdicts), where a verdict is
+      **None** if no rule covers the range
+    """
+
+    boundaries = set([0])
+
+    for is_accept, (min_address, max_address_of_rule) in rules:
+      boundaries.add(min_address)
+
+      if max_address_of_rule < max_address:
+        boundaries.add(max_address_of_rule + 1)
+
+    starts = sorted(boundaries)
+    verdicts = [None] * len(starts)
+
+    # Earlier rules take precedence, so each range keeps the first verdict it's
+    # given. Ranges that have been decided are skipped over with a union-find.
+
+    next_undecided = list(range(len(starts) + 1))
+
+    def find(index):
+      while next_undecided[index] != index:
+        next_undecided[index] = next_undecided[next_undecided[index]]
+        index = next_undecided[index]
+
+      return index
+
+    for is_accept, (min_address, max_address_of_rule) in rules:
+      end = bisect.bisect_right(starts, max_address_of_rule)
+      index = find(bisect.bisect_left(starts, min_address))
+
+      while index < end:
+        verdicts[index] = is_accept
+        next_undecided[index] = index + 1
+        index = find(index + 1)
+
+    return starts, verdicts
+
+
+class RingBuffer(object):
+  """
+  Fixed size buffer of our most recently appended values. This is backed by
+  an array so appending doesn't allocate.
+  """
+
+  def __init__(self, size):
+    self._values = array.array('d', [0.0] * size)
+    self._index = 0  # position our next value is written to
+    self._count = 0
+
+  def append(self, value):
+    """
+    Adds a value, replacing our oldest if we're full.
+
+    :param float value: value to be added
+    """
+
+    self._values[self._index] = value
+    self._index = (self._index + 1) % len(self._values)
+    self._count = min(self._count + 1, len(self._values))
+
+  def values(self):
+    """
+    Provides our values from oldest to newest.
+
+    :returns: **list** of **float** values
+    """
+
+    if self._count < len(self._values):
+      return self._values[:self._count].tolist()
+    else:
+      return (self._values[self._index:] + self._values[:self._index]).tolist()
+
+  def clear(self):
+    """
+    Removes all of our values.
+    """
+
+    self._index = 0
+    self._count = 0
+
+  def __len__(self):
+    return self._count
+
+
+class ProcSampler(object):
+  """
+  Reads the resource usage of a process from proc. Unlike stem's proc helpers
+  we keep the files we need open, re-read them in place, and only parse the
+  fields we use. Values that don't change (like the process' start time and
+  our total memory) are only read once.
+
+  :var int pid: process we're sampling
+  """
+
+  def __init__(self, pid, proc_path = '/proc'):
+    self.pid = pid
+    self._fds = []
+
+    try:
+      self._stat_fd = self._open('%s/%s/stat' % (proc_path, pid))
+      self._status_fd = self._open('%s/%s/status' % (proc_path, pid))
+
+      self._clock_ticks = float(os.sysconf('SC_CLK_TCK'))
+      self._total_memory = ProcSampler._field(self._read_file('%s/meminfo' % proc_path), b'MemTotal:') * 1024
+      boot_time = ProcSampler._field(self._read_file('%s/stat' % proc_path), b'btime')
+      self._start_time = boot_time + self._stat_fields()[2] / self._clock_ticks
+    except:
+      self.close()
+      raise
+
+  def sample(self):
+    """
+    Provides the process' present resource usage. This returns a tuple of the
+    form...
+
+      (total_cpu_time, uptime, memory_in_bytes, memory_in_percent)
+
+    :returns: **tuple** with the resource usage information
+
+    :raises: **IOError** if unsuccessful
+    """
+
+    utime, stime, _ = self._stat_fields()
+    memory_in_bytes = ProcSampler._field(self._read(self._status_fd), b'VmRSS:') * 1024
+
+    total_cpu_time = (utime + stime) / self._clock_ticks
+    uptime = time.time() - self._start_time
+
+    return (total_cpu_time, uptime, memory_in_bytes, float(memory_in_bytes) / self._total_memory)
+
+  def close(self):
+    """
+    Closes our proc files.
+    """
+
+    while self._fds:
+      os.close(self._fds.pop())
+
+  def _open(self, path):
+    try:
+      fd = os.open(path, os.O_RDONLY)
+    except OSError as exc:
+      raise IOError("unable to read '%s': %s" % (path, exc))
+
+    self._fds.append(fd)
+    return fd
+
+  def _read(self, fd):
+    try:
+      if hasattr(os, 'pread'):
+        return os.pread(fd, 8192, 0)  # added in python 3.3
+      else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        return os.read(fd, 8192)
+    except OSError as exc:
+      raise IOError('unable to read proc contents for pid %s: %s' % (self.pid, exc))
+
+  def _read_file(self, path):
+    try:
+      with open(path, 'rb') as proc_file:
+        return proc_file.read()
+    except IOError as exc:
+      raise IOError("unable to read '%s': %s" % (path, exc))
+
+  def _stat_fields(self):
+    """
+    Provides the utime, stime, and starttime of our process' stat file, all in
+    clock ticks.
+    """
+
+    # The command can contain spaces and parentheses, so fields are relative
+    # to its closing parenthesis.
+
+    contents = self._read(self._stat_fd)
+    fields = contents[contents.rfind(b')') + 2:].split()
+
+    try:
+      return int(fields[11]), int(fields[12]), int(fields[19])
+    except (IndexError, ValueError):
+      raise IOError('unrecognized stat contents for pid %s: %s' % (self.pid, contents))
+
+  @staticmethod
+  def _field(contents, label):
+    start = contents.find(label)
+
+    if start == -1:
+      raise IOError("proc contents lack a '%s' field" % label.decode('ascii'))
+
+    try:
+      return int(contents[start + len(label):contents.find(b'\n', start)].split()[0])
+    except (IndexError, ValueError):
+      raise IOError("malformed '%s' field in proc contents" % label.decode('ascii'))
+
 
 class ConsensusTracker(object):
   """
@@ -811,6 +2444,25 @@ class ConsensusTracker(object):
     self._my_router_status_entry = None
     self._my_router_status_entry_time = 0
 
+    # Our own address and ORPorts, along with the controller snapshot they're
+    # from. These are only rebuilt when our snapshot changes.
+
+    self._my_relay = (None, None, {})
+
+    # In-memory index of packed addresses to {or_port => fingerprint}, so
+    # lookups are a hash probe rather than a cache query. This is replaced
+    # wholesale when relay information changes.
+
+    self._relay_index = None
+    self._relay_index_stats = RelayIndexStats(0, 0, 0.0, 0)
+
+    # Digest of the relays in our cache, mapping fingerprints to a hash of
+    # their consensus information. New consensus are compared against this so
+    # we only write the relays that changed.
+
+    self._digest = None
+    self._last_update = None
+
     # Stem's get_network_statuses() is slow, and overkill for what we need
     # here. Just parsing the raw GETINFO response to cut startup time down.
     #
@@ -824,34 +2476,186 @@ class ConsensusTracker(object):
       stem.util.log.info('Cache is only %s old, no need to refresh it.' % str_tools.time_label(cache_age, is_long = True))
     else:
       stem.util.log.info('Cache is %s old, refreshing relay information.' % str_tools.time_label(cache_age, is_long = True))
-      ns_response = controller.get_info('ns/all', None)
 
-      if ns_response:
-        self._update(ns_response)
+      # Reading tor's cached consensus from disk is preferable since it keeps
+      # several megabytes off our control connection.
+
+      start_time = time.time()
+      data_directory = controller.get_conf('DataDirectory', None) if controller.is_localhost() else None
+
+      try:
+        if not data_directory:
+          raise IOError('unable to determine the data directory')
+
+        self._record_relays(_cached_consensus_relays(nyx.expand_path(data_directory)), start_time)
+      except IOError as exc:
+        stem.util.log.info("Unable to read tor's cached consensus, requesting it instead (%s)" % exc)
+        ns_response = controller.get_info('ns/all', None)
 
-    controller.add_event_listener(lambda event: self._update(event.consensus_content), stem.control.EventType.NEWCONSENSUS)
+        if ns_response:
+          self._update(ns_response)
+
+    if self._relay_index is None:
+      cached_relays = nyx.cache().relays(include_status = True)
+      self._digest = _relay_digest(cached_relays)
+      self._build_index([(relay[1], relay[2], relay[0]) for relay in cached_relays])
+
+    # Processing a consensus takes a while, so we do so in a worker thread
+    # rather than stem's event thread. Otherwise events such as BW queue up
+    # behind us. If consensus arrive faster than we can process them only the
+    # newest is used.
+
+    self._pending_consensus = None
+    self._pending_consensus_cond = threading.Condition()
+    self._consensus_worker = None
+
+    controller.add_event_listener(self._new_consensus_event, stem.control.EventType.NEWCONSENSUS)
+
+  def _new_consensus_event(self, event):
+    with self._pending_consensus_cond:
+      self._pending_consensus = event.consensus_content
+      self._pending_consensus_cond.notify()
+
+      if self._consensus_worker is None:
+        self._consensus_worker = threading.Thread(target = self._process_consensus, name = 'ConsensusTracker')
+        self._consensus_worker.setDaemon(True)
+        self._consensus_worker.start()
+
+  def _process_consensus(self):
+    while True:
+      with self._pending_consensus_cond:
+        while self._pending_consensus is None:
+          self._pending_consensus_cond.wait()
+
+        consensus_content, self._pending_consensus = self._pending_consensus, None
+
+      try:
+        self._update(consensus_content)
+      except Exception as exc:
+        stem.util.log.warn('Unable to process the new consensus: %s' % exc)
 
   def _update(self, consensus_content):
-    start_time = time.time()
+    self._record_relays(_consensus_relays(consensus_content), time.time())
+
+  def _record_relays(self, relays, start_time):
     our_fingerprint = tor_controller().get_info('fingerprint', None)
+    cache = nyx.cache()
+    digest = _relay_digest(relays)
+
+    # Our timestamp is only updated with the last chunk, so if we're
+    # interrupted we'll refresh the cache when next started.
 
-    with nyx.cache().write() as writer:
-      for line in consensus_content.splitlines():
-        if line.startswith('r '):
-          r_comp = line.split(' ')
+    if not self._digest:
+      for i in range(0, len(relays), CONSENSUS_CHUNK_SIZE):
+        with cache.write() as writer:
+          writer.record_relays(relays[i:i + CONSENSUS_CHUNK_SIZE], is_complete = i + CONSENSUS_CHUNK_SIZE >= len(relays))
 
-          address = r_comp[6]
-          or_port = int(r_comp[7])
-          fingerprint = stem.descriptor.router_status_entry._base64_to_hex(r_comp[2])
-          nickname = r_comp[1]
+      changed, removed = relays, []
+      self._last_update = ConsensusUpdate(len(relays), 0, 0, time.time() - start_time, True)
+    else:
+      changed = [relay for relay in relays if self._digest.get(relay[0]) != digest[relay[0]]]
+      removed = [fingerprint for fingerprint in self._digest if fingerprint not in digest]
+      added_count = len([relay for relay in changed if relay[0] not in self._digest])
 
-          if fingerprint == our_fingerprint:
-            self._my_router_status_entry = None
-            self._my_router_status_entry_time = 0
+      # prior locations of relays, which we need to drop from our index
 
-          writer.record_relay(fingerprint, address, or_port, nickname)
+      prior_addresses = dict([(fingerprint, cache.relay_address(fingerprint)) for fingerprint in [relay[0] for relay in changed if relay[0] in self._digest] + removed])
 
-    stem.util.log.info('Updated consensus cache, took %0.2fs.' % (time.time() - start_time))
+      for i in range(0, max(1, len(changed)), CONSENSUS_CHUNK_SIZE):
+        is_complete = i + CONSENSUS_CHUNK_SIZE >= len(changed)
+
+        with cache.write() as writer:
+          writer.update_relays(changed[i:i + CONSENSUS_CHUNK_SIZE], removed if is_complete else [], is_complete = is_complete)
+
+      self._update_index(changed, removed, prior_addresses)
+      self._last_update = ConsensusUpdate(added_count, len(changed) - added_count, len(removed), time.time() - start_time, False)
+
+    self._digest = digest
+
+    if our_fingerprint in [relay[0] for relay in changed] or our_fingerprint in removed:
+      self._my_router_status_entry = None
+      self._my_router_status_entry_time = 0
+
+    if self._last_update.is_full:
+      stem.util.log.info('Updated consensus cache, took %0.2fs.' % self._last_update.duration)
+      self._build_index([(relay[1], relay[2], relay[0]) for relay in relays])
+    else:
+      stem.util.log.info('Updated consensus cache with %i new, %i changed, and %i removed relays, took %0.3fs.' % (self._last_update.added, self._last_update.changed, self._last_update.removed, self._last_update.duration))
+
+  def _update_index(self, changed, removed, prior_addresses):
+    """
+    Applies relay changes to a copy of our address index and swaps it in. Port
+    mappings are replaced rather than modified, since callers may hold them.
+
+    :param list changed: relay tuples that are new or changed
+    :param list removed: fingerprints of relays that are gone
+    :param dict prior_addresses: fingerprints to their prior (address, or_port)
+    """
+
+    start_time = time.time()
+    index = dict(self._relay_index) if self._relay_index else {}
+
+    for fingerprint, prior_address in prior_addresses.items():
+      packed_address = _pack_address(prior_address[0]) if prior_address else None
+      ports = index.get(packed_address)
+
+      if ports and ports.get(prior_address[1]) == fingerprint:
+        ports = dict(ports)
+        del ports[prior_address[1]]
+
+        if ports:
+          index[packed_address] = ports
+        else:
+          del index[packed_address]
+
+    for fingerprint, address, or_port in [relay[:3] for relay in changed]:
+      packed_address = _pack_address(address)
+
+      if packed_address is not None:
+        ports = dict(index.get(packed_address, {}))
+        ports[or_port] = fingerprint
+        index[packed_address] = ports
+
+    self._relay_index = index
+    self._relay_index_stats = RelayIndexStats(sum([len(ports) for ports in index.values()]), len(index), time.time() - start_time, _index_memory(index))
+
+  def _build_index(self, relays):
+    """
+    Builds our relay address index and swaps it in.
+
+    :param list relays: (address, or_port, fingerprint) tuples to be indexed
+    """
+
+    start_time = time.time()
+    index = {}
+
+    for address, or_port, fingerprint in relays:
+      packed_address = _pack_address(address)
+
+      if packed_address is not None:
+        index.setdefault(packed_address, {})[or_port] = fingerprint
+
+    memory_bytes = _index_memory(index)
+    self._relay_index = index
+    self._relay_index_stats = RelayIndexStats(len(relays), len(index), time.time() - start_time, memory_bytes)
+
+    stem.util.log.info('Indexed %i relays at %i addresses (%s), took %0.3fs.' % (len(relays), len(index), str_tools.size_label(memory_bytes, 1), self._relay_index_stats.build_time))
+
+  def _my_relay_ports(self):
+    """
+    Provides our own address and ORPorts. This is refreshed when our
+    controller snapshot is, such as when tor's configuration changes.
+
+    :returns: **tuple** of the form (address, {or_port => fingerprint})
+    """
+
+    snapshot = controller_snapshot()
+
+    if snapshot is not self._my_relay[0]:
+      ports = snapshot.or_ports if snapshot.fingerprint else ()
+      self._my_relay = (snapshot, snapshot.address, dict([(port, snapshot.fingerprint) for port in ports]))
+
+    return self._my_relay[1:]
 
   def my_router_status_entry(self):
     """
@@ -896,16 +2700,33 @@ class ConsensusTracker(object):
     :returns: **dict** of ORPorts to their fingerprint
     """
 
-    controller = tor_controller()
+    my_address, my_ports = self._my_relay_ports()
 
-    if controller.get_info('address', None) == address:
-      fingerprint = controller.get_info('fingerprint', None)
-      ports = controller.get_ports(stem.control.Listener.OR, None)
+    if my_ports and address == my_address:
+      return my_ports
+    elif self._relay_index is None:
+      return nyx.cache().relays_for_address(address)
 
-      if fingerprint and ports:
-        return dict([(port, fingerprint) for port in ports])
+    return self._relay_index.get(_pack_address(address), {})
 
-    return nyx.cache().relays_for_address(address)
+  def get_index_stats(self):
+    """
+    Provides statistics about our in-memory relay address index.
+
+    :returns: :data:`~nyx.tracker.RelayIndexStats` for our present index
+    """
+
+    return self._relay_index_stats
+
+  def get_last_update(self):
+    """
+    Provides the changes made by the last consensus we processed.
+
+    :returns: :data:`~nyx.tracker.ConsensusUpdate` for our last update, or
+      **None** if we haven't processed a consensus
+    """
+
+    return self._last_update
 
   def get_relay_address(self, fingerprint, default):
     """
@@ -916,13 +2737,24 @@ class ConsensusTracker(object):
     :returns: **tuple** with a **str** address and **int** port
     """
 
-    controller = tor_controller()
-
-    if fingerprint == controller.get_info('fingerprint', None):
-      my_address = controller.get_info('address', None)
-      my_or_ports = controller.get_ports(stem.control.Listener.OR, [])
+    snapshot = controller_snapshot()
 
-      if my_address and len(my_or_ports) == 1:
-        return (my_address, my_or_ports[0])
+    if fingerprint == snapshot.fingerprint:
+      if snapshot.address and len(snapshot.or_ports) == 1:
+        return (snapshot.address, list(snapshot.or_ports)[0])
 
     return nyx.cache().relay_address(fingerprint, default)
+
+  def get_relay_status(self, fingerprint):
+    """
+    Provides the consensus information we have for a relay, such as its flags
+    and bandwidth. This is read from our cache rather than tor, so it's cheap
+    enough to call when drawing.
+
+    :param str fingerprint: relay to look up
+
+    :returns: :data:`~nyx.RelayStatus` of the relay, **None** if it isn't in
+      the consensus
+    """
+
+    return nyx.cache().relay_status(fingerprint) if fingerprint else None
@@ -8,9 +8,14 @@ import os
 import time
 import unittest
 
+import stem
+import stem.control
+import stem.exit_policy
+
 import nyx.curses
+import nyx.tracker
 
-from nyx import expand_path, chroot, join, uses_settings
+from nyx import batch_query, controller_snapshot, expand_path, chroot, join, uses_settings, _address_value, _pack_address
 
 try:
   # added in python 3.3
@@ -113,6 +118,66 @@ def render(func, *args, **kwargs):
   return RenderResult(attr.get('content'), attr.get('return_value'), attr.get('runtime'))
 
 
+def snapshot(**attr):
+  """
+  Provides a controller snapshot for tests, with the given attributes and
+  blank defaults for everything else.
+
+  :returns: :data:`~nyx.ControllerSnapshot` with our attributes
+  """
+
+  defaults = {
+    'or_ports': frozenset(),
+    'dir_ports': frozenset(),
+    'socks_ports': frozenset(),
+    'control_ports': frozenset(),
+    'exit_policy': None,
+    'exit_matcher': None,
+    'hidden_service_conf': {},
+    'hidden_service_targets': frozenset(),
+    'address': None,
+    'fingerprint': None,
+    'is_geoip_unavailable': False,
+    'timestamp': time.time(),
+  }
+
+  defaults.update(attr)
+
+  if defaults['exit_policy'] and not defaults['exit_matcher']:
+    defaults['exit_matcher'] = nyx.tracker.ExitPolicyMatcher(defaults['exit_policy'])
+
+  return nyx.ControllerSnapshot(**defaults)
+
+
+def conf_map(values):
+  """
+  Provides a replacement for stem's get_conf_map() method that responds in
+  the same shape as a real controller.
+
+  :param dict values: configuration options mapped to a **list** of their
+    values, which is empty if they're unset
+
+  :returns: **function** that can be used as a mock's side_effect
+  """
+
+  def get_conf_map(params, default = stem.control.UNDEFINED, multiple = True):
+    result = {}
+
+    for param in params:
+      param_values = values.get(param, [])
+
+      if param_values:
+        result[param] = param_values if multiple else param_values[0]
+      elif default != stem.control.UNDEFINED:
+        result[param] = default
+      else:
+        result[param] = [] if multiple else None
+
+    return result
+
+  return get_conf_map
+
+
 class TestBaseUtil(unittest.TestCase):
   def setUp(self):
     nyx.CHROOT = None
@@ -150,6 +215,124 @@ class TestBaseUtil(unittest.TestCase):
     self.assertEqual('', chroot())
     config.set('tor_chroot', None)
 
+  @patch('nyx.tor_controller')
+  @patch('nyx.UNBATCHED_GETINFO', set())
+  def test_batch_query(self, tor_controller_mock):
+    info = {'version': '0.4.2.7', 'address': '128.31.0.34'}
+
+    def get_info(params, *args):
+      if isinstance(params, list):
+        return dict([(param, get_info(param)) for param in params])
+      elif params not in info:
+        raise stem.InvalidArguments('552', 'Not running in server mode')
+
+      return info[params]
+
+    tor_controller_mock().get_info.side_effect = get_info
+    tor_controller_mock().get_conf_map.side_effect = conf_map({'Nickname': ['caerSidi'], 'DirPort': [], 'CookieAuthentication': ['1']})
+
+    response = batch_query(info = {'version': 'Unknown', 'address': 'Unknown'}, conf = {'Nickname': '', 'DirPort': '0', 'CookieAuthentication': None})
+    self.assertEqual({'version': '0.4.2.7', 'address': '128.31.0.34'}, response.info)
+    self.assertEqual({'Nickname': 'caerSidi', 'DirPort': '0', 'CookieAuthentication': '1'}, response.conf)
+    self.assertEqual(1, tor_controller_mock().get_info.call_count)
+    self.assertEqual(1, tor_controller_mock().get_conf_map.call_count)
+
+    # unavailable keys fail the whole request, so we fall back to asking for
+    # each and leave the ones that fail out of future batches
+
+    response = batch_query(info = {'version': 'Unknown', 'fingerprint': 'Unknown'})
+    self.assertEqual({'version': '0.4.2.7', 'fingerprint': 'Unknown'}, response.info)
+    self.assertEqual(set(['fingerprint']), nyx.UNBATCHED_GETINFO)
+
+    tor_controller_mock().get_info.reset_mock()
+    batch_query(info = {'version': 'Unknown', 'fingerprint': 'Unknown'})
+    self.assertEqual([(['version'],), ('fingerprint',)], [call[0] for call in tor_controller_mock().get_info.call_args_list])
+
+    # and they're batched again once available
+
+    info['fingerprint'] = '9695DFC35FFEB861329B9F1AB04C46397020CE31'
+    response = batch_query(info = {'version': 'Unknown', 'fingerprint': 'Unknown'})
+    self.assertEqual('9695DFC35FFEB861329B9F1AB04C46397020CE31', response.info['fingerprint'])
+    self.assertEqual(set(), nyx.UNBATCHED_GETINFO)
+
+  @patch('nyx.tor_controller')
+  @patch('nyx.CONTROLLER_SNAPSHOT', None)
+  @patch('nyx.SNAPSHOT_LISTENING_TO', None)
+  @patch('nyx.SNAPSHOT_GENERATION', 0)
+  @patch('nyx.EXIT_MATCHER', None)
+  def test_controller_snapshot(self, tor_controller_mock):
+    controller = tor_controller_mock()
+    controller.get_ports.side_effect = lambda listener, default: {stem.control.Listener.OR: [9001], stem.control.Listener.CONTROL: [9051]}.get(listener, default)
+    controller.get_info.side_effect = lambda param, default = None: {'address': '128.31.0.34'}.get(param, default)
+    controller.get_hidden_service_conf.return_value = {'/var/lib/tor/hs/': {'HiddenServicePort': [(80, '127.0.0.1', 8080), (443, 'localhost', 8443)]}}
+    controller.is_geoip_unavailable.return_value = False
+    controller.get_exit_policy.return_value = stem.exit_policy.ExitPolicy('accept *:22', 'reject *:*')
+
+    snapshot = controller_snapshot()
+    self.assertEqual(frozenset([9001]), snapshot.or_ports)
+    self.assertEqual(frozenset(), snapshot.dir_ports)
+    self.assertEqual(frozenset([9051]), snapshot.control_ports)
+    self.assertEqual(frozenset([('127.0.0.1', 8080), ('127.0.0.1', 8443), ('::1', 8443)]), snapshot.hidden_service_targets)
+    self.assertEqual('128.31.0.34', snapshot.address)
+    self.assertEqual(None, snapshot.fingerprint)
+
+    # subsequent calls are answered without asking tor
+
+    self.assertTrue(snapshot is controller_snapshot())
+    self.assertEqual(1, controller.get_hidden_service_conf.call_count)
+
+    # configuration changes, resets, and address changes refetch our snapshot
+
+    conf_listener = [call[0][0] for call in controller.add_event_listener.call_args_list if call[0][1] == stem.control.EventType.CONF_CHANGED][0]
+    address_listener = [call[0][0] for call in controller.add_event_listener.call_args_list if call[0][1] == stem.control.EventType.STATUS_SERVER][0]
+    status_listener = controller.add_status_listener.call_args[0][0]
+
+    conf_listener(Mock())
+    self.assertFalse(snapshot is controller_snapshot())
+
+    # our compiled exit policy is kept until the policy changes
+
+    self.assertTrue(snapshot.exit_matcher is controller_snapshot().exit_matcher)
+
+    controller.get_exit_policy.return_value = stem.exit_policy.ExitPolicy('reject *:*')
+    conf_listener(Mock())
+    self.assertFalse(controller_snapshot().exit_matcher.can_exit_to('75.119.206.243', 22))
+
+    status_listener(controller, stem.control.State.RESET, 1234.5)
+    controller_snapshot()
+
+    address_listener(Mock(action = 'CHECKING_REACHABILITY'))
+    controller_snapshot()
+    self.assertEqual(4, controller.get_hidden_service_conf.call_count)
+
+    address_listener(Mock(action = 'EXTERNAL_ADDRESS'))
+    controller_snapshot()
+    self.assertEqual(5, controller.get_hidden_service_conf.call_count)
+
+    # and are only registered once
+
+    self.assertEqual(1, controller.add_status_listener.call_count)
+
+    # changes while we're building a snapshot mean we don't keep it
+
+    controller.get_hidden_service_conf.side_effect = lambda default: conf_listener(Mock()) or {}
+    address_listener(Mock(action = 'EXTERNAL_ADDRESS'))
+    snapshot = controller_snapshot()
+
+    controller.get_hidden_service_conf.side_effect = None
+    self.assertFalse(snapshot is controller_snapshot())
+    self.assertEqual(7, controller.get_hidden_service_conf.call_count)
+
+  def test_address_helpers(self):
+    self.assertEqual(b'\x4b\x77\xce\xf3', _pack_address('75.119.206.243'))
+    self.assertEqual(16, len(_pack_address('2001:db8::1')))
+    self.assertEqual(1266142963, _address_value('75.119.206.243'))
+    self.assertEqual((0x20010db8 << 96) + 1, _address_value('2001:db8::1'))
+
+    for malformed in ('not an address', '256.0.0.1', '2001:db8::1::2', None):
+      self.assertEqual(None, _pack_address(malformed))
+      self.assertEqual(None, _address_value(malformed))
+
   def test_join(self):
     # check our pydoc examples
 
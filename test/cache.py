@@ -2,8 +2,11 @@
 Unit tests for nyx.cache.
 """
 
+import datetime
+import os
 import re
 import tempfile
+import threading
 import time
 import unittest
 
@@ -51,6 +54,40 @@ class TestCache(unittest.TestCase):
         cache = nyx.cache()
         self.assertEqual('caersidi', cache.relay_nickname('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66'))
 
+  def test_reads_during_write(self):
+    """
+    Reads from other threads see the last commit rather than waiting on an
+    ongoing write.
+    """
+
+    with tempfile.NamedTemporaryFile(suffix = '.sqlite') as tmp:
+      with patch('nyx.data_directory', Mock(return_value = tmp.name)):
+        cache = nyx.cache()
+        self.assertEqual('wal', cache._query('PRAGMA journal_mode').fetchone()[0])
+
+        with cache.write() as writer:
+          writer.record_relay('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', '208.113.165.162', 1443, 'caersidi')
+
+        results = []
+
+        def lookup():
+          results.append(cache._query('SELECT nickname FROM relays').fetchall())
+
+        with cache.write() as writer:
+          writer.record_relay('9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.34', 9101, 'moria1')
+
+          with cache._conn_lock:
+            lookup_thread = threading.Thread(target = lookup)
+            lookup_thread.start()
+            lookup_thread.join(2)
+
+        self.assertEqual([[('caersidi',)]], results)
+        self.assertEqual(2, len(cache.relays()))
+
+        for path in (tmp.name + '-wal', tmp.name + '-shm'):
+          if os.path.exists(path):
+            os.remove(path)
+
   @patch('nyx.data_directory', Mock(return_value = None))
   def test_relays_for_address(self):
     """
@@ -107,6 +144,173 @@ class TestCache(unittest.TestCase):
 
     self.assertEqual(None, cache.relay_address('66E1D8F00C49820FE8AA26003EC49B6F069E8AE3'))
 
+  @patch('nyx.data_directory', Mock(return_value = None))
+  def test_relays(self):
+    """
+    Basic checks for listing all cached relays.
+    """
+
+    cache = nyx.cache()
+    self.assertEqual([], cache.relays())
+
+    with cache.write() as writer:
+      writer.record_relay('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', '208.113.165.162', 1443, 'caersidi')
+      writer.record_relay('9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.34', 9101, 'moria1')
+
+    self.assertEqual([
+      ('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', '208.113.165.162', 1443, 'caersidi'),
+      ('9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.34', 9101, 'moria1'),
+    ], sorted(cache.relays()))
+
+  @patch('nyx.data_directory', Mock(return_value = None))
+  def test_relay_status(self):
+    """
+    Basic checks for fetching the consensus information of relays.
+    """
+
+    cache = nyx.cache()
+
+    with cache.write() as writer:
+      writer.record_relay('9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.34', 9101, 'moria1', 9131, '2012-08-06 11:19:31', ['Authority', 'Fast'], 20)
+      writer.record_relay('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', '208.113.165.162', 1443, 'caersidi')
+
+    self.assertEqual(nyx.RelayStatus('9695DFC35FFEB861329B9F1AB04C46397020CE31', 'moria1', '128.31.0.34', 9101, 9131, datetime.datetime(2012, 8, 6, 11, 19, 31), ('Authority', 'Fast'), 20), cache.relay_status('9695DFC35FFEB861329B9F1AB04C46397020CE31'))
+    self.assertEqual(nyx.RelayStatus('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', 'caersidi', '208.113.165.162', 1443, None, None, (), None), cache.relay_status('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66'))
+    self.assertEqual(None, cache.relay_status('66E1D8F00C49820FE8AA26003EC49B6F069E8AE3'))
+    self.assertEqual(None, cache.relay_status('invalid'))
+
+    self.assertEqual([
+      ('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', '208.113.165.162', 1443, 'caersidi', None, None, (), None),
+      ('9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.34', 9101, 'moria1', 9131, '2012-08-06 11:19:31', ('Authority', 'Fast'), 20),
+    ], sorted(cache.relays(include_status = True)))
+
+    with cache.write() as writer:
+      self.assertRaises(ValueError, writer.record_relay, '9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.34', 9101, 'moria1', 99999)
+
+  @patch('nyx.data_directory', Mock(return_value = None))
+  def test_record_relays(self):
+    """
+    Record relays in bulk, skipping malformed entries.
+    """
+
+    cache = nyx.cache()
+    before = time.time()
+
+    with cache.write() as writer:
+      self.assertEqual(2, writer.record_relays([
+        ('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', '208.113.165.162', 1443, 'caersidi'),
+        ('9695DFC35FFEB861329B9F1AB04C46397020CE31', '2001:858:2:2:aabb:0:563b:1526', 9101, 'moria1'),
+        ('9695DFC35FFEB861329B9F1AB04C46397020CE3', '128.31.0.34', 9101, 'moria1'),
+        ('74A910646BCEEFBCD2E874FC1DC997430F968145', '208.113.165.162', 1543, 'caer sidi'),
+        ('74A910646BCEEFBCD2E874FC1DC997430F968145', '208.113.165', 1543, 'caersidi2'),
+        ('74A910646BCEEFBCD2E874FC1DC997430F968145', '208.113.165.162', 0, 'caersidi2'),
+      ]))
+
+    self.assertEqual([
+      ('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', '208.113.165.162', 1443, 'caersidi'),
+      ('9695DFC35FFEB861329B9F1AB04C46397020CE31', '2001:858:2:2:aabb:0:563b:1526', 9101, 'moria1'),
+    ], sorted(cache.relays()))
+
+    self.assertTrue(cache.relays_updated_at() >= before)
+
+  def test_removing_stale_relays(self):
+    """
+    Relays that aren't a part of a complete update are removed, and their
+    space is reclaimed.
+    """
+
+    caersidi = ('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', '208.113.165.162', 1443, 'caersidi')
+    moria1 = ('9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.34', 9101, 'moria1')
+    relays = [('%040X' % i, '10.0.%i.%i' % (i // 256, i % 256), 9001, 'relay%i' % i) for i in range(2000)]
+
+    with tempfile.NamedTemporaryFile(suffix = '.sqlite') as tmp:
+      with patch('nyx.data_directory', Mock(return_value = tmp.name)):
+        cache = nyx.cache()
+
+        with cache.write() as writer:
+          writer.record_relays(relays + [caersidi])
+
+        self.assertEqual(2001, len(cache.relays()))
+
+        # updates in multiple parts only remove relays when complete
+
+        with cache.write() as writer:
+          writer.record_relays([moria1], is_complete = False)
+
+        self.assertEqual(2002, len(cache.relays()))
+
+        with cache.write() as writer:
+          writer.record_relays([caersidi])
+
+        self.assertEqual([caersidi, moria1], sorted(cache.relays()))
+        self.assertEqual(0, cache._query('PRAGMA freelist_count').fetchone()[0])
+
+        # relays recorded individually last until the next complete update
+
+        with cache.write() as writer:
+          writer.record_relay(*relays[0])
+          writer.record_relays([caersidi], is_complete = False)
+
+        self.assertEqual(3, len(cache.relays()))
+
+        with cache.write() as writer:
+          writer.record_relays([moria1])
+
+        self.assertEqual([caersidi, moria1], sorted(cache.relays()))
+
+        for path in (tmp.name + '-wal', tmp.name + '-shm'):
+          if os.path.exists(path):
+            os.remove(path)
+
+  @patch('nyx.data_directory', Mock(return_value = None))
+  def test_memoized_lookups(self):
+    """
+    Repeated lookups are memoized until the cache is written to.
+    """
+
+    cache = nyx.cache()
+
+    with cache.write() as writer:
+      writer.record_relay('9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.34', 9101, 'moria1')
+
+    self.assertEqual(nyx.CacheStats(0, 0, 0, 1), cache.lookup_stats())
+
+    for i in range(3):
+      self.assertEqual('moria1', cache.relay_nickname('9695DFC35FFEB861329B9F1AB04C46397020CE31'))
+      self.assertEqual(('128.31.0.34', 9101), cache.relay_address('9695DFC35FFEB861329B9F1AB04C46397020CE31'))
+      self.assertEqual({9101: '9695DFC35FFEB861329B9F1AB04C46397020CE31'}, cache.relays_for_address('128.31.0.34'))
+      self.assertEqual('Unknown', cache.relay_nickname('74A910646BCEEFBCD2E874FC1DC997430F968145', 'Unknown'))
+
+    self.assertEqual(nyx.CacheStats(8, 4, 4, 1), cache.lookup_stats())
+
+    # callers can't modify our memoized results
+
+    cache.relays_for_address('128.31.0.34')[9102] = 'foo'
+    self.assertEqual({9101: '9695DFC35FFEB861329B9F1AB04C46397020CE31'}, cache.relays_for_address('128.31.0.34'))
+
+    # writes invalidate our memoized results
+
+    with cache.write() as writer:
+      writer.record_relay('9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.35', 9101, 'moria2')
+
+    self.assertEqual(0, cache.lookup_stats().size)
+    self.assertEqual('moria2', cache.relay_nickname('9695DFC35FFEB861329B9F1AB04C46397020CE31'))
+    self.assertEqual(('128.31.0.35', 9101), cache.relay_address('9695DFC35FFEB861329B9F1AB04C46397020CE31'))
+
+    # least recently used results are evicted
+
+    with patch('nyx.CACHE_MEMO_SIZE', 2):
+      cache.relay_nickname('74A910646BCEEFBCD2E874FC1DC997430F968145')
+
+    self.assertEqual(2, cache.lookup_stats().size)
+    misses = cache.lookup_stats().misses
+
+    self.assertEqual(('128.31.0.35', 9101), cache.relay_address('9695DFC35FFEB861329B9F1AB04C46397020CE31'))
+    self.assertEqual(misses, cache.lookup_stats().misses)
+
+    self.assertEqual('moria2', cache.relay_nickname('9695DFC35FFEB861329B9F1AB04C46397020CE31'))
+    self.assertEqual(misses + 1, cache.lookup_stats().misses)
+
   @patch('nyx.data_directory', Mock(return_value = None))
   def test_relays_updated_at(self):
     """
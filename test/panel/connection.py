@@ -2,16 +2,18 @@
 Unit tests for nyx.panel.connection.
 """
 
+import curses
 import datetime
 import unittest
 
 import stem.exit_policy
 import stem.version
+import nyx.curses
 import nyx.panel.connection
 import test
 
 from nyx.tracker import Connection
-from nyx.panel.connection import Category, LineType, Line, Entry
+from nyx.panel.connection import Category, LineType, Line, LineModel, Entry, SortAttr
 from test import require_curses
 
 try:
@@ -71,6 +73,18 @@ DETAILS_FOR_RELAY = """
 +------------------------------------------------------------------------------+
 """.strip()
 
+DETAILS_LOADING_DESCRIPTOR = """
++------------------------------------------------------------------------------+
+| address: 75.119.206.243:22                                                   |
+| locale: de   fingerprint: B6D83EC2D9E18B0A7A33428F8CFA9C536769E209           |
+| nickname: caerSidi                  orport: 9051       dirport: 9052         |
+| published: 17:15 03/01/2012                                                  |
+| flags: Fast, HSDir                                                           |
+| loading descriptor...                                                        |
+|                                                                              |
++------------------------------------------------------------------------------+
+""".strip()
+
 DETAILS_FOR_MULTIPLE_MATCHES = """
 +------------------------------------------------------------------------------+
 | address: 75.119.206.243:22                                                   |
@@ -123,15 +137,15 @@ def line(entry = MockEntry(), line_type = LineType.CONNECTION, connection = CONN
 class TestConnectionPanel(unittest.TestCase):
   @require_curses
   def test_draw_title(self):
-    rendered = test.render(nyx.panel.connection._draw_title, [], True)
+    rendered = test.render(nyx.panel.connection._draw_title, LineModel().categories, True)
     self.assertEqual('Connection Details:', rendered.content)
 
-    rendered = test.render(nyx.panel.connection._draw_title, [], False)
+    rendered = test.render(nyx.panel.connection._draw_title, LineModel().categories, False)
     self.assertEqual('Connections:', rendered.content)
 
     entries = [MockEntry(entry_type = category) for category in (Category.INBOUND, Category.INBOUND, Category.OUTBOUND, Category.INBOUND, Category.CONTROL)]
 
-    rendered = test.render(nyx.panel.connection._draw_title, entries, False)
+    rendered = test.render(nyx.panel.connection._draw_title, LineModel(entries).categories, False)
     self.assertEqual('Connections (3 inbound, 1 outbound, 1 control):', rendered.content)
 
   @require_curses
@@ -160,16 +174,19 @@ class TestConnectionPanel(unittest.TestCase):
 
   @require_curses
   @patch('nyx.panel.connection.tor_controller')
+  @patch('nyx.tracker.get_descriptor_tracker')
   @patch('nyx.tracker.get_consensus_tracker')
-  def test_draw_details_for_relay(self, consensus_tracker_mock, tor_controller_mock):
-    router_status_entry = Mock()
-    router_status_entry.or_port = 9051
-    router_status_entry.dir_port = 9052
-    router_status_entry.nickname = 'caerSidi'
-    router_status_entry.flags = ['Fast', 'HSDir']
-    router_status_entry.published = datetime.datetime(2012, 3, 1, 17, 15, 27)
-
-    tor_controller_mock().get_network_status.return_value = router_status_entry
+  def test_draw_details_for_relay(self, consensus_tracker_mock, descriptor_tracker_mock, tor_controller_mock):
+    consensus_tracker_mock().get_relay_status.return_value = nyx.RelayStatus(
+      fingerprint = 'B6D83EC2D9E18B0A7A33428F8CFA9C536769E209',
+      nickname = 'caerSidi',
+      address = '75.119.206.243',
+      or_port = 9051,
+      dir_port = 9052,
+      published = datetime.datetime(2012, 3, 1, 17, 15, 27),
+      flags = ('Fast', 'HSDir'),
+      bandwidth = 20,
+    )
 
     server_descriptor = Mock()
     server_descriptor.exit_policy = stem.exit_policy.ExitPolicy('reject *:*')
@@ -177,7 +194,7 @@ class TestConnectionPanel(unittest.TestCase):
     server_descriptor.operating_system = 'Debian'
     server_descriptor.contact = 'spiffy_person@torproject.org'
 
-    tor_controller_mock().get_server_descriptor.return_value = server_descriptor
+    descriptor_tracker_mock().fetch.return_value = nyx.tracker.RelayDescriptors(None, server_descriptor, None)
 
     consensus_tracker_mock().get_relay_fingerprints.return_value = {
       22: 'B6D83EC2D9E18B0A7A33428F8CFA9C536769E209'
@@ -185,6 +202,187 @@ class TestConnectionPanel(unittest.TestCase):
 
     rendered = test.render(nyx.panel.connection._draw_details, line())
     self.assertEqual(DETAILS_FOR_RELAY, rendered.content)
+    self.assertFalse(tor_controller_mock().get_network_status.called)
+    self.assertFalse(tor_controller_mock().get_server_descriptor.called)
+
+    # descriptors we're still fetching are drawn as a placeholder
+
+    descriptor_tracker_mock().fetch.side_effect = nyx.tracker.UnresolvedResult()
+
+    rendered = test.render(nyx.panel.connection._draw_details, line())
+    self.assertEqual(DETAILS_LOADING_DESCRIPTOR, rendered.content)
+
+  @patch('nyx.tracker.get_consensus_tracker')
+  def test_details_fingerprint(self, consensus_tracker_mock):
+    consensus_tracker_mock().get_relay_fingerprints.return_value = {
+      22: 'B6D83EC2D9E18B0A7A33428F8CFA9C536769E209'
+    }
+
+    self.assertEqual('B6D83EC2D9E18B0A7A33428F8CFA9C536769E209', nyx.panel.connection._details_fingerprint(line()))
+    self.assertEqual(None, nyx.panel.connection._details_fingerprint(line(line_type = LineType.CIRCUIT_HEADER, circ = MockCircuit(status = 'EXTENDING'))))
+
+    consensus_tracker_mock().get_relay_fingerprints.return_value = {
+      22: 'B6D83EC2D9E18B0A7A33428F8CFA9C536769E209',
+      443: 'E0BD57A11F00041A9789577C53A1B784473669E4',
+    }
+
+    self.assertEqual('B6D83EC2D9E18B0A7A33428F8CFA9C536769E209', nyx.panel.connection._details_fingerprint(line()))
+    self.assertEqual(None, nyx.panel.connection._details_fingerprint(line(connection = CONNECTION._replace(remote_port = 80))))
+
+  @patch('nyx.tracker.get_consensus_tracker')
+  @patch('nyx.tracker.get_locale_tracker', Mock())
+  @patch('nyx.panel.connection.controller_snapshot', Mock(return_value = test.snapshot(
+    or_ports = frozenset([9001]),
+    socks_ports = frozenset([9050]),
+    control_ports = frozenset([9051]),
+    hidden_service_targets = frozenset([('127.0.0.1', 8080)]),
+    exit_policy = stem.exit_policy.ExitPolicy('accept *:22', 'reject *:*'),
+  )))
+  def test_connection_type(self, consensus_tracker_mock):
+    consensus_tracker_mock().get_relay_fingerprints.return_value = {}
+
+    def entry_type(**attr):
+      conn = CONNECTION._replace(**attr)
+      return nyx.panel.connection._classify([conn])[0][conn].get_type()
+
+    self.assertEqual(Category.INBOUND, entry_type(local_port = 9001))
+    self.assertEqual(Category.SOCKS, entry_type(local_port = 9050))
+    self.assertEqual(Category.CONTROL, entry_type(local_port = 9051))
+    self.assertEqual(Category.HIDDEN, entry_type(remote_address = '127.0.0.1', remote_port = 8080))
+    self.assertEqual(Category.EXIT, entry_type())
+    self.assertEqual(Category.OUTBOUND, entry_type(remote_port = 443))
+
+  @patch('nyx.tracker.get_consensus_tracker')
+  @patch('nyx.tracker.get_locale_tracker', Mock())
+  @patch('nyx.panel.connection.controller_snapshot', Mock(return_value = test.snapshot(
+    hidden_service_targets = frozenset([('127.0.0.1', 80)]),
+    exit_policy = stem.exit_policy.ExitPolicy('accept *:80', 'reject *:*'),
+  )))
+  def test_exit_sharing_hidden_service_port(self, consensus_tracker_mock):
+    consensus_tracker_mock().get_relay_fingerprints.return_value = {}
+
+    # exits to the port our hidden service forwards to are still exits
+
+    hidden = CONNECTION._replace(remote_address = '127.0.0.1', remote_port = 80)
+    exit = CONNECTION._replace(remote_address = '93.184.216.34', remote_port = 80)
+    entries = nyx.panel.connection._classify([hidden, exit])[0]
+
+    self.assertEqual(Category.HIDDEN, entries[hidden].get_type())
+    self.assertEqual(Category.EXIT, entries[exit].get_type())
+    self.assertTrue(entries[exit].is_private())
+
+  def test_sort_entries(self):
+    class SortableEntry(Entry):
+      def __init__(self, value):
+        super(SortableEntry, self).__init__()
+        self.value = value
+        self.lookups = 0
+
+      def sort_value(self, attr):
+        self.lookups += 1
+        return self.value if attr == SortAttr.PORT else 0
+
+    sort_order = [SortAttr.CATEGORY, SortAttr.PORT]
+    entries = [SortableEntry(value) for value in (5, 1, 3, 9, 7)]
+
+    present = nyx.panel.connection._sort_entries([], entries, sort_order)
+    self.assertEqual([1, 3, 5, 7, 9], [entry.value for entry in present])
+
+    # new entries are placed among the ones we have, and removed ones dropped
+
+    added = [SortableEntry(4), SortableEntry(10)]
+    updated = nyx.panel.connection._sort_entries(present, [entry for entry in entries if entry.value != 3] + added, sort_order)
+    self.assertEqual([1, 4, 5, 7, 9, 10], [entry.value for entry in updated])
+
+    # sort keys are only computed once for each ordering
+
+    self.assertEqual([2, 2, 2, 2], [entry.lookups for entry in entries if entry.value != 3])
+
+    nyx.panel.connection._sort_entries([], updated, [SortAttr.PORT])
+    self.assertEqual([3, 3, 3, 3], [entry.lookups for entry in entries if entry.value != 3])
+
+  def test_line_model(self):
+    circuit_entry = MockEntry(entry_type = Category.CIRCUIT)
+    circuit_entry._lines = [line(entry = circuit_entry, line_type = LineType.CIRCUIT_HEADER)] + [line(entry = circuit_entry, line_type = LineType.CIRCUIT, fingerprint = fp) for fp, _ in MockCircuit().path]
+
+    entries = [MockEntry(entry_type = Category.INBOUND), circuit_entry, MockEntry(entry_type = Category.OUTBOUND)]
+
+    for entry in (entries[0], entries[2]):
+      entry._lines = [line(entry = entry)]
+
+    lines = LineModel(entries)
+    expected = [entry_line for entry in entries for entry_line in entry.get_lines()]
+
+    self.assertEqual(6, len(lines))
+    self.assertEqual(expected, list(lines))
+    self.assertEqual(expected, [lines[i] for i in range(len(lines))])
+    self.assertEqual(expected[-1], lines[-1])
+    self.assertEqual(list(range(6)), [lines.index(entry_line) for entry_line in expected])
+    self.assertEqual({Category.INBOUND: 1, Category.CIRCUIT: 1, Category.OUTBOUND: 1}, dict(lines.categories))
+
+    self.assertTrue(expected[3] in lines)
+    self.assertFalse(line(entry = MockEntry()) in lines)
+    self.assertFalse(None in lines)
+    self.assertRaises(ValueError, lines.index, line(entry = MockEntry()))
+    self.assertRaises(IndexError, lines.__getitem__, 6)
+
+    # the scroller tracks its selection through the model
+
+    scroller = nyx.curses.CursorScroller()
+    self.assertEqual((expected[0], 0), scroller.selection(lines, 2))
+    self.assertTrue(scroller.handle_key(nyx.curses.KeyInput(curses.KEY_END), lines, 2))
+    self.assertEqual((expected[5], 4), scroller.selection(lines, 2))
+
+    # and keeps it selected as the lines are reordered
+
+    self.assertEqual((expected[5], 0), scroller.selection(LineModel([entries[2], entries[1], entries[0]]), 2))
+
+  @patch('nyx.tracker.get_consensus_tracker')
+  @patch('nyx.tracker.get_locale_tracker')
+  @patch('nyx.panel.connection.LAST_RETRIEVED_CIRCUITS', [MockCircuit(path = [('E0BD57A11F00041A9789577C53A1B784473669E4', 'caerSidi')])])
+  @patch('nyx.panel.connection.controller_snapshot', Mock(return_value = test.snapshot(
+    or_ports = frozenset([9001]),
+    socks_ports = frozenset([9050]),
+    exit_policy = stem.exit_policy.ExitPolicy('accept *:22', 'accept *:53', 'reject *:*'),
+  )))
+  def test_classify(self, locale_tracker_mock, consensus_tracker_mock):
+    relays = {
+      '128.31.0.34': {9101: '9695DFC35FFEB861329B9F1AB04C46397020CE31'},
+      '208.113.165.162': {443: 'E0BD57A11F00041A9789577C53A1B784473669E4'},
+    }
+
+    consensus_tracker_mock().get_relay_fingerprints.side_effect = lambda address: relays.get(address, {})
+    consensus_tracker_mock().get_relay_nickname.side_effect = lambda fingerprint: {'9695DFC35FFEB861329B9F1AB04C46397020CE31': 'moria1', 'E0BD57A11F00041A9789577C53A1B784473669E4': 'caerSidi'}.get(fingerprint)
+    locale_tracker_mock().get_locales.side_effect = lambda addresses: dict([(address, 'us') for address in addresses])
+
+    connections = [
+      CONNECTION._replace(local_port = 9001, remote_address = '128.31.0.34', remote_port = 51234),  # inbound from a relay
+      CONNECTION._replace(local_port = 9001),  # inbound from a client
+      CONNECTION._replace(local_port = 9050, remote_address = '127.0.0.1', remote_port = 48120),  # socks
+      CONNECTION,  # exit
+      CONNECTION._replace(remote_port = 53, protocol = 'udp'),  # exit to a resolver
+      CONNECTION._replace(remote_address = '128.31.0.34', remote_port = 9101),  # outbound to a relay
+      CONNECTION._replace(remote_address = '208.113.165.162', remote_port = 443),  # directory fetch
+    ]
+
+    entries, stats = nyx.panel.connection._classify(connections)
+
+    self.assertEqual(
+      [Category.INBOUND, Category.INBOUND, Category.SOCKS, Category.EXIT, Category.EXIT, Category.OUTBOUND, Category.DIRECTORY],
+      [entries[conn].get_type() for conn in connections],
+    )
+
+    self.assertEqual([False, True, False, True, False, False, False], [entries[conn].is_private() for conn in connections])
+    self.assertEqual((None, None, 'us'), entries[connections[0]].get_lines()[0][4:])
+    self.assertEqual(('9695DFC35FFEB861329B9F1AB04C46397020CE31', 'moria1', 'us'), entries[connections[5]].get_lines()[0][4:])
+    self.assertEqual(('E0BD57A11F00041A9789577C53A1B784473669E4', 'caerSidi', 'us'), entries[connections[6]].get_lines()[0][4:])
+
+    # each distinct address and relay is looked up once
+
+    self.assertEqual(7, stats.connections)
+    self.assertEqual(4, consensus_tracker_mock().get_relay_fingerprints.call_count)
+    self.assertEqual(2, consensus_tracker_mock().get_relay_nickname.call_count)
+    self.assertEqual(1, locale_tracker_mock().get_locales.call_count)
 
   @require_curses
   @patch('nyx.tracker.get_consensus_tracker')
@@ -199,10 +397,8 @@ class TestConnectionPanel(unittest.TestCase):
     self.assertEqual(DETAILS_FOR_MULTIPLE_MATCHES, rendered.content)
 
   @require_curses
-  @patch('nyx.panel.connection.tor_controller')
-  def test_draw_line(self, tor_controller_mock):
-    tor_controller_mock().is_geoip_unavailable.return_value = False
-    tor_controller_mock().get_info.return_value = '82.121.9.9'
+  @patch('nyx.panel.connection.controller_snapshot', Mock(return_value = test.snapshot(address = '82.121.9.9')))
+  def test_draw_line(self):
 
     test_data = ((
       line(),
@@ -226,10 +422,8 @@ class TestConnectionPanel(unittest.TestCase):
       self.assertEqual(expected, rendered.content)
 
   @require_curses
-  @patch('nyx.panel.connection.tor_controller')
-  def test_draw_address_column(self, tor_controller_mock):
-    tor_controller_mock().is_geoip_unavailable.return_value = False
-    tor_controller_mock().get_info.return_value = '82.121.9.9'
+  @patch('nyx.panel.connection.controller_snapshot', Mock(return_value = test.snapshot(address = '82.121.9.9')))
+  def test_draw_address_column(self):
 
     test_data = ((
       line(),
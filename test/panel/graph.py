@@ -11,13 +11,14 @@ import nyx.curses
 import nyx.panel.graph
 import test
 
+from nyx.tracker import Connection, ConnectionChanges
 from test import require_curses
 
 try:
   # added in python 3.3
-  from unittest.mock import patch
+  from unittest.mock import Mock, patch
 except ImportError:
-  from mock import patch
+  from mock import Mock, patch
 
 EXPECTED_BLANK_GRAPH = """
 Download:
@@ -96,6 +97,28 @@ class TestGraphPanel(unittest.TestCase):
 
     self.assertEqual({2: '0', 11: '0'}, nyx.panel.graph._y_axis_labels(12, data.primary, 0, 0))
 
+  @patch('nyx.panel.graph.controller_snapshot', Mock(return_value = test.snapshot(or_ports = frozenset([9001]), control_ports = frozenset([9051]))))
+  @patch('nyx.tracker.get_connection_tracker')
+  def test_connection_stats(self, connection_tracker_mock):
+
+    inbound = Connection(0.0, False, '127.0.0.1', 9001, '75.119.206.243', 22, 'tcp', False)
+    outbound = Connection(0.0, False, '127.0.0.1', 3531, '86.59.30.40', 443, 'tcp', False)
+    control = Connection(0.0, False, '127.0.0.1', 9051, '127.0.0.1', 48120, 'tcp', False)
+
+    connection_tracker_mock().get_changes = Mock(side_effect = [
+      ConnectionChanges(1, frozenset([inbound, outbound, control]), None),
+      ConnectionChanges(2, frozenset(), frozenset([inbound])),
+    ])
+
+    stats = nyx.panel.graph.ConnectionStats()
+
+    stats.bandwidth_event(None)
+    self.assertEqual((1, 1), (stats.primary.latest_value, stats.secondary.latest_value))
+
+    stats.bandwidth_event(None)
+    self.assertEqual((0, 1), (stats.primary.latest_value, stats.secondary.latest_value))
+    connection_tracker_mock().get_changes.assert_called_with(1)
+
   @require_curses
   @patch('nyx.panel.graph.tor_controller')
   def test_draw_subgraph_blank(self, tor_controller_mock):
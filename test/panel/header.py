@@ -86,6 +86,7 @@ class TestHeaderPanel(unittest.TestCase):
     panel = nyx.panel.header.HeaderPanel()
     self.assertEqual(EXPECTED_PANEL, test.render(panel._draw).content)
 
+  @patch('nyx.tor_controller')
   @patch('nyx.panel.header.tor_controller')
   @patch('nyx.tracker.get_resource_tracker')
   @patch('nyx.tracker.get_consensus_tracker')
@@ -94,7 +95,8 @@ class TestHeaderPanel(unittest.TestCase):
   @patch('os.uname', Mock(return_value = ('Linux', 'odin', '3.5.0-54-generic', '#81~precise1-Ubuntu SMP Tue Jul 15 04:05:58 UTC 2014', 'i686')))
   @patch('stem.util.system.start_time', Mock(return_value = 5678))
   @patch('stem.util.proc.file_descriptors_used', Mock(return_value = 89))
-  def test_sample(self, consensus_tracker_mock, resource_tracker_mock, tor_controller_mock):
+  def test_sample(self, consensus_tracker_mock, resource_tracker_mock, tor_controller_mock, nyx_controller_mock):
+    nyx_controller_mock.return_value = tor_controller_mock()
     tor_controller_mock().is_alive.return_value = True
     tor_controller_mock().connection_time.return_value = 567.8
     tor_controller_mock().get_latest_heartbeat.return_value = 89.0
@@ -102,21 +104,25 @@ class TestHeaderPanel(unittest.TestCase):
     tor_controller_mock().get_exit_policy.return_value = stem.exit_policy.ExitPolicy('reject *:*')
     tor_controller_mock().get_version.return_value = stem.version.Version('0.1.2.3-tag')
     tor_controller_mock().get_pid.return_value = '123'
+    tor_controller_mock().get_start_time.return_value = 5678
 
-    tor_controller_mock().get_info.side_effect = lambda param, default = None: {
+    info = {
       'address': '174.21.17.28',
       'fingerprint': '1A94D1A794FCB2F8B6CBC179EF8FDD4008A98D3B',
       'status/version/current': 'recommended',
       'process/descriptor-limit': 678,
-    }[param]
+    }
 
-    tor_controller_mock().get_conf.side_effect = lambda param, default = None: {
-      'Nickname': 'Unnamed',
-      'HashedControlPassword': None,
-      'CookieAuthentication': '1',
-      'DirPort': '7001',
-      'ControlSocket': None,
-    }[param]
+    conf = {
+      'Nickname': ['Unnamed'],
+      'HashedControlPassword': [],
+      'CookieAuthentication': ['1'],
+      'DirPort': ['7001'],
+      'ControlSocket': [],
+    }
+
+    tor_controller_mock().get_info.side_effect = lambda params, default = None: dict([(param, info[param]) for param in params])
+    tor_controller_mock().get_conf_map.side_effect = test.conf_map(conf)
 
     tor_controller_mock().get_listeners.side_effect = lambda param, default = None: {
       stem.control.Listener.OR: [('0.0.0.0', 7000)],
@@ -165,6 +171,30 @@ class TestHeaderPanel(unittest.TestCase):
     self.assertEqual('odin', vals.hostname)
     self.assertEqual('Linux 3.5.0-54-generic', vals.platform)
 
+    # GETINFO and GETCONF values are each requested together
+
+    self.assertEqual(1, tor_controller_mock().get_info.call_count)
+    self.assertEqual(1, tor_controller_mock().get_conf_map.call_count)
+    self.assertFalse(tor_controller_mock().get_conf.called)
+
+    # values that don't change are reused until tor's reset
+
+    tor_controller_mock().get_pid.return_value = '456'
+
+    with patch('time.time', Mock(return_value = 1239.5)):
+      self.assertEqual('123', nyx.panel.header.Sampling.create(vals).pid)
+      self.assertEqual('456', nyx.panel.header.Sampling.create(vals, is_reset = True).pid)
+
+    self.assertEqual(2, tor_controller_mock().get_pid.call_count)
+
+    # authentication is determined by our torrc
+
+    conf['CookieAuthentication'] = ['0']
+    self.assertEqual('open', nyx.panel.header.Sampling.create().auth_type)
+
+    conf['HashedControlPassword'] = ['16:B3B7A80AD1F9C2C760E17F84CB7B6F8E7D8D36E2E6A4E8BFCD5B8CFD5A']
+    self.assertEqual('password', nyx.panel.header.Sampling.create().auth_type)
+
   def test_sample_format(self):
     vals = nyx.panel.header.Sampling(
       version = '0.2.8.1',
@@ -9,6 +9,7 @@ import nyx
 import nyx.curses
 import nyx.panel
 import nyx.popups
+import nyx.tracker
 import test
 
 from test import require_curses, mock_keybindings
@@ -459,3 +460,22 @@ class TestPopups(unittest.TestCase):
     rendered = test.render(nyx.popups.show_descriptor, '29787760145CD1A473552A2FC64C72A9A130820E', nyx.curses.Color.RED, lambda key: key.match('esc'))
     self.assertEqual(EXPECTED_DESCRIPTOR, rendered.content)
     self.assertEqual(nyx.curses.KeyInput(27), rendered.return_value)
+
+  @patch('nyx.tracker.get_descriptor_tracker')
+  def test_descriptor_text(self, descriptor_tracker_mock):
+    descriptor_tracker_mock().fetch.return_value = nyx.tracker.RelayDescriptors('r moria1 lpXfw1/+uGEym58asExGOXAgzjE', None, None)
+
+    expected = ['Consensus:', '', 'r moria1 lpXfw1/+uGEym58asExGOXAgzjE']
+    self.assertEqual(expected, nyx.popups._descriptor_text('9695DFC35FFEB861329B9F1AB04C46397020CE31'))
+    descriptor_tracker_mock().fetch.assert_called_with('9695DFC35FFEB861329B9F1AB04C46397020CE31', nyx.popups.DESCRIPTOR_TIMEOUT)
+
+    # tor is slow to provide the descriptors
+
+    descriptor_tracker_mock().fetch.side_effect = nyx.tracker.UnresolvedResult()
+    self.assertEqual(['Consensus:', '', nyx.popups.LOADING_MSG], nyx.popups._descriptor_text('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66'))
+
+    # tor doesn't have the descriptors
+
+    descriptor_tracker_mock().fetch.side_effect = None
+    descriptor_tracker_mock().fetch.return_value = nyx.tracker.RelayDescriptors(None, None, None)
+    self.assertEqual(['Consensus:', '', nyx.popups.ERROR_MSG], nyx.popups._descriptor_text('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66'))
@@ -0,0 +1,89 @@
+"""
+Unit tests for nyx.Scheduler.
+"""
+
+import threading
+import time
+import unittest
+
+from nyx import Scheduler, ScheduledTask
+
+
+class TestScheduler(unittest.TestCase):
+  def test_runs_tasks_at_their_rate(self):
+    scheduler = Scheduler()
+    fast, slow = ScheduledTask('fast', 0.01), ScheduledTask('slow', 0.05)
+    runs = {'fast': 0, 'slow': 0}
+
+    def count_runs(task):
+      while task.wait(0.5):
+        runs[task.name] += 1
+
+    threads = [threading.Thread(target = count_runs, args = (task,)) for task in (fast, slow)]
+
+    for task in (fast, slow):
+      scheduler.add(task)
+
+    for thread in threads:
+      thread.start()
+
+    time.sleep(0.12)
+
+    for task in (fast, slow):
+      scheduler.remove(task)
+
+    for thread in threads:
+      thread.join()
+
+    self.assertTrue(8 <= runs['fast'] <= 14)
+    self.assertTrue(2 <= runs['slow'] <= 4)
+    self.assertEqual(set(), set(scheduler.lag().keys()))
+
+  def test_wake(self):
+    # waking a task shouldn't need to wait on the scheduler
+
+    task = ScheduledTask('task', 60)
+    Scheduler().add(task, delay = 60)
+
+    threading.Timer(0.01, task.wake).start()
+
+    start_time = time.time()
+    self.assertTrue(task.wait(5))
+    self.assertTrue(time.time() - start_time < 1)
+
+  def test_set_rate(self):
+    scheduler = Scheduler()
+    task = ScheduledTask('task', 60)
+    scheduler.add(task)
+
+    self.assertTrue(task.wait(1))  # first run is right away
+    self.assertFalse(task.wait(0.05))
+
+    scheduler.set_rate(task, 0.01)
+    self.assertTrue(task.wait(1))
+    self.assertEqual(0.01, task.rate)
+
+  def test_lag(self):
+    scheduler = Scheduler()
+    task = ScheduledTask('task', 60)
+    scheduler.add(task)
+
+    time.sleep(0.05)  # task is due, but we're not waiting on it
+    task.wait()
+
+    last_lag, max_lag = scheduler.lag()['task']
+    self.assertTrue(last_lag >= 0.04)
+    self.assertTrue(max_lag >= last_lag)
+
+  def test_fire_while_running(self):
+    # runs that come due while the daemon is busy are picked up by its next wait
+
+    task = ScheduledTask('task', 60)
+    task._fire(time.time() - 0.5)
+    self.assertTrue(task.wait(0))
+    self.assertTrue(task.lag >= 0.5)
+
+    task._fire(time.time())
+    self.assertTrue(task.wait(0))
+    self.assertTrue(task.lag < 0.5)
+    self.assertFalse(task.wait(0))
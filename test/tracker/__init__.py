@@ -4,7 +4,11 @@ Unit tests for nyx's tracker utilities.
 
 __all__ = [
   'connection_tracker',
+  'consensus_tracker',
   'daemon',
+  'descriptor_tracker',
+  'exit_policy_matcher',
+  'locale_tracker',
   'port_usage_tracker',
   'resource_tracker',
 ]
@@ -1,7 +1,9 @@
+import socket
+import struct
 import time
 import unittest
 
-from nyx.tracker import ConnectionTracker
+from nyx.tracker import ConnectionTracker, NLMSG_HEADER, NLM_F_DUMP_INTR, INET_DIAG_MSG, _connections_via_netlink
 
 from stem.util import connection
 
@@ -11,6 +13,8 @@ try:
 except ImportError:
   from mock import Mock, patch
 
+TIMEOUT = 5
+
 STEM_CONNECTIONS = [
   connection.Connection('127.0.0.1', 3531, '75.119.206.243', 22, 'tcp', False),
   connection.Connection('127.0.0.1', 1766, '86.59.30.40', 443, 'tcp', False),
@@ -18,6 +22,22 @@ STEM_CONNECTIONS = [
 ]
 
 
+def _netlink_response(*sockets, **kwargs):
+  """
+  Constructs a sock_diag response for (local, remote, uid, inode) sockets,
+  followed by the message that concludes the dump. An 'error' keyword argument
+  provides the errno our concluding message reports.
+  """
+
+  response = b''
+
+  for (local_address, local_port), (remote_address, remote_port), uid, inode in sockets:
+    msg = INET_DIAG_MSG.pack(socket.AF_INET, 1, 0, 0, struct.pack('!H', local_port), struct.pack('!H', remote_port), socket.inet_aton(local_address) + b'\x00' * 12, socket.inet_aton(remote_address) + b'\x00' * 12, 0, b'', 0, 0, 0, uid, inode)
+    response += NLMSG_HEADER.pack(NLMSG_HEADER.size + len(msg), 20, 2, 0, 0) + msg
+
+  return response + NLMSG_HEADER.pack(NLMSG_HEADER.size + 4, 3, 2, 0, 0) + struct.pack('=i', -kwargs.get('error', 0))
+
+
 class TestConnectionTracker(unittest.TestCase):
   @patch('nyx.tracker.tor_controller')
   @patch('nyx.tracker.connection.get_connections')
@@ -120,3 +140,87 @@ class TestConnectionTracker(unittest.TestCase):
       self.assertEqual(STEM_CONNECTIONS[1].remote_address, connections[1].remote_address)
       self.assertTrue(second_start_time < connections[1].start_time < time.time())
       self.assertFalse(connections[1].is_legacy)
+
+  @patch('nyx.tracker.tor_controller')
+  @patch('nyx.tracker.connection.get_connections')
+  @patch('nyx.tracker.system', Mock(return_value = Mock()))
+  @patch('stem.util.proc.is_available', Mock(return_value = False))
+  @patch('nyx.tracker.connection.system_resolvers', Mock(return_value = [connection.Resolver.NETSTAT]))
+  def test_connection_changes(self, get_value_mock, tor_controller_mock):
+    tor_controller_mock().get_pid.return_value = 12345
+    tor_controller_mock().get_conf.return_value = '0'
+    get_value_mock.return_value = STEM_CONNECTIONS[:2]
+
+    with ConnectionTracker(0.04) as daemon:
+      wait_until = time.time() + TIMEOUT
+
+      while daemon.get_changes(0).generation < 1:
+        if time.time() > wait_until:
+          self.fail('ConnectionTracker never ran')
+
+        time.sleep(0.01)
+
+      changes = daemon.get_changes(0)
+      first_generation = changes.generation
+      self.assertEqual(set(STEM_CONNECTIONS[:2]), set([tuple(conn[2:]) for conn in changes.added]))
+      self.assertEqual(frozenset(), changes.removed)
+
+      # runs that see the same connections still advance our generation, so
+      # wait for the one that notices our change
+
+      get_value_mock.return_value = STEM_CONNECTIONS[1:]
+      wait_until = time.time() + TIMEOUT
+
+      while not daemon.get_changes(first_generation).removed:
+        if time.time() > wait_until:
+          self.fail("ConnectionTracker didn't notice our connection change")
+
+        time.sleep(0.01)
+
+      changes = daemon.get_changes(first_generation)
+      self.assertTrue(changes.generation > first_generation)
+      self.assertEqual([STEM_CONNECTIONS[2]], [tuple(conn[2:]) for conn in changes.added])
+      self.assertEqual([STEM_CONNECTIONS[0]], [tuple(conn[2:]) for conn in changes.removed])
+
+      # nothing has changed since the latest generation
+
+      changes = daemon.get_changes(changes.generation)
+      self.assertEqual(frozenset(), changes.added)
+      self.assertEqual(frozenset(), changes.removed)
+
+      # without a prior generation we get everything
+
+      changes = daemon.get_changes(None)
+      self.assertEqual(set(STEM_CONNECTIONS[1:]), set([tuple(conn[2:]) for conn in changes.added]))
+      self.assertEqual(None, changes.removed)
+
+  @patch('nyx.tracker._socket_inodes', Mock(return_value = set([5005, 5007])))
+  @patch('socket.socket')
+  def test_connections_via_netlink(self, socket_mock):
+    socket_mock().recv.side_effect = [_netlink_response(
+      (('127.0.0.1', 3531), ('75.119.206.243', 22), 1000, 5005),
+      (('127.0.0.1', 1766), ('86.59.30.40', 443), 1000, 5006),
+      (('127.0.0.1', 1059), ('74.125.28.106', 80), 1000, 5007),
+    )] + [_netlink_response()] * 3
+
+    self.assertEqual([STEM_CONNECTIONS[0], STEM_CONNECTIONS[2]], _connections_via_netlink(12345))
+    self.assertEqual(4, socket_mock().send.call_count)
+
+  @patch('nyx.tracker._socket_inodes', Mock(return_value = set([5005])))
+  @patch('socket.socket')
+  def test_connections_via_netlink_failure(self, socket_mock):
+    socket_mock().recv.return_value = NLMSG_HEADER.pack(NLMSG_HEADER.size + 4, 2, 0, 0, 0) + struct.pack('=i', -1)
+    self.assertRaises(IOError, _connections_via_netlink, 12345)
+
+  @patch('nyx.tracker._socket_inodes', Mock(return_value = set([5005])))
+  @patch('socket.socket')
+  def test_connections_via_netlink_failed_dump(self, socket_mock):
+    socket_mock().recv.return_value = _netlink_response((('127.0.0.1', 3531), ('75.119.206.243', 22), 1000, 5005), error = 2)
+    self.assertRaises(IOError, _connections_via_netlink, 12345)
+
+  @patch('nyx.tracker._socket_inodes', Mock(return_value = set([5005])))
+  @patch('socket.socket')
+  def test_connections_via_netlink_interrupted_dump(self, socket_mock):
+    response = _netlink_response((('127.0.0.1', 3531), ('75.119.206.243', 22), 1000, 5005))
+    socket_mock().recv.return_value = NLMSG_HEADER.pack(NLMSG_HEADER.size + INET_DIAG_MSG.size, 20, 2 | NLM_F_DUMP_INTR, 0, 0) + response[NLMSG_HEADER.size:]
+    self.assertRaises(IOError, _connections_via_netlink, 12345)
@@ -0,0 +1,280 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import nyx
+import test
+
+from nyx.tracker import ConsensusTracker, ConsensusUpdate, _cached_consensus_relays, _consensus_relays
+
+try:
+  # added in python 3.3
+  from unittest.mock import Mock, patch
+except ImportError:
+  from mock import Mock, patch
+
+CONSENSUS = """\
+network-status-version 3
+vote-status consensus
+r caerSidi PqjpYPa5TOMAYqqO8CiUwA+NHmY 4ulq0GSM2R06lhzbnP5FQt0lZNc 2012-08-06 11:19:31 208.113.165.162 1443 0
+s Fast Running Stable Valid
+w Bandwidth=20
+r moria1 lpXfw1/+uGEym58asExGOXAgzjE IpcU7dolas8+Q+oAzwgvZIWx7PA 2012-08-06 11:19:31 128.31.0.34 9101 9131
+s Authority Fast Running Stable V2Dir Valid
+r caerSidi2 dKkQZGvO77zS6HT8HcmXQw+WgUU XKkv2WZgrgoz9Pde/xODHuP1lXM 2012-08-06 11:19:31 208.113.165.162 1543 0
+s Fast Running Valid
+"""
+
+MICRODESC_CONSENSUS = """\
+network-status-version 3 microdesc
+vote-status consensus
+r moria1 lpXfw1/+uGEym58asExGOXAgzjE 2012-08-06 11:19:31 128.31.0.34 9101 9131
+m 1ZwZtm7Y4Nzp4oSC7NOPo0HxRa+8CRAwDpHhP32nDzo
+s Authority Fast Running Stable V2Dir Valid
+"""
+
+
+class TestConsensusTracker(unittest.TestCase):
+  def setUp(self):
+    nyx.CACHE = None  # drop cached database reference
+
+    snapshot_patch = patch('nyx.tracker.controller_snapshot', Mock(return_value = test.snapshot()))
+    snapshot_patch.start()
+    self.addCleanup(snapshot_patch.stop)
+
+  def test_consensus_relays(self):
+    self.assertEqual([
+      ('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', '208.113.165.162', 1443, 'caerSidi', None, '2012-08-06 11:19:31', ('Fast', 'Running', 'Stable', 'Valid'), 20),
+      ('9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.34', 9101, 'moria1', 9131, '2012-08-06 11:19:31', ('Authority', 'Fast', 'Running', 'Stable', 'V2Dir', 'Valid'), None),
+      ('74A910646BCEEFBCD2E874FC1DC997430F968145', '208.113.165.162', 1543, 'caerSidi2', None, '2012-08-06 11:19:31', ('Fast', 'Running', 'Valid'), None),
+    ], _consensus_relays(CONSENSUS))
+
+    self.assertEqual([], _consensus_relays('r caerSidi PqjpYPa5TOMAYqqO8CiUwA+NHmY 4ulq0GSM2R06lhzbnP5FQt0lZNc 2012-08-06 11:19:31 208.113.165.162'))
+    self.assertEqual([], _consensus_relays('r caerSidi PqjpYPa5TOMAYqqO8CiUwA+NHmY 4ulq0GSM2R06lhzbnP5FQt0lZNc 2012-08-06 11:19:31 208.113.165.162 orport 0'))
+
+  def test_cached_consensus_relays(self):
+    data_directory = tempfile.mkdtemp()
+
+    try:
+      self.assertRaises(IOError, _cached_consensus_relays, data_directory)
+
+      # empty or truncated consensus have no relays for us
+
+      for content in ('', CONSENSUS[:CONSENSUS.index('\nr ')]):
+        with open(os.path.join(data_directory, 'cached-consensus'), 'w') as consensus_file:
+          consensus_file.write(content)
+
+        self.assertRaises(IOError, _cached_consensus_relays, data_directory)
+
+      with open(os.path.join(data_directory, 'cached-consensus'), 'w') as consensus_file:
+        consensus_file.write(CONSENSUS)
+
+      self.assertEqual(_consensus_relays(CONSENSUS), _cached_consensus_relays(data_directory))
+
+      # the newest flavor is used
+
+      with open(os.path.join(data_directory, 'cached-microdesc-consensus'), 'w') as consensus_file:
+        consensus_file.write(MICRODESC_CONSENSUS)
+
+      os.utime(os.path.join(data_directory, 'cached-consensus'), (time.time() - 60, time.time() - 60))
+      self.assertEqual([('9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.34', 9101, 'moria1', 9131, '2012-08-06 11:19:31', ('Authority', 'Fast', 'Running', 'Stable', 'V2Dir', 'Valid'), None)], _cached_consensus_relays(data_directory))
+    finally:
+      shutil.rmtree(data_directory)
+
+  @patch('nyx.tracker.tor_controller')
+  @patch('nyx.data_directory', Mock(return_value = None))
+  def test_relays_from_data_directory(self, tor_controller_mock):
+    data_directory = tempfile.mkdtemp()
+
+    try:
+      with open(os.path.join(data_directory, 'cached-microdesc-consensus'), 'w') as consensus_file:
+        consensus_file.write(MICRODESC_CONSENSUS)
+
+      tor_controller_mock().is_localhost.return_value = True
+      tor_controller_mock().get_conf.return_value = data_directory
+      tor_controller_mock().get_info.side_effect = lambda param, default = None: CONSENSUS if param == 'ns/all' else default
+
+      tracker = ConsensusTracker()
+      self.assertEqual(1, tracker.get_index_stats().relays)
+      self.assertFalse(('ns/all', None) in [call[0] for call in tor_controller_mock().get_info.call_args_list])
+    finally:
+      shutil.rmtree(data_directory)
+
+    # falls back to requesting the consensus when it can't be read
+
+    nyx.CACHE = None
+    tracker = ConsensusTracker()
+    self.assertEqual(3, tracker.get_index_stats().relays)
+
+  @patch('nyx.tracker.tor_controller')
+  @patch('nyx.data_directory', Mock(return_value = None))
+  def test_relay_index(self, tor_controller_mock):
+    tor_controller_mock().is_localhost.return_value = False
+    tor_controller_mock().get_info.side_effect = lambda param, default = None: CONSENSUS if param == 'ns/all' else default
+    tracker = ConsensusTracker()
+
+    self.assertEqual({9101: '9695DFC35FFEB861329B9F1AB04C46397020CE31'}, tracker.get_relay_fingerprints('128.31.0.34'))
+    self.assertEqual({1443: '3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', 1543: '74A910646BCEEFBCD2E874FC1DC997430F968145'}, tracker.get_relay_fingerprints('208.113.165.162'))
+    self.assertEqual({}, tracker.get_relay_fingerprints('199.254.238.53'))
+    self.assertEqual({}, tracker.get_relay_fingerprints('not an address'))
+
+    stats = tracker.get_index_stats()
+    self.assertEqual(3, stats.relays)
+    self.assertEqual(2, stats.addresses)
+    self.assertTrue(stats.memory_bytes > 0)
+
+  @patch('nyx.tracker.tor_controller')
+  @patch('nyx.data_directory', Mock(return_value = None))
+  def test_relay_index_from_cache(self, tor_controller_mock):
+    # when our cache is fresh the index is built from it instead
+
+    tor_controller_mock().is_localhost.return_value = False
+    tor_controller_mock().get_info.return_value = None
+
+    with nyx.cache().write() as writer:
+      writer.record_relay('9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.34', 9101, 'moria1')
+
+    tracker = ConsensusTracker()
+    self.assertEqual({9101: '9695DFC35FFEB861329B9F1AB04C46397020CE31'}, tracker.get_relay_fingerprints('128.31.0.34'))
+    self.assertEqual(1, tracker.get_index_stats().relays)
+
+  @patch('nyx.tracker.tor_controller')
+  @patch('nyx.tracker.controller_snapshot')
+  @patch('nyx.data_directory', Mock(return_value = None))
+  def test_our_own_relay(self, controller_snapshot_mock, tor_controller_mock):
+    tor_controller_mock().is_localhost.return_value = False
+    tor_controller_mock().get_info.side_effect = lambda param, default = None: CONSENSUS if param == 'ns/all' else default
+
+    controller_snapshot_mock.return_value = test.snapshot(
+      or_ports = frozenset([9101, 9102]),
+      address = '128.31.0.34',
+      fingerprint = '9695DFC35FFEB861329B9F1AB04C46397020CE31',
+    )
+
+    tracker = ConsensusTracker()
+
+    self.assertEqual({9101: '9695DFC35FFEB861329B9F1AB04C46397020CE31', 9102: '9695DFC35FFEB861329B9F1AB04C46397020CE31'}, tracker.get_relay_fingerprints('128.31.0.34'))
+
+  @patch('nyx.tracker.tor_controller')
+  @patch('nyx.tracker.CONSENSUS_CHUNK_SIZE', 2)
+  @patch('nyx.data_directory', Mock(return_value = None))
+  def test_new_consensus_event(self, tor_controller_mock):
+    tor_controller_mock().is_localhost.return_value = False
+    tor_controller_mock().get_info.return_value = None
+    tracker = ConsensusTracker()
+    self.assertEqual({}, tracker.get_relay_fingerprints('128.31.0.34'))
+
+    # the listener returns without processing the consensus itself
+
+    updated = threading.Event()
+
+    def update(content):
+      time.sleep(0.1)
+      updated.set()
+
+    with patch.object(tracker, '_update') as update_mock:
+      update_mock.side_effect = update
+
+      start_time = time.time()
+      tracker._new_consensus_event(Mock(consensus_content = CONSENSUS))
+      self.assertTrue(time.time() - start_time < 0.05)
+
+      self.assertTrue(updated.wait(5))
+      update_mock.assert_called_once_with(CONSENSUS)
+
+  @patch('nyx.tracker.tor_controller')
+  @patch('nyx.tracker.CONSENSUS_CHUNK_SIZE', 2)
+  @patch('nyx.data_directory', Mock(return_value = None))
+  def test_update_in_chunks(self, tor_controller_mock):
+    tor_controller_mock().is_localhost.return_value = False
+    tor_controller_mock().get_info.return_value = None
+    tracker = ConsensusTracker()
+
+    with patch('nyx.CacheWriter.record_relays', autospec = True, side_effect = nyx.CacheWriter.record_relays) as record_relays_mock:
+      tracker._update(CONSENSUS)
+      self.assertEqual([False, True], [call[1]['is_complete'] for call in record_relays_mock.call_args_list])
+
+    self.assertEqual(3, len(nyx.cache().relays()))
+    self.assertEqual(3, tracker.get_index_stats().relays)
+    self.assertEqual({9101: '9695DFC35FFEB861329B9F1AB04C46397020CE31'}, tracker.get_relay_fingerprints('128.31.0.34'))
+    self.assertTrue(time.time() - nyx.cache().relays_updated_at() < 5)
+
+  @patch('nyx.tracker.tor_controller')
+  @patch('nyx.data_directory', Mock(return_value = None))
+  def test_update_with_changes(self, tor_controller_mock):
+    tor_controller_mock().is_localhost.return_value = False
+    tor_controller_mock().get_info.side_effect = lambda param, default = None: CONSENSUS if param == 'ns/all' else default
+    tracker = ConsensusTracker()
+
+    self.assertEqual(ConsensusUpdate(3, 0, 0, tracker.get_last_update().duration, True), tracker.get_last_update())
+    prior_ports = tracker.get_relay_fingerprints('208.113.165.162')
+
+    # moria1 changes its address, caerSidi2 leaves, and maatuska joins
+
+    new_consensus = CONSENSUS.replace('128.31.0.34', '128.31.0.39').split('r caerSidi2')[0] + \
+      'r maatuska bi0qk1lUTqQJtMFUwXRFj4hkJz0 Gtv6DEuHoq0J9x0glw5QPjRmG14 2012-08-06 11:19:31 171.25.193.9 80 443\n'
+
+    with patch('nyx.CacheWriter.record_relays') as record_relays_mock:
+      tracker._update(new_consensus)
+      self.assertFalse(record_relays_mock.called)
+
+    update = tracker.get_last_update()
+    self.assertEqual((1, 1, 1, False), (update.added, update.changed, update.removed, update.is_full))
+
+    self.assertEqual({}, tracker.get_relay_fingerprints('128.31.0.34'))
+    self.assertEqual({9101: '9695DFC35FFEB861329B9F1AB04C46397020CE31'}, tracker.get_relay_fingerprints('128.31.0.39'))
+    self.assertEqual({1443: '3EA8E960F6B94CE30062AA8EF02894C00F8D1E66'}, tracker.get_relay_fingerprints('208.113.165.162'))
+    self.assertEqual({80: '6E2D2A9359544EA409B4C154C174458F8864273D'}, tracker.get_relay_fingerprints('171.25.193.9'))
+    self.assertEqual(3, tracker.get_index_stats().relays)
+
+    # mappings callers already have aren't modified
+
+    self.assertEqual({1443: '3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', 1543: '74A910646BCEEFBCD2E874FC1DC997430F968145'}, prior_ports)
+
+    self.assertEqual([
+      ('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66', '208.113.165.162', 1443, 'caerSidi'),
+      ('6E2D2A9359544EA409B4C154C174458F8864273D', '171.25.193.9', 80, 'maatuska'),
+      ('9695DFC35FFEB861329B9F1AB04C46397020CE31', '128.31.0.39', 9101, 'moria1'),
+    ], sorted(nyx.cache().relays()))
+
+    # an unchanged consensus is nearly free
+
+    tracker._update(new_consensus)
+    update = tracker.get_last_update()
+    self.assertEqual((0, 0, 0, False), (update.added, update.changed, update.removed, update.is_full))
+
+    # flag and bandwidth changes are recorded too
+
+    tracker._update(new_consensus.replace('w Bandwidth=20', 'w Bandwidth=40'))
+    update = tracker.get_last_update()
+    self.assertEqual((0, 1, 0, False), (update.added, update.changed, update.removed, update.is_full))
+    self.assertEqual(40, tracker.get_relay_status('3EA8E960F6B94CE30062AA8EF02894C00F8D1E66').bandwidth)
+
+  @patch('nyx.tracker.tor_controller')
+  @patch('nyx.data_directory', Mock(return_value = None))
+  def test_relay_status(self, tor_controller_mock):
+    tor_controller_mock().is_localhost.return_value = False
+    tor_controller_mock().get_info.side_effect = lambda param, default = None: CONSENSUS if param == 'ns/all' else default
+    tracker = ConsensusTracker()
+
+    self.assertEqual(nyx.RelayStatus(
+      fingerprint = '9695DFC35FFEB861329B9F1AB04C46397020CE31',
+      nickname = 'moria1',
+      address = '128.31.0.34',
+      or_port = 9101,
+      dir_port = 9131,
+      published = datetime.datetime(2012, 8, 6, 11, 19, 31),
+      flags = ('Authority', 'Fast', 'Running', 'Stable', 'V2Dir', 'Valid'),
+      bandwidth = None,
+    ), tracker.get_relay_status('9695DFC35FFEB861329B9F1AB04C46397020CE31'))
+
+    self.assertEqual(None, tracker.get_relay_status('6E2D2A9359544EA409B4C154C174458F8864273D'))
+    self.assertEqual(None, tracker.get_relay_status(None))
+
+    # status is read from our cache rather than tor
+
+    self.assertFalse(tor_controller_mock().get_network_status.called)
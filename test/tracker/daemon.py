@@ -78,3 +78,19 @@ class TestDaemon(unittest.TestCase):
       daemon.set_paused(False)
       time.sleep(0.2)
       self.assertTrue(2 < daemon.run_counter())
+
+  @patch('nyx.tracker.tor_controller', Mock(return_value = Mock()))
+  @patch('nyx.tracker.system', Mock(return_value = Mock()))
+  def test_stopping_daemon(self):
+    # Stopping shouldn't need to wait for our next run.
+
+    daemon = Daemon(60)
+    daemon.start()
+    time.sleep(0.01)
+
+    start_time = time.time()
+    daemon.stop()
+    daemon.join()
+
+    self.assertTrue(time.time() - start_time < 0.1)
+    self.assertEqual(1, daemon.run_counter())
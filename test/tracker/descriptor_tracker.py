@@ -0,0 +1,104 @@
+import datetime
+import unittest
+
+from nyx.tracker import DescriptorTracker, RelayDescriptors, UnresolvedResult
+
+try:
+  # added in python 3.3
+  from unittest.mock import Mock, patch
+except ImportError:
+  from mock import Mock, patch
+
+MORIA1 = '9695DFC35FFEB861329B9F1AB04C46397020CE31'
+CAERSIDI = '3EA8E960F6B94CE30062AA8EF02894C00F8D1E66'
+TIMEOUT = 5
+
+
+class TestDescriptorTracker(unittest.TestCase):
+  @patch('nyx.tracker.get_consensus_tracker', Mock())
+  @patch('nyx.tracker.tor_controller')
+  def test_fetching_descriptors(self, tor_controller_mock):
+    server_descriptors = {MORIA1: Mock(nickname = 'moria1')}
+    tor_controller_mock().get_network_status.side_effect = lambda fingerprint, default: 'r %s' % fingerprint
+    tor_controller_mock().get_server_descriptor.side_effect = lambda fingerprint, default: server_descriptors.get(fingerprint, default)
+    tor_controller_mock().get_microdescriptor.return_value = None
+
+    tracker = DescriptorTracker()
+    fetched = []
+    tracker.add_listener(fetched.append)
+
+    self.assertRaises(UnresolvedResult, tracker.fetch, MORIA1)
+
+    with tracker._pending_cond:  # holds off our worker
+      self.assertEqual({}, tracker.query([MORIA1, CAERSIDI, None]))
+
+    self.assertEqual(RelayDescriptors('r %s' % MORIA1, server_descriptors[MORIA1], None), tracker.fetch(MORIA1, TIMEOUT))
+    self.assertEqual(RelayDescriptors('r %s' % CAERSIDI, None, None), tracker.fetch(CAERSIDI, TIMEOUT))  # tor lacks its server descriptor
+    self.assertEqual(set([MORIA1, CAERSIDI]), set(fetched))
+
+    # cached descriptors are provided without asking tor again
+
+    self.assertEqual(set([MORIA1, CAERSIDI]), set(tracker.query([MORIA1, CAERSIDI]).keys()))
+    self.assertEqual(2, tor_controller_mock().get_server_descriptor.call_count)
+
+  @patch('nyx.tracker.get_consensus_tracker', Mock())
+  @patch('nyx.tracker.tor_controller')
+  def test_fetch_with_timeout(self, tor_controller_mock):
+    tracker = DescriptorTracker()
+
+    # relays we wait for are fetched ahead of prior queries
+
+    with tracker._pending_cond:  # holds off our worker until we're waiting
+      tracker.query([MORIA1, CAERSIDI])
+      self.assertEqual(tor_controller_mock().get_network_status(), tracker.fetch(CAERSIDI, TIMEOUT).router_status_entry)
+
+    self.assertEqual(CAERSIDI, tor_controller_mock().get_server_descriptor.call_args_list[0][0][0])
+
+    # we stop waiting when tor fails to provide descriptors, and don't cache
+    # the failure
+
+    tor_controller_mock().get_network_status.side_effect = OSError('connection closed')
+    self.assertRaises(UnresolvedResult, tracker.fetch, '74A910646BCEEFBCD2E874FC1DC997430F968145', TIMEOUT)
+    self.assertFalse('74A910646BCEEFBCD2E874FC1DC997430F968145' in tracker._cache)
+
+  @patch('nyx.tracker.get_consensus_tracker', Mock())
+  @patch('nyx.tracker.tor_controller', Mock())
+  @patch('nyx.tracker.DESCRIPTOR_CACHE_SIZE', 2)
+  def test_cache_size(self):
+    tracker = DescriptorTracker()
+
+    tracker.fetch(MORIA1, TIMEOUT)
+    tracker.fetch(CAERSIDI, TIMEOUT)
+    tracker.fetch(MORIA1)  # most recently used
+    tracker.fetch('74A910646BCEEFBCD2E874FC1DC997430F968145', TIMEOUT)
+
+    tracker.fetch(MORIA1)
+    self.assertRaises(UnresolvedResult, tracker.fetch, CAERSIDI)
+
+  @patch('nyx.tracker.get_consensus_tracker')
+  @patch('nyx.tracker.tor_controller')
+  def test_republished_descriptors(self, tor_controller_mock, consensus_tracker_mock):
+    published = datetime.datetime(2026, 10, 16, 12, 0, 0)
+    consensus_tracker_mock().get_relay_status.side_effect = lambda fingerprint: Mock(published = published)
+    tor_controller_mock().get_network_status.side_effect = lambda fingerprint, default: 'r %s %s' % (fingerprint, published)
+
+    tracker = DescriptorTracker()
+    self.assertEqual('r %s %s' % (MORIA1, published), tracker.fetch(MORIA1, TIMEOUT).router_status_entry)
+
+    # a consensus listing a newer descriptor makes us fetch it again
+
+    published = datetime.datetime(2026, 10, 16, 13, 0, 0)
+    self.assertRaises(UnresolvedResult, tracker.fetch, MORIA1)
+    self.assertEqual({}, tracker.query([MORIA1]))
+    self.assertEqual('r %s %s' % (MORIA1, published), tracker.fetch(MORIA1, TIMEOUT).router_status_entry)
+
+  @patch('nyx.tracker.get_consensus_tracker', Mock())
+  @patch('nyx.tracker.tor_controller', Mock())
+  def test_query_replaces_pending(self):
+    tracker = DescriptorTracker()
+
+    with tracker._pending_cond:  # holds off our worker
+      tracker.query([MORIA1, CAERSIDI])
+      tracker.query([CAERSIDI])
+
+      self.assertEqual([CAERSIDI], list(tracker._pending.keys()))
@@ -0,0 +1,38 @@
+import unittest
+
+import stem.exit_policy
+
+from nyx.tracker import ExitPolicyMatcher
+
+
+class TestExitPolicyMatcher(unittest.TestCase):
+  def test_can_exit_to(self):
+    policy = stem.exit_policy.ExitPolicy(
+      'reject 10.0.0.0/8:*',
+      'accept 10.1.0.0/16:80',  # shadowed by the prior rule
+      'reject 75.119.206.0/24:1-1024',
+      'accept6 [2001:db8::]/32:443',
+      'reject6 [::1]:*',
+      'accept *:22',
+      'accept *:80-443',
+      'reject *:*',
+    )
+
+    matcher = ExitPolicyMatcher(policy, cache_size = 4)
+
+    destinations = [(address, port) for address in ('10.1.2.3', '75.119.206.243', '75.119.207.1', '2001:db8::1', '::1', '[2001:db9::1]') for port in (22, 80, 443, 2000)]
+
+    for address, port in destinations:
+      self.assertEqual(policy.can_exit_to(address, port), matcher.can_exit_to(address, port), 'mismatch for %s:%i' % (address, port))
+
+    self.assertEqual(4, len(matcher._cache))
+    self.assertRaises(ValueError, matcher.can_exit_to, 'not an address', 80)
+    self.assertFalse(ExitPolicyMatcher(stem.exit_policy.ExitPolicy('reject *:*')).can_exit_to('75.119.206.243', 22))
+
+    # rules tor ignores, and microdescriptor policies that default to reject
+
+    for policy in (stem.exit_policy.ExitPolicy('reject6 75.119.206.243:*', 'accept *:80', 'reject *:*'), stem.exit_policy.MicroExitPolicy('accept 22,80-443'), stem.exit_policy.MicroExitPolicy('reject 25')):
+      matcher = ExitPolicyMatcher(policy)
+
+      for address, port in destinations:
+        self.assertEqual(policy.can_exit_to(address, port), matcher.can_exit_to(address, port), 'mismatch for %s:%i with %s' % (address, port, policy))
@@ -0,0 +1,145 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import stem
+
+from nyx.tracker import LocaleTracker, _geoip_ranges
+
+try:
+  # added in python 3.3
+  from unittest.mock import patch
+except ImportError:
+  from mock import patch
+
+GEOIP = """\
+# Last updated based on February 7 2018 Maxmind GeoLite2 Country
+16777216,16777471,AU
+16777472,16778239,CN
+2147483648,2147549183,US
+1093926912,1093927167,DE
+-5,16777215,XX
+4294967040,4294967296,XX
+"""
+
+GEOIP6 = """\
+# Last updated based on February 7 2018 Maxmind GeoLite2 Country
+2001:200::,2001:200:ffff:ffff:ffff:ffff:ffff:ffff,JP
+2a01:4f8::,2a01:4f8:ffff:ffff:ffff:ffff:ffff:ffff,DE
+"""
+
+
+class TestLocaleTracker(unittest.TestCase):
+  def setUp(self):
+    self.data_directory = tempfile.mkdtemp()
+
+    for filename, content in (('geoip', GEOIP), ('geoip6', GEOIP6)):
+      with open(os.path.join(self.data_directory, filename), 'w') as geoip_file:
+        geoip_file.write(content)
+
+  def tearDown(self):
+    shutil.rmtree(self.data_directory)
+
+  def test_geoip_ranges(self):
+    starts, ends, locales = _geoip_ranges(os.path.join(self.data_directory, 'geoip'), socket.AF_INET)
+
+    self.assertEqual([16777216, 16777472, 1093926912, 2147483648], list(starts))
+    self.assertEqual([16777471, 16778239, 1093927167, 2147549183], list(ends))
+    self.assertEqual(['au', 'cn', 'de', 'us'], locales)
+    self.assertEqual(4, starts.itemsize)
+
+    starts, ends, locales = _geoip_ranges(os.path.join(self.data_directory, 'geoip6'), socket.AF_INET6)
+    self.assertEqual(['jp', 'de'], locales)
+
+    self.assertRaises(IOError, _geoip_ranges, os.path.join(self.data_directory, 'nonexistent'), socket.AF_INET)
+
+  @patch('nyx.tracker.tor_controller')
+  def test_local_lookups(self, tor_controller_mock):
+    tor_controller_mock().is_localhost.return_value = True
+    tor_controller_mock().get_conf.side_effect = lambda option, default = None: os.path.join(self.data_directory, {'GeoIPFile': 'geoip', 'GeoIPv6File': 'geoip6'}[option])
+
+    tracker = LocaleTracker()
+
+    self.assertEqual('au', tracker.get_locale('1.0.0.1'))
+    self.assertEqual('cn', tracker.get_locale('1.0.3.255'))
+    self.assertEqual('de', tracker.get_locale('65.52.0.10'))
+    self.assertEqual('us', tracker.get_locale('128.0.255.255'))
+    self.assertEqual('??', tracker.get_locale('128.1.0.0'))
+    self.assertEqual('??', tracker.get_locale('0.0.0.1'))
+    self.assertEqual('jp', tracker.get_locale('2001:200::1'))
+    self.assertEqual('de', tracker.get_locale('2a01:4f8:1:2::3'))
+    self.assertEqual('??', tracker.get_locale('2a02::1'))
+
+    self.assertEqual({'1.0.0.1': 'au', '2001:200::1': 'jp'}, tracker.get_locales(['1.0.0.1', '2001:200::1']))
+    self.assertFalse(tor_controller_mock().get_info.called)
+
+  @patch('nyx.tracker.tor_controller')
+  def test_tor_lookups(self, tor_controller_mock):
+    # when tor isn't local we ask it instead
+
+    tor_controller_mock().is_localhost.return_value = False
+    tor_controller_mock().get_info.return_value = {'ip-to-country/1.0.0.1': 'au', 'ip-to-country/2001:200::1': 'jp'}
+
+    tracker = LocaleTracker()
+    self.assertEqual({'1.0.0.1': 'au', '2001:200::1': 'jp'}, tracker.get_locales(['1.0.0.1', '2001:200::1', '1.0.0.1']))
+    self.assertEqual(1, tor_controller_mock().get_info.call_count)
+
+    # responses are cached
+
+    self.assertEqual('au', tracker.get_locale('1.0.0.1'))
+    self.assertEqual(1, tor_controller_mock().get_info.call_count)
+
+    tor_controller_mock().get_info.return_value = {}
+    self.assertEqual(None, tracker.get_locale('128.1.0.0'))
+
+  @patch('nyx.tracker.tor_controller')
+  def test_tor_rejecting_addresses(self, tor_controller_mock):
+    locales = {'ip-to-country/1.0.0.1': 'au', 'ip-to-country/2001:200::1': 'jp'}
+
+    def get_info(keys):
+      if isinstance(keys, list):
+        if any(key not in locales for key in keys):
+          raise stem.InvalidArguments('552', 'Unrecognized key')
+
+        return dict([(key, locales[key]) for key in keys])
+      elif keys in locales:
+        return locales[keys]
+      else:
+        raise stem.InvalidArguments('552', 'Unrecognized key')
+
+    tor_controller_mock().is_localhost.return_value = False
+    tor_controller_mock().get_info.side_effect = get_info
+
+    # tor rejects the batch due to one address, so we ask for each
+
+    tracker = LocaleTracker()
+    self.assertEqual({'1.0.0.1': 'au', '2001:200::1': 'jp'}, tracker.get_locales(['1.0.0.1', '2001:200::1', 'invalid']))
+    self.assertEqual(4, tor_controller_mock().get_info.call_count)
+
+    # addresses tor can't resolve aren't asked about again
+
+    self.assertEqual({}, tracker.get_locales(['invalid']))
+    self.assertEqual(None, tracker.get_locale('invalid'))
+    self.assertEqual(4, tor_controller_mock().get_info.call_count)
+
+    # nor are any cached when we can't reach tor
+
+    tor_controller_mock().get_info.side_effect = stem.SocketClosed()
+    self.assertEqual({}, tracker.get_locales(['128.1.0.0']))
+
+    tor_controller_mock().get_info.side_effect = get_info
+    locales['ip-to-country/128.1.0.0'] = '??'
+    self.assertEqual({'128.1.0.0': '??'}, tracker.get_locales(['128.1.0.0']))
+
+  @patch('nyx.tracker.tor_controller')
+  def test_unreadable_geoip_file(self, tor_controller_mock):
+    tor_controller_mock().is_localhost.return_value = True
+    tor_controller_mock().get_conf.side_effect = lambda option, default = None: os.path.join(self.data_directory, 'nonexistent') if option == 'GeoIPFile' else os.path.join(self.data_directory, 'geoip6')
+    tor_controller_mock().get_info.return_value = {'ip-to-country/1.0.0.1': 'au'}
+
+    tracker = LocaleTracker()
+    self.assertEqual('au', tracker.get_locale('1.0.0.1'))
+    self.assertEqual('jp', tracker.get_locale('2001:200::1'))
+    self.assertEqual(1, tor_controller_mock().get_info.call_count)
@@ -1,7 +1,12 @@
+import os
+import shutil
+import tempfile
 import time
 import unittest
 
-from nyx.tracker import Process, PortUsageTracker, _process_for_ports
+import nyx.tracker
+
+from nyx.tracker import Process, PortUsageTracker, SocketOwnerIndex, UnknownApplication, UnresolvedResult, _process_for_ports, _process_for_ports_via_proc
 
 try:
   # added in python 3.3
@@ -88,6 +93,7 @@ class TestPortUsageTracker(unittest.TestCase):
   @patch('nyx.tracker.tor_controller')
   @patch('nyx.tracker._process_for_ports')
   @patch('nyx.tracker.system', Mock(return_value = Mock()))
+  @patch('nyx.tracker.proc.is_available', Mock(return_value = False))
   def test_fetching_samplings(self, process_for_ports_mock, tor_controller_mock):
     tor_controller_mock().get_pid.return_value = 12345
     process_for_ports_mock.return_value = {37277: 'python', 51849: 'tor'}
@@ -103,6 +109,7 @@ class TestPortUsageTracker(unittest.TestCase):
   @patch('nyx.tracker.tor_controller')
   @patch('nyx.tracker._process_for_ports')
   @patch('nyx.tracker.system', Mock(return_value = Mock()))
+  @patch('nyx.tracker.proc.is_available', Mock(return_value = False))
   def test_resolver_failover(self, process_for_ports_mock, tor_controller_mock):
     tor_controller_mock().get_pid.return_value = 12345
     process_for_ports_mock.side_effect = IOError()
@@ -119,3 +126,167 @@ class TestPortUsageTracker(unittest.TestCase):
       self.assertTrue(daemon.is_alive())
       time.sleep(0.1)
       self.assertFalse(daemon.is_alive())
+
+  @patch('nyx.tracker.tor_controller')
+  @patch('nyx.tracker._process_for_ports')
+  @patch('nyx.tracker._process_for_ports_via_proc', Mock(side_effect = IOError()))
+  @patch('nyx.tracker.system', Mock(return_value = Mock()))
+  @patch('nyx.tracker.proc.is_available', Mock(return_value = True))
+  def test_failing_over_to_lsof(self, process_for_ports_mock, tor_controller_mock):
+    tor_controller_mock().get_pid.return_value = 12345
+    process_for_ports_mock.return_value = {37277: 'python'}
+
+    with PortUsageTracker(0.01) as daemon:
+      self.assertEqual(True, daemon._use_proc)
+      self.assertEqual({}, daemon.query([37277], []))
+
+      while not daemon.query([37277], []):
+        time.sleep(0.01)
+
+      self.assertEqual(False, daemon._use_proc)
+      self.assertEqual({37277: 'python'}, daemon.query([37277], []))
+
+  def test_socket_owner_index(self):
+    proc_path = tempfile.mkdtemp()
+
+    def add_fd(pid, fd, target):
+      fd_dir = os.path.join(proc_path, str(pid), 'fd')
+
+      if not os.path.exists(fd_dir):
+        os.makedirs(fd_dir)
+
+        with open(os.path.join(proc_path, str(pid), 'comm'), 'w') as comm_file:
+          comm_file.write('proc%i\n' % pid)
+
+      os.symlink(target, os.path.join(fd_dir, str(fd)))
+
+    try:
+      add_fd(2001, 0, '/dev/null')
+      add_fd(2001, 14, 'socket:[14048]')
+      add_fd(2462, 3, 'socket:[14047]')
+
+      index = SocketOwnerIndex(proc_path)
+      index.refresh()
+
+      self.assertEqual(Process(2001, 'proc2001'), index.owner(14048))
+      self.assertEqual(Process(2462, 'proc2462'), index.owner(14047))
+      self.assertEqual(None, index.owner(22023))
+
+      # only new descriptors are read when refreshing
+
+      add_fd(3444, 3, 'socket:[22023]')
+
+      with patch('os.readlink', Mock(side_effect = os.readlink)) as readlink_mock:
+        index.refresh()
+        self.assertEqual(1, readlink_mock.call_count)
+
+      self.assertEqual(Process(3444, 'proc3444'), index.owner(22023))
+
+      # reusing a descriptor number is caught when we reread
+
+      os.remove(os.path.join(proc_path, '2462', 'fd', '3'))
+      add_fd(2462, 3, 'socket:[22099]')
+      index.refresh()
+
+      self.assertEqual(None, index.owner(14047))
+      self.assertEqual(None, index.owner(22099))
+
+      index.refresh(reread = True)
+      self.assertEqual(Process(2462, 'proc2462'), index.owner(22099))
+
+      # looking up an unknown socket rereads everything, but only the first
+      # time while it's open
+
+      with patch('os.readlink', Mock(side_effect = os.readlink)) as readlink_mock:
+        self.assertEqual({22099: Process(2462, 'proc2462'), 31337: None}, index.owners([22099, 31337], set([22099, 31337])))
+        self.assertEqual(6, readlink_mock.call_count)  # checking 22099 twice, plus our four descriptors
+
+        readlink_mock.reset_mock()
+        self.assertEqual({31337: None}, index.owners([31337], set([22099, 31337])))
+        self.assertEqual(0, readlink_mock.call_count)
+
+        # but we look again if it's a new socket with the same inode
+
+        index.owners([], set([22099]))
+        index.owners([31337], set([22099, 31337]))
+        self.assertEqual(4, readlink_mock.call_count)
+
+      # processes that exit are dropped
+
+      shutil.rmtree(os.path.join(proc_path, '3444'))
+      index.refresh()
+
+      self.assertEqual(None, index.owner(22023))
+    finally:
+      shutil.rmtree(proc_path)
+
+  @patch('nyx.tracker._tcp_sockets')
+  def test_process_for_ports_via_proc(self, tcp_sockets_mock):
+    tcp_sockets_mock.return_value = [
+      (9051, 37277, 14048),
+      (9051, 51849, 22024),
+      (37277, 9051, 14047),
+      (51849, 9051, 22023),
+    ]
+
+    owners = {14047: Process(2462, 'python'), 22024: Process(2001, 'tor')}
+
+    index = Mock()
+    index.owners.side_effect = lambda inodes, live_inodes: dict([(inode, owners.get(inode)) for inode in inodes])
+
+    with patch('nyx.tracker.SOCKET_OWNER_INDEX', index):
+      self.assertEqual({37277: Process(2462, 'python'), 51849: Process(2001, 'tor'), 80: None}, _process_for_ports_via_proc([37277, 80], [51849]))
+      self.assertEqual(set([14048, 22024, 14047, 22023]), index.owners.call_args[0][1])
+
+    self.assertEqual(None, nyx.tracker.SOCKET_OWNER_INDEX)
+
+  @patch('nyx.tracker.tor_controller', Mock())
+  @patch('nyx.tracker._process_for_ports')
+  @patch('nyx.tracker.proc.is_available', Mock(return_value = False))
+  def test_port_cache(self, process_for_ports_mock):
+    process_for_ports_mock.return_value = {37277: Process(2462, 'python'), 51849: None}
+    daemon = PortUsageTracker(5)
+
+    # requests are deduplicated, and only queued when not cached
+
+    self.assertEqual({}, daemon.query([37277, 37277], [51849]))
+    self.assertEqual({}, daemon.query([37277], [51849]))
+    self.assertRaises(UnresolvedResult, daemon.fetch, 37277)
+
+    self.assertTrue(daemon._task(None, None))
+    process_for_ports_mock.assert_called_once_with([37277], [51849])
+
+    self.assertEqual({37277: Process(2462, 'python'), 51849: None}, daemon.query([37277], [51849]))
+    self.assertTrue(daemon._task(None, None))
+    self.assertEqual(1, process_for_ports_mock.call_count)
+
+    self.assertEqual(Process(2462, 'python'), daemon.fetch(37277))
+    self.assertRaises(UnknownApplication, daemon.fetch, 51849)
+
+    # unknown applications expire sooner, but are provided until replaced
+
+    with patch('time.time', Mock(return_value = time.time() + nyx.tracker.PORT_USAGE_UNKNOWN_TTL + 1)):
+      self.assertEqual({37277: Process(2462, 'python'), 51849: None}, daemon.query([37277], [51849]))
+      self.assertTrue(daemon._task(None, None))
+      process_for_ports_mock.assert_called_with([], [51849])
+
+    # failed lookups are retried
+
+    process_for_ports_mock.side_effect = IOError()
+    daemon.query([80], [])
+    self.assertFalse(daemon._task(None, None))
+    self.assertFalse(daemon._task(None, None))
+    process_for_ports_mock.assert_called_with([80], [])
+
+    # least recently used entries are evicted
+
+    process_for_ports_mock.side_effect = None
+    process_for_ports_mock.return_value = {80: None}
+
+    with patch('nyx.tracker.PORT_USAGE_CACHE_SIZE', 2):
+      daemon.fetch(37277)
+      self.assertTrue(daemon._task(None, None))
+
+    self.assertEqual(Process(2462, 'python'), daemon.fetch(37277))
+    self.assertRaises(UnknownApplication, daemon.fetch, 80)
+    self.assertRaises(UnresolvedResult, daemon.fetch, 51849)
@@ -1,7 +1,12 @@
+import os
+import shutil
+import tempfile
 import time
 import unittest
 
-from nyx.tracker import ResourceTracker, _resources_via_ps, _resources_via_proc
+import nyx.tracker
+
+from nyx.tracker import ProcSampler, ResourceTracker, RingBuffer, _resources_via_ps, _resources_via_proc
 
 try:
   # added in python 3.3
@@ -14,6 +19,27 @@ PS_OUTPUT = """\
 00:00:02       00:18 18848  0.4
 """
 
+PROC_STAT = b'12345 (tor (relay)) S 1 12345 12345 0 -1 4194560 5612 0 0 0 150 50 0 0 20 0 1 0 1000 47968256 4713 0\n'
+
+PROC_STATUS = b"""\
+Name:\ttor
+State:\tS (sleeping)
+VmPeak:\t   47968 kB
+VmRSS:\t   18848 kB
+Threads:\t1
+"""
+
+PROC_MEMINFO = b"""\
+MemTotal:        4712000 kB
+MemFree:          512000 kB
+"""
+
+PROC_SYSTEM_STAT = b"""\
+cpu  81934 120 30239 3410293 4120 0 1422 0 0 0
+btime 1388967000
+processes 83721
+"""
+
 
 class TestResourceTracker(unittest.TestCase):
   @patch('nyx.tracker.tor_controller')
@@ -125,6 +151,53 @@ class TestResourceTracker(unittest.TestCase):
       self.assertEqual(0.3, resources.memory_percent)
       self.assertTrue((time.time() - resources.timestamp) < 0.5)
 
+  @patch('nyx.tracker.proc.is_available', Mock(return_value = True))
+  @patch('nyx.tracker.tor_controller', Mock())
+  def test_sample_percentiles(self):
+    daemon = ResourceTracker(5, 0.25)
+    self.assertEqual(0.25, daemon.get_rate())
+
+    # usage of a tenth of a cpu (0.025 seconds of cpu per quarter second
+    # sampling) except for a spike
+
+    cpu_total = 10.0
+
+    for i in range(40):
+      cpu_total += 1.0 if i == 37 else 0.025
+      cpu_sample, cpu_usage = daemon._buffer_sample(cpu_total, 100.0 + i * 0.25)
+
+    cpu_usage.sort()
+
+    self.assertEqual(20, len(cpu_usage))
+    self.assertAlmostEqual(0.1, nyx.tracker._percentile(cpu_usage, 0.5))
+    self.assertAlmostEqual(0.1, nyx.tracker._percentile(cpu_usage, 0.95))
+    self.assertAlmostEqual(4.0, cpu_usage[-1])
+    self.assertAlmostEqual((1.0 + 3 * 0.025) / 1.0, cpu_sample)
+
+  @patch('nyx.tracker.proc.is_available', Mock(return_value = False))
+  @patch('nyx.tracker.tor_controller', Mock())
+  def test_sample_percentiles_without_proc(self):
+    daemon = ResourceTracker(5, 0.25)
+
+    self.assertEqual(5, daemon.get_rate())
+    self.assertEqual(None, daemon._sample_times)
+
+  def test_ring_buffer(self):
+    buffer = RingBuffer(3)
+    self.assertEqual([], buffer.values())
+
+    buffer.append(1)
+    buffer.append(2)
+    self.assertEqual([1.0, 2.0], buffer.values())
+
+    buffer.append(3)
+    buffer.append(4)
+    self.assertEqual([2.0, 3.0, 4.0], buffer.values())
+    self.assertEqual(3, len(buffer))
+
+    buffer.clear()
+    self.assertEqual([], buffer.values())
+
   @patch('nyx.tracker.system.call', Mock(return_value = PS_OUTPUT.split('\n')))
   def test_resources_via_ps(self):
     total_cpu_time, uptime, memory_in_bytes, memory_in_percent = _resources_via_ps(12345)
@@ -134,14 +207,54 @@ class TestResourceTracker(unittest.TestCase):
     self.assertEqual(19300352, memory_in_bytes)
     self.assertEqual(0.004, memory_in_percent)
 
+  @patch('nyx.tracker.ProcSampler')
+  def test_resources_via_proc(self, proc_sampler_mock):
+    proc_sampler_mock.return_value.pid = 12345
+    proc_sampler_mock.return_value.sample.return_value = (2.0, 18.0, 19300352, 0.004)
+
+    try:
+      self.assertEqual((2.0, 18.0, 19300352, 0.004), _resources_via_proc(12345))
+      self.assertEqual((2.0, 18.0, 19300352, 0.004), _resources_via_proc(12345))
+
+      # our sampler is reused until the pid changes
+
+      proc_sampler_mock.assert_called_once_with(12345)
+      self.assertEqual(2, proc_sampler_mock.return_value.sample.call_count)
+
+      proc_sampler_mock.return_value.sample.side_effect = IOError('process is gone')
+      self.assertRaises(IOError, _resources_via_proc, 12345)
+      self.assertEqual(None, nyx.tracker.PROC_SAMPLER)
+    finally:
+      nyx.tracker.PROC_SAMPLER = None
+
   @patch('time.time', Mock(return_value = 1388967218.973117))
-  @patch('nyx.tracker.proc.stats', Mock(return_value = (1.5, 0.5, 1388967200.9)))
-  @patch('nyx.tracker.proc.memory_usage', Mock(return_value = (19300352, 6432)))
-  @patch('nyx.tracker.proc.physical_memory', Mock(return_value = 4825088000))
-  def test_resources_via_proc(self):
-    total_cpu_time, uptime, memory_in_bytes, memory_in_percent = _resources_via_proc(12345)
+  @patch('os.sysconf', Mock(return_value = 100))
+  def test_proc_sampler(self):
+    proc_path = tempfile.mkdtemp()
 
-    self.assertEqual(2.0, total_cpu_time)
-    self.assertEqual(18, int(uptime))
-    self.assertEqual(19300352, memory_in_bytes)
-    self.assertEqual(0.004, memory_in_percent)
+    try:
+      os.mkdir(os.path.join(proc_path, '12345'))
+
+      for path, content in (('12345/stat', PROC_STAT), ('12345/status', PROC_STATUS), ('meminfo', PROC_MEMINFO), ('stat', PROC_SYSTEM_STAT)):
+        with open(os.path.join(proc_path, path), 'wb') as proc_file:
+          proc_file.write(content)
+
+      sampler = ProcSampler(12345, proc_path)
+      total_cpu_time, uptime, memory_in_bytes, memory_in_percent = sampler.sample()
+
+      self.assertEqual(2.0, total_cpu_time)
+      self.assertEqual(208, int(uptime))
+      self.assertEqual(19300352, memory_in_bytes)
+      self.assertEqual(0.004, memory_in_percent)
+
+      # contents are re-read from our open files
+
+      with open(os.path.join(proc_path, '12345/status'), 'wb') as proc_file:
+        proc_file.write(PROC_STATUS.replace(b'18848', b'37696'))
+
+      self.assertEqual(38600704, sampler.sample()[2])
+      sampler.close()
+    finally:
+      shutil.rmtree(proc_path)
+
+    self.assertRaises(IOError, ProcSampler, 12345, proc_path)